@@ -2,6 +2,39 @@
  * Audio processing client for bidirectional audio AI communication
  */
 
+// Codec ids in the binary frame header (framing.py / audio_codecs.py)
+const CODEC_IDS = { 'pcm16': 0, 'mulaw': 1, 'alaw': 2, 'ima-adpcm': 3, 'opus': 4 };
+
+// IMA ADPCM as sent by the server: blocks of a 3-byte header plus nibbles
+const ADPCM_BLOCK_SAMPLES = 33;
+const ADPCM_HEADER_BYTES = 3;
+const ADPCM_INDEX_ADJUST = [-1, -1, -1, -1, 2, 4, 6, 8];
+const ADPCM_STEPS = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+];
+
+// G.711 decode tables, built once
+const MULAW_TABLE = new Int16Array(256);
+const ALAW_TABLE = new Int16Array(256);
+for (let i = 0; i < 256; i++) {
+    const u = ~i & 0xff;
+    const exponent = (u >> 4) & 0x07;
+    const magnitude = ((((u & 0x0f) << 3) + 0x84) << exponent) - 0x84;
+    MULAW_TABLE[i] = (u & 0x80) ? -magnitude : magnitude;
+
+    const a = i ^ 0x55;
+    const segment = (a & 0x70) >> 4;
+    let t = (a & 0x0f) << 4;
+    t = segment === 0 ? t + 8 : (t + 0x108) << (segment - 1);
+    ALAW_TABLE[i] = (a & 0x80) ? t : -t;
+}
+
 class AudioClient {
     constructor(serverUrl = 'ws://localhost:8765') {
         this.serverUrl = serverUrl;
@@ -15,6 +48,27 @@ class AudioClient {
         this.maxReconnectAttempts = 3;
         this.sessionId = null;
 
+        // Reconnect token from the server; presenting it resumes the conversation
+        this.resumeToken = null;
+
+        // Seconds a busy server asked us to wait before reconnecting
+        this.retryAfter = null;
+
+        // Audio framing: 'binary' (raw PCM frames) once negotiated, else 'json'
+        this.framing = 'json';
+        this.sendSeq = 0;
+
+        // Flow control: the server asks us to pause sending when its buffer fills
+        this.isPaused = false;
+
+        // Model audio codecs we can decode, most compact first. Opus needs
+        // WebCodecs and a separate playback path, so it is not requested.
+        this.acceptCodecs = ['ima-adpcm', 'mulaw', 'alaw', 'pcm16'];
+
+        // Rate the microphone is actually captured at; browsers may ignore the
+        // 16 kHz we ask for, in which case the server resamples
+        this.inputSampleRate = 16000;
+
         // Callbacks
         this.onReady = () => {};
         this.onAudioReceived = () => {};
@@ -23,6 +77,7 @@ class AudioClient {
         this.onError = () => {};
         this.onInterrupted = () => {};
         this.onSessionIdReceived = (sessionId) => {};
+        this.onQueued = (position, eta) => {};
 
         // Audio playback
         this.audioQueue = [];
@@ -62,7 +117,11 @@ class AudioClient {
 
         return new Promise((resolve, reject) => {
             try {
-                this.ws = new WebSocket(this.serverUrl);
+                this.ws = new WebSocket(this._connectUrl());
+                this.ws.binaryType = 'arraybuffer';
+                this.framing = 'json';
+                this.sendSeq = 0;
+                this.isPaused = false;
 
                 const connectionTimeout = setTimeout(() => {
                     if (!this.isConnected) {
@@ -97,19 +156,55 @@ class AudioClient {
 
                 this.ws.onmessage = async (event) => {
                     try {
+                        // Binary frames carry model audio in the negotiated codec
+                        if (event.data instanceof ArrayBuffer) {
+                            const audioData = this._decodeAudioFrame(event.data);
+                            if (audioData) {
+                                this.onAudioReceived(audioData);
+                                await this.playAudio(audioData);
+                            }
+                            return;
+                        }
+
                         // Log raw message data to help debug
                         console.log('Raw WebSocket message received:', event.data);
 
                         const message = JSON.parse(event.data);
 
                         if (message.type === 'ready') {
+                            if (message.token) {
+                                this.resumeToken = message.token;
+                            }
+                            // Switch to binary audio frames if the server offers them
+                            if (Array.isArray(message.framing) && message.framing.includes('binary')) {
+                                this.ws.send(JSON.stringify({ type: 'framing', mode: 'binary' }));
+                                this.framing = 'binary';
+                            }
+                            // Ask for compressed model audio if the server offers codecs
+                            if (Array.isArray(message.codecs)) {
+                                this.ws.send(JSON.stringify({ type: 'codec', accept: this.acceptCodecs }));
+                            }
+                            this._declareInputFormat();
                             this.isConnected = true;
                             this.onReady();
                             resolve();
                         }
+                        else if (message.type === 'queued') {
+                            // Server is at capacity; we hold a place in its queue
+                            clearTimeout(connectionTimeout);
+                            this.onQueued(message.position, message.eta);
+                        }
+                        else if (message.type === 'rejected') {
+                            // Server is full; it closes the connection next
+                            clearTimeout(connectionTimeout);
+                            this.retryAfter = message.retry_after;
+                            reject(new Error(`Server busy (${message.reason}), retry in ${message.retry_after}s`));
+                        }
                         else if (message.type === 'audio') {
                             // Handle receiving audio data from server
-                            const audioData = message.data;
+                            const audioData = message.codec
+                                ? this._decodeCodec(CODEC_IDS[message.codec], this._base64ToArrayBuffer(message.data))
+                                : message.data;
                             this.onAudioReceived(audioData);
                             await this.playAudio(audioData);
                         }
@@ -127,6 +222,13 @@ class AudioClient {
                             this.isModelSpeaking = false;
                             this.onInterrupted(message.data);
                         }
+                        else if (message.type === 'pause') {
+                            // Server buffer is filling up; stop sending audio
+                            this.isPaused = true;
+                        }
+                        else if (message.type === 'resume') {
+                            this.isPaused = false;
+                        }
                         else if (message.type === 'error') {
                             // Handle server error
                             this.onError(message.data);
@@ -148,6 +250,16 @@ class AudioClient {
         });
     }
 
+    // Server URL, carrying the resume token when reconnecting
+    _connectUrl() {
+        if (!this.resumeToken) {
+            return this.serverUrl;
+        }
+        const url = new URL(this.serverUrl);
+        url.searchParams.set('token', this.resumeToken);
+        return url.toString();
+    }
+
     // Try to reconnect with exponential backoff
     async tryReconnect() {
         if (this.reconnectAttempts >= this.maxReconnectAttempts) {
@@ -156,7 +268,12 @@ class AudioClient {
         }
 
         this.reconnectAttempts++;
-        const backoffTime = Math.min(1000 * Math.pow(2, this.reconnectAttempts), 10000);
+        let backoffTime = Math.min(1000 * Math.pow(2, this.reconnectAttempts), 10000);
+        // A busy server says when to come back
+        if (this.retryAfter) {
+            backoffTime = Math.max(backoffTime, this.retryAfter * 1000);
+            this.retryAfter = null;
+        }
 
         console.log(`Attempting to reconnect in ${backoffTime}ms (attempt ${this.reconnectAttempts})`);
 
@@ -188,6 +305,9 @@ class AudioClient {
                 window.existingAudioContexts.push(this.audioContext);
             }
 
+            this.inputSampleRate = this.audioContext.sampleRate;
+            this._declareInputFormat();
+
             // Create MediaStreamSource
             const source = this.audioContext.createMediaStreamSource(stream);
             
@@ -207,14 +327,18 @@ class AudioClient {
                 }
                 
                 // Send to server if connected
-                if (this.isConnected && this.isRecording) {
-                    const audioBuffer = new Uint8Array(int16Data.buffer);
-                    const base64Audio = this._arrayBufferToBase64(audioBuffer);
-                    
-                    this.ws.send(JSON.stringify({
-                        type: 'audio',
-                        data: base64Audio
-                    }));
+                if (this.isConnected && this.isRecording && !this.isPaused) {
+                    if (this.framing === 'binary') {
+                        this.ws.send(this._encodeAudioFrame(int16Data.buffer, this.inputSampleRate));
+                    } else {
+                        const audioBuffer = new Uint8Array(int16Data.buffer);
+                        const base64Audio = this._arrayBufferToBase64(audioBuffer);
+
+                        this.ws.send(JSON.stringify({
+                            type: 'audio',
+                            data: base64Audio
+                        }));
+                    }
                 }
             };
             
@@ -268,11 +392,11 @@ class AudioClient {
         }
     }
     
-    // Decode and play received audio
-    async playAudio(base64Audio) {
+    // Decode and play received audio (base64 string or raw PCM ArrayBuffer)
+    async playAudio(audio) {
         try {
             // Decode the base64 audio data
-            const audioData = this._base64ToArrayBuffer(base64Audio);
+            const audioData = typeof audio === 'string' ? this._base64ToArrayBuffer(audio) : audio;
 
             // Create an audio context if needed
             if (!this.audioContext || this.audioContext.state === 'closed') {
@@ -403,8 +527,9 @@ class AudioClient {
     close() {
         this.stopRecording();
 
-        // Reset session ID
+        // Reset session ID; a deliberate close starts a new conversation next time
         this.sessionId = null;
+        this.resumeToken = null;
 
         // Stop any audio playback
         this.interrupt();
@@ -446,6 +571,96 @@ class AudioClient {
         this.isConnected = false;
     }
     
+    // Utility: Tell the server our capture rate if it isn't the native 16 kHz
+    _declareInputFormat() {
+        if (this.inputSampleRate === 16000 || !this.ws || this.ws.readyState !== WebSocket.OPEN) {
+            return;
+        }
+        this.ws.send(JSON.stringify({
+            type: 'format',
+            sample_rate: this.inputSampleRate,
+            channels: 1,
+            encoding: 'int16'
+        }));
+    }
+
+    // Utility: Build a binary audio frame (8-byte header + PCM payload)
+    _encodeAudioFrame(pcmBuffer, sampleRate) {
+        const frame = new ArrayBuffer(8 + pcmBuffer.byteLength);
+        const view = new DataView(frame);
+        view.setUint8(0, 1);              // kind: audio
+        view.setUint8(1, 0);              // codec: 16-bit PCM
+        // sample rate (big-endian); 0 when it does not fit the 16-bit field,
+        // which leaves the rate to the format message
+        view.setUint16(2, sampleRate <= 0xFFFF ? sampleRate : 0);
+        view.setUint32(4, this.sendSeq);  // sequence number
+        this.sendSeq = (this.sendSeq + 1) >>> 0;
+        new Uint8Array(frame, 8).set(new Uint8Array(pcmBuffer));
+        return frame;
+    }
+
+    // Utility: Extract the payload of a binary audio frame as 16-bit PCM
+    _decodeAudioFrame(frame) {
+        if (frame.byteLength < 8) return null;
+        const view = new DataView(frame);
+        if (view.getUint8(0) !== 1) return null;
+        return this._decodeCodec(view.getUint8(1), frame.slice(8));
+    }
+
+    // Utility: Decode a model audio payload to a 16-bit PCM ArrayBuffer
+    _decodeCodec(codec, payload) {
+        if (codec === CODEC_IDS.mulaw) {
+            return this._decodeTable(MULAW_TABLE, payload);
+        }
+        if (codec === CODEC_IDS.alaw) {
+            return this._decodeTable(ALAW_TABLE, payload);
+        }
+        if (codec === CODEC_IDS['ima-adpcm']) {
+            return this._decodeAdpcm(payload);
+        }
+        return payload;
+    }
+
+    // Utility: G.711 decode, one table lookup per byte
+    _decodeTable(table, payload) {
+        const codes = new Uint8Array(payload);
+        const pcm = new Int16Array(codes.length);
+        for (let i = 0; i < codes.length; i++) {
+            pcm[i] = table[codes[i]];
+        }
+        return pcm.buffer;
+    }
+
+    // Utility: Decode IMA ADPCM blocks (see audio_codecs.py on the server)
+    _decodeAdpcm(payload) {
+        const view = new DataView(payload);
+        const count = view.getUint32(0, true);
+        const pcm = new Int16Array(count);
+        let offset = 4;
+        let n = 0;
+        while (n < count) {
+            let predictor = view.getInt16(offset, true);
+            let index = view.getUint8(offset + 2);
+            offset += ADPCM_HEADER_BYTES;
+            pcm[n++] = predictor;
+            for (let i = 1; i < ADPCM_BLOCK_SAMPLES; i++) {
+                const byte = view.getUint8(offset + ((i - 1) >> 1));
+                const code = (i & 1) ? (byte & 0x0f) : (byte >> 4);
+                const step = ADPCM_STEPS[index];
+                let diff = step >> 3;
+                if (code & 4) diff += step;
+                if (code & 2) diff += step >> 1;
+                if (code & 1) diff += step >> 2;
+                predictor += (code & 8) ? -diff : diff;
+                predictor = Math.max(-32768, Math.min(32767, predictor));
+                index = Math.max(0, Math.min(88, index + ADPCM_INDEX_ADJUST[code & 7]));
+                if (n < count) pcm[n++] = predictor;
+            }
+            offset += (ADPCM_BLOCK_SAMPLES - 1) >> 1;
+        }
+        return pcm.buffer;
+    }
+
     // Utility: Convert ArrayBuffer to Base64
     _arrayBufferToBase64(buffer) {
         let binary = '';
@@ -0,0 +1,323 @@
+"""
+Classification of ADK live events from their structured fields.
+
+``EventDispatcher`` routes each event from ``Runner.run_live`` to handlers
+for model audio, streamed model text, user transcription, tool calls and
+responses, interruption and turn completion. It reads the event's own
+fields (``content.parts``, ``partial``, ``interrupted``, ``turn_complete``
+and, on ADK versions that have them, ``input_transcription`` and
+``output_transcription``) in a single pass, instead of searching
+``str(event)``, which renders every audio chunk's bytes.
+
+Model text arrives as a run of ``partial`` chunks followed by a final event
+repeating the whole segment. Partial chunks are forwarded as they arrive;
+a final segment is forwarded only when no partial chunks preceded it. The
+per-turn transcript keeps the final segments and replaces their partial
+chunks, so nothing needs deduplicating at the end of the turn.
+
+Set ``RECORD_EVENTS`` to record a live event stream as JSON lines, and run
+this module with ``bench`` to compare dispatch cost with the previous
+string-matching loop on a recording (or on a synthetic stream).
+"""
+
+import argparse
+import asyncio
+import time
+
+from metrics import counter
+
+events_total = counter("adk_events_total", "ADK live events dispatched")
+
+
+class TurnTranscript:
+    """Text for one speaker in one turn, built from partial and final events."""
+
+    def __init__(self):
+        self.segments = []  # Final text of each finished segment
+        self.pending = []  # Partial chunks of the segment in progress
+
+    def add(self, text, partial):
+        """Add text; returns True if it is new (not a final repeat of partials)."""
+        if partial:
+            self.pending.append(text)
+            return True
+        repeat = bool(self.pending)
+        self.pending.clear()
+        self.segments.append(text)
+        return not repeat
+
+    def text(self):
+        if self.pending:
+            return " ".join([*self.segments, "".join(self.pending)])
+        return " ".join(self.segments)
+
+    def clear(self):
+        self.segments.clear()
+        self.pending.clear()
+
+
+class EventDispatcher:
+    """Dispatch ADK live events to async handlers, one session's stream."""
+
+    def __init__(
+        self,
+        on_audio=None,
+        on_text=None,
+        on_input_text=None,
+        on_tool_call=None,
+        on_tool_response=None,
+        on_interrupted=None,
+        on_turn_complete=None,
+    ):
+        """
+        Args:
+            on_audio: called with the PCM bytes of each model audio part
+            on_text: called with model text as it streams
+            on_input_text: called with each piece of user transcription
+            on_tool_call: called with each ``FunctionCall``
+            on_tool_response: called with each ``FunctionResponse``
+            on_interrupted: called once per interrupted turn
+            on_turn_complete: called with (interrupted, input text, output
+                text) when a turn ends
+
+        Handlers are async callables; any may be None.
+        """
+        self.on_audio = on_audio
+        self.on_text = on_text
+        self.on_input_text = on_input_text
+        self.on_tool_call = on_tool_call
+        self.on_tool_response = on_tool_response
+        self.on_interrupted = on_interrupted
+        self.on_turn_complete = on_turn_complete
+        self.input = TurnTranscript()
+        self.output = TurnTranscript()
+        self.interrupted = False
+
+        # Per-session stats
+        self.events = 0
+        self.audio_parts = 0
+
+    async def dispatch(self, event):
+        """Route one event to its handlers."""
+        self.events += 1
+        events_total.inc()
+        partial = bool(event.partial)
+
+        content = event.content
+        if content is not None and content.parts:
+            from_user = content.role == "user"
+            for part in content.parts:
+                if part.inline_data is not None:
+                    self.audio_parts += 1
+                    if self.on_audio is not None:
+                        await self.on_audio(part.inline_data.data)
+                elif part.text:
+                    if from_user:
+                        await self._input_text(part.text, partial)
+                    else:
+                        await self._output_text(part.text, partial)
+                elif part.function_call is not None:
+                    if self.on_tool_call is not None:
+                        await self.on_tool_call(part.function_call)
+                elif part.function_response is not None:
+                    if self.on_tool_response is not None:
+                        await self.on_tool_response(part.function_response)
+
+        # Newer ADK versions carry transcriptions in their own fields
+        transcription = getattr(event, "input_transcription", None)
+        if transcription is not None and transcription.text:
+            await self._input_text(transcription.text, not transcription.finished)
+        transcription = getattr(event, "output_transcription", None)
+        if transcription is not None and transcription.text:
+            await self._output_text(transcription.text, not transcription.finished)
+
+        if event.interrupted and not self.interrupted:
+            self.interrupted = True
+            if self.on_interrupted is not None:
+                await self.on_interrupted()
+
+        if event.turn_complete:
+            interrupted = self.interrupted
+            input_text = self.input.text()
+            output_text = self.output.text()
+            self.input.clear()
+            self.output.clear()
+            self.interrupted = False
+            if self.on_turn_complete is not None:
+                await self.on_turn_complete(interrupted, input_text, output_text)
+
+    async def _input_text(self, text, partial):
+        if self.input.add(text, partial) and self.on_input_text is not None:
+            await self.on_input_text(text)
+
+    async def _output_text(self, text, partial):
+        if self.output.add(text, partial) and self.on_text is not None:
+            await self.on_text(text)
+
+
+class EventRecorder:
+    """Append events to a file as JSON lines, for replay with ``bench``."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", buffering=1024 * 1024)
+
+    def record(self, event):
+        self.file.write(event.model_dump_json(exclude_none=True))
+        self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+
+def load_events(path):
+    """Load a recorded event stream."""
+    from google.adk.events import Event
+
+    with open(path) as f:
+        return [Event.model_validate_json(line) for line in f if line.strip()]
+
+
+def synthetic_events(turns=20, chunks=50, chunk_bytes=1920, words=30):
+    """
+    An event stream shaped like a live session: per turn, model audio
+    chunks interleaved with partial text, a final text event, user
+    transcription, and turn_complete; every fifth turn is interrupted.
+    """
+    from google.adk.events import Event
+    from google.genai import types
+
+    audio = bytes(range(256)) * (chunk_bytes // 256) + bytes(chunk_bytes % 256)
+    events = []
+    for turn in range(turns):
+        user = types.Content(role="user", parts=[types.Part(text="where is my order")])
+        events.append(Event(author="user", content=user, partial=False))
+        streamed = []
+        for i in range(chunks):
+            part = types.Part(
+                inline_data=types.Blob(data=audio, mime_type="audio/pcm;rate=24000")
+            )
+            events.append(
+                Event(
+                    author="agent",
+                    content=types.Content(role="model", parts=[part]),
+                    partial=True,
+                )
+            )
+            if i % (max(1, chunks // words)) == 0:
+                word = f"word{i} "
+                streamed.append(word)
+                events.append(
+                    Event(
+                        author="agent",
+                        content=types.Content(
+                            role="model", parts=[types.Part(text=word)]
+                        ),
+                        partial=True,
+                    )
+                )
+        events.append(
+            Event(
+                author="agent",
+                content=types.Content(
+                    role="model", parts=[types.Part(text="".join(streamed))]
+                ),
+                partial=False,
+            )
+        )
+        if turn % 5 == 4:
+            events.append(Event(author="agent", interrupted=True))
+        events.append(Event(author="agent", turn_complete=True))
+    return events
+
+
+async def _string_matching_loop(events):
+    # The loop this module replaced, minus the sends, for comparison
+    input_texts = []
+    output_texts = []
+    interrupted = False
+    for event in events:
+        event.get_function_calls()
+        event.get_function_responses()
+        event_str = str(event)
+        if event.content and event.content.parts:
+            for part in event.content.parts:
+                if hasattr(part, "inline_data") and part.inline_data:
+                    await asyncio.sleep(0)
+                if hasattr(part, "text") and part.text:
+                    if hasattr(event.content, "role") and event.content.role == "user":
+                        input_texts.append(part.text)
+                    elif "partial=True" in event_str:
+                        await asyncio.sleep(0)
+                        output_texts.append(part.text)
+        if event.interrupted and not interrupted:
+            interrupted = True
+        if event.turn_complete:
+            " ".join(dict.fromkeys(input_texts))
+            " ".join(dict.fromkeys(output_texts))
+            input_texts = []
+            output_texts = []
+            interrupted = False
+
+
+async def _dispatcher_loop(events):
+    async def sent(*args):
+        await asyncio.sleep(0)
+
+    async def noted(*args):
+        pass
+
+    dispatcher = EventDispatcher(
+        on_audio=sent,
+        on_text=sent,
+        on_input_text=noted,
+        on_tool_call=noted,
+        on_tool_response=noted,
+        on_interrupted=noted,
+        on_turn_complete=noted,
+    )
+    for event in events:
+        await dispatcher.dispatch(event)
+
+
+def benchmark(events, repeat=5):
+    """
+    Time the string-matching loop and the dispatcher over ``events``.
+    Returns {name: microseconds per event}, best of ``repeat`` runs.
+    """
+    results = {}
+    for name, loop in (
+        ("string matching", _string_matching_loop),
+        ("dispatcher", _dispatcher_loop),
+    ):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            asyncio.run(loop(events))
+            best = min(best, time.perf_counter() - start)
+        results[name] = 1e6 * best / len(events)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Compare per-event dispatch cost")
+    bench.add_argument(
+        "--events", help="Recorded stream (RECORD_EVENTS); default: synthetic"
+    )
+    bench.add_argument("--turns", type=int, default=20)
+    bench.add_argument("--chunks", type=int, default=50, help="Audio chunks per turn")
+    bench.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.events:
+        events = load_events(args.events)
+    else:
+        events = synthetic_events(args.turns, args.chunks)
+    print(f"{len(events)} events")
+    for name, per_event in benchmark(events, args.repeat).items():
+        print(f"{name:>16}: {per_event:.1f} µs per event")
+
+
+if __name__ == "__main__":
+    main()
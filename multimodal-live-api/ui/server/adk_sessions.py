@@ -0,0 +1,468 @@
+"""
+ADK session lifecycle and an optional SQLite session store.
+
+The ADK server shares one ``Runner`` between all connections and keeps each
+conversation in an ADK session whose id is a SHA-256 hash of the client's
+reconnect token (see resumption.py), so ids are unique and unguessable and
+the database never holds a token that could resume a conversation.
+``SessionManager``
+tracks which sessions are attached to a connection. When a client
+disconnects its session is kept for an idle TTL so a reconnect with the
+same token picks the conversation up again, then evicted; a session ended
+for inactivity is deleted at once. Memory therefore holds only live and
+recently idle conversations, however many connections a worker serves.
+
+With the in-memory ADK service, eviction deletes the session. With
+``SqliteSessionService`` (``SESSION_DB=path``) the in-memory service is the
+working set and SQLite is written behind it: appended events mark a session
+dirty, and a background task writes dirty sessions, their new events and
+app and user state in one transaction per batch, in a worker thread so the
+event loop never waits on the disk. Eviction then only drops the in-memory
+copy; a later lookup, after a restart too, loads the session back from
+the database. Sessions not updated for ``retention`` seconds can no longer
+be resumed and are purged when the database is opened and with every batch.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+
+from metrics import counter, gauge, histogram
+from scheduler import DeadlineScheduler
+
+APP_NAME = "audio_assistant"
+# Clients are anonymous, so every session belongs to the same ADK user
+USER_ID = "client"
+
+sessions_created = counter("adk_sessions_created_total", "ADK sessions created")
+sessions_resumed = counter(
+    "adk_sessions_resumed_total", "ADK sessions reattached by a reconnecting client"
+)
+sessions_evicted = counter(
+    "adk_sessions_evicted_total", "Idle ADK sessions evicted from memory"
+)
+sessions_loaded = counter(
+    "session_db_sessions_loaded_total", "Sessions loaded back from the session DB"
+)
+db_events_written = counter(
+    "session_db_events_written_total", "Session events written to the session DB"
+)
+db_sessions_purged = counter(
+    "session_db_sessions_purged_total",
+    "Sessions deleted from the session DB after the retention period",
+)
+db_flush_seconds = histogram(
+    "session_db_flush_seconds", "Time to write one batch to the session DB"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    last_update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, id)
+);
+CREATE INDEX IF NOT EXISTS sessions_last_update ON sessions (last_update_time);
+CREATE TABLE IF NOT EXISTS events (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id, seq)
+);
+CREATE TABLE IF NOT EXISTS app_states (
+    app_name TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_states (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (app_name, user_id)
+);
+"""
+
+
+def _dumps(state):
+    return json.dumps(state, default=str)
+
+
+class SqliteSessionService(InMemorySessionService):
+    """In-memory ADK session service with write-behind SQLite persistence."""
+
+    def __init__(self, path, flush_interval=0.5, retention=86400.0):
+        """
+        Args:
+            path: SQLite database file, created if missing
+            flush_interval: seconds changes are batched before being written
+            retention: seconds a session is kept after its last update, 0 to
+                keep sessions forever
+        """
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = retention
+        # The connection is only used from worker threads, one at a time,
+        # under the flush lock
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        with self.db:
+            self._purge()
+        self._dirty = {}  # (app, user, id) -> storage session with unwritten changes
+        self._deleted = set()  # Keys deleted since the last write
+        self._written = {}  # (app, user, id) -> events already in the database
+        self._lock = asyncio.Lock()  # One batch written at a time, in order
+        self._wakeup = asyncio.Event()
+        self._task = None
+        gauge(
+            "session_db_pending_sessions",
+            "Sessions with changes not yet written to the session DB",
+            fn=lambda: len(self._dirty),
+        )
+
+    def _mark(self, app_name, user_id, session_id):
+        key = (app_name, user_id, session_id)
+        session = self.sessions.get(app_name, {}).get(user_id, {}).get(session_id)
+        if session is None:
+            return
+        self._dirty[key] = session
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def create_session(self, *, app_name, user_id, state=None, session_id=None):
+        session = await super().create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+        self._written[(app_name, user_id, session.id)] = 0
+        self._mark(app_name, user_id, session.id)
+        return session
+
+    async def append_event(self, session, event):
+        event = await super().append_event(session, event)
+        if not event.partial:
+            self._mark(session.app_name, session.user_id, session.id)
+        return event
+
+    async def get_session(self, *, app_name, user_id, session_id, config=None):
+        session = await super().get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+        if session is None and await self._load(app_name, user_id, session_id):
+            session = await super().get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+        return session
+
+    async def delete_session(self, *, app_name, user_id, session_id):
+        await super().delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        key = (app_name, user_id, session_id)
+        self._dirty.pop(key, None)
+        self._written.pop(key, None)
+        self._deleted.add(key)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def evict(self, *, app_name, user_id, session_id):
+        """
+        Drop a session from memory only. Unwritten changes are still written
+        by the next batch, and ``get_session`` loads it back on demand.
+        """
+        key = (app_name, user_id, session_id)
+        self.sessions.get(app_name, {}).get(user_id, {}).pop(session_id, None)
+        if key not in self._dirty:
+            self._written.pop(key, None)
+
+    def _cutoff(self):
+        """Oldest last update time of a session still kept."""
+        return time.time() - self.retention if self.retention else 0.0
+
+    async def exists(self, *, app_name, user_id, session_id):
+        """Whether a session is in memory or within retention in the database."""
+        key = (app_name, user_id, session_id)
+        if key in self._deleted:
+            return False
+        if key in self._dirty or session_id in self.sessions.get(app_name, {}).get(
+            user_id, {}
+        ):
+            return True
+        async with self._lock:
+            return await asyncio.to_thread(
+                self._query_exists, app_name, user_id, session_id
+            )
+
+    def _query_exists(self, app_name, user_id, session_id):
+        row = self.db.execute(
+            "SELECT 1 FROM sessions WHERE app_name = ? AND user_id = ? AND id = ? "
+            "AND last_update_time >= ?",
+            (app_name, user_id, session_id, self._cutoff()),
+        ).fetchone()
+        return row is not None
+
+    async def _load(self, app_name, user_id, session_id):
+        # Write anything pending first, so an evicted session whose last
+        # changes are still queued loads complete
+        await self.flush()
+        async with self._lock:
+            loaded = await asyncio.to_thread(self._read, app_name, user_id, session_id)
+        if loaded is None:
+            return False
+        session, app_state, user_state = loaded
+        users = self.sessions.setdefault(app_name, {})
+        if session_id in users.get(user_id, {}):
+            return True  # Loaded concurrently
+        users.setdefault(user_id, {})[session_id] = session
+        self._written[(app_name, user_id, session_id)] = len(session.events)
+        if app_state is not None:
+            self.app_state.setdefault(app_name, app_state)
+        if user_state is not None:
+            self.user_state.setdefault(app_name, {}).setdefault(user_id, user_state)
+        sessions_loaded.inc()
+        return True
+
+    def _read(self, app_name, user_id, session_id):
+        row = self.db.execute(
+            "SELECT state, last_update_time FROM sessions "
+            "WHERE app_name = ? AND user_id = ? AND id = ? AND last_update_time >= ?",
+            (app_name, user_id, session_id, self._cutoff()),
+        ).fetchone()
+        if row is None:
+            return None
+        events = [
+            Event.model_validate_json(event)
+            for (event,) in self.db.execute(
+                "SELECT event FROM events "
+                "WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq",
+                (app_name, user_id, session_id),
+            )
+        ]
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=json.loads(row[0]),
+            events=events,
+            last_update_time=row[1],
+        )
+        app_state = self.db.execute(
+            "SELECT state FROM app_states WHERE app_name = ?", (app_name,)
+        ).fetchone()
+        user_state = self.db.execute(
+            "SELECT state FROM user_states WHERE app_name = ? AND user_id = ?",
+            (app_name, user_id),
+        ).fetchone()
+        return (
+            session,
+            json.loads(app_state[0]) if app_state else None,
+            json.loads(user_state[0]) if user_state else None,
+        )
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let changes accumulate into one batch
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending changes now."""
+        async with self._lock:
+            if not self._dirty and not self._deleted:
+                return
+            # Snapshot on the event loop; the worker thread only serializes
+            # and writes. Events are never modified once appended.
+            rows = []
+            for key, session in self._dirty.items():
+                app_name, user_id, session_id = key
+                start = self._written.get(key, 0)
+                new_events = session.events[start:]
+                rows.append(
+                    (
+                        key,
+                        dict(session.state),
+                        session.last_update_time,
+                        start,
+                        new_events,
+                        dict(self.app_state.get(app_name, {})),
+                        dict(self.user_state.get(app_name, {}).get(user_id, {})),
+                    )
+                )
+                if session_id in self.sessions.get(app_name, {}).get(user_id, {}):
+                    self._written[key] = start + len(new_events)
+                else:
+                    self._written.pop(key, None)  # Evicted or deleted
+            deleted = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+            await asyncio.to_thread(self._write, rows, deleted)
+
+    def _write(self, rows, deleted):
+        start = time.perf_counter()
+        events = 0
+        with self.db:
+            for key in deleted:
+                self.db.execute(
+                    "DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?",
+                    key,
+                )
+                self.db.execute(
+                    "DELETE FROM events "
+                    "WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                    key,
+                )
+            for key, state, updated, seq, new_events, app_state, user_state in rows:
+                app_name, user_id, _ = key
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    (*key, _dumps(state), updated),
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (*key, seq + i, event.model_dump_json(exclude_none=True))
+                        for i, event in enumerate(new_events)
+                    ],
+                )
+                events += len(new_events)
+                if app_state:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO app_states VALUES (?, ?)",
+                        (app_name, _dumps(app_state)),
+                    )
+                if user_state:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO user_states VALUES (?, ?, ?)",
+                        (app_name, user_id, _dumps(user_state)),
+                    )
+            self._purge()
+        db_events_written.inc(events)
+        db_flush_seconds.observe(time.perf_counter() - start)
+
+    def _purge(self):
+        """Delete sessions past retention; runs in a write transaction."""
+        if not self.retention:
+            return
+        cutoff = self._cutoff()
+        self.db.execute(
+            "DELETE FROM events WHERE (app_name, user_id, session_id) IN "
+            "(SELECT app_name, user_id, id FROM sessions WHERE last_update_time < ?)",
+            (cutoff,),
+        )
+        purged = self.db.execute(
+            "DELETE FROM sessions WHERE last_update_time < ?", (cutoff,)
+        ).rowcount
+        db_sessions_purged.inc(purged)
+
+    async def close(self):
+        """Write pending changes and close the database."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self.db.close()
+
+
+def session_id_for(token):
+    """ADK session id of a reconnect token."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionManager:
+    """Open, share and evict the ADK sessions behind client connections."""
+
+    def __init__(self, session_service):
+        """
+        Args:
+            session_service: ADK session service; a ``SqliteSessionService``
+                keeps evicted sessions in its database
+        """
+        self.service = session_service
+        self.scheduler = DeadlineScheduler()  # Eviction deadlines of idle sessions
+        self.attached = set()  # Session ids in use by a connection
+        gauge(
+            "adk_sessions_attached",
+            "ADK sessions attached to a client connection",
+            fn=lambda: len(self.attached),
+        )
+        gauge(
+            "adk_sessions_idle",
+            "Disconnected ADK sessions kept in memory for a reconnect",
+            fn=lambda: len(self.scheduler),
+        )
+
+    async def can_resume(self, token):
+        """Whether a reconnecting client's token names a detached session."""
+        session_id = session_id_for(token)
+        if session_id in self.attached:
+            return False  # Another connection holds it
+        if isinstance(self.service, SqliteSessionService):
+            return await self.service.exists(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+        session = await self.service.get_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+        )
+        return session is not None
+
+    async def open(self, token):
+        """Attach the session for ``token``, creating it if needed."""
+        session_id = session_id_for(token)
+        self.attached.add(session_id)
+        self.scheduler.cancel(session_id)
+        session = await self.service.get_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+        )
+        if session is not None:
+            sessions_resumed.inc()
+            return session
+        sessions_created.inc()
+        return await self.service.create_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+        )
+
+    async def release(self, token, idle_ttl, discard=False):
+        """
+        Detach a session when its connection ends. It is evicted after
+        ``idle_ttl`` seconds, or deleted at once if ``discard`` is set.
+        """
+        session_id = session_id_for(token)
+        self.attached.discard(session_id)
+        if discard:
+            await self.service.delete_session(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+        else:
+            self.scheduler.schedule(session_id, time.monotonic() + idle_ttl, self.evict)
+
+    async def evict(self, session_id):
+        if session_id in self.attached:
+            return  # Reattached since the deadline was set
+        sessions_evicted.inc()
+        if isinstance(self.service, SqliteSessionService):
+            self.service.evict(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+        else:
+            await self.service.delete_session(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+
+    async def close(self):
+        await self.scheduler.close()
@@ -0,0 +1,263 @@
+"""
+Admission control for client connections.
+
+Every admitted connection opens an upstream Live session, so accepting all
+of them during a spike overruns the upstream concurrency quota and sessions
+fail part way through. ``AdmissionController`` caps concurrent sessions.
+Connections beyond the cap wait in a bounded queue, ordered by priority
+class and then arrival, and are told their position and an estimated wait
+whenever it changes. When the queue is full a new arrival is rejected with
+a retry-after hint, unless it outranks someone already waiting, in which
+case the lowest-ranked waiter is shed instead. Waiters that reach
+``max_wait`` are rejected the same way.
+
+The estimated wait assumes sessions end at the rate observed so far: a
+waiter at position ``p`` waits about ``p * mean session time / max
+sessions``. Retry-after hints use the same estimate for the whole queue,
+with jitter so rejected clients don't all come back at once.
+
+Limits are per server process; with ``--workers`` each worker admits up to
+the limit.
+"""
+
+import asyncio
+import heapq
+import hmac
+import itertools
+import random
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import counter, gauge, histogram
+
+# Priority classes, highest first
+PRIORITY_RESUMING = 0  # Reconnecting to a conversation in progress
+PRIORITY_AUTHENTICATED = 1  # Presented a priority key
+PRIORITY_DEFAULT = 2
+PRIORITY_NAMES = {
+    PRIORITY_RESUMING: "resuming",
+    PRIORITY_AUTHENTICATED: "authenticated",
+    PRIORITY_DEFAULT: "default",
+}
+
+MIN_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 300.0
+
+wait_seconds = histogram(
+    "admission_wait_seconds",
+    "Time connections waited in the admission queue before a decision",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+
+
+def _decision(decision, priority):
+    return counter(
+        "admission_decisions_total",
+        "Admission decisions by outcome and priority class",
+        {"decision": decision, "priority": PRIORITY_NAMES[priority]},
+    )
+
+
+def key_from_request(websocket):
+    """
+    Return the priority key a client presented, as ``Authorization: Bearer``
+    or as the ``key`` query parameter, if any.
+    """
+    request = getattr(websocket, "request", None)
+    headers = getattr(request, "headers", None) or getattr(
+        websocket, "request_headers", {}
+    )
+    authorization = headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer ") :].strip()
+    path = getattr(request, "path", None) or getattr(websocket, "path", "") or ""
+    values = parse_qs(urlsplit(path).query).get("key")
+    return values[0] if values else None
+
+
+def is_priority_key(key, keys):
+    """Constant-time check of a presented key against the configured ones."""
+    return key is not None and any(
+        hmac.compare_digest(key.encode(), known.encode()) for known in keys
+    )
+
+
+def load_priority_keys(path):
+    """Read priority keys from a file, one per line."""
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class Rejected(Exception):
+    """A connection was turned away; the client may retry after a while."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason}, retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "future", "moved", "enqueued")
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.moved = asyncio.Event()  # Set when the waiter's position changes
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """Cap concurrent sessions and queue the connections beyond the cap."""
+
+    def __init__(self, max_sessions=0, max_queue=100, max_wait=60.0):
+        """
+        Args:
+            max_sessions: concurrent sessions admitted, 0 for no limit
+            max_queue: connections allowed to wait for a slot
+            max_wait: seconds a connection waits before being rejected
+        """
+        self.max_sessions = max_sessions
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.queue = []  # Heap of waiters, best first
+        self._seq = itertools.count()
+        self.mean_session = 60.0  # EWMA of admitted session seconds
+        self._closed = False
+        gauge(
+            "admission_queue_length",
+            "Connections waiting for a session slot",
+            fn=lambda: len(self.queue),
+        )
+        gauge(
+            "admission_max_sessions",
+            "Concurrent session limit (0 is unlimited)",
+            fn=lambda: self.max_sessions,
+        )
+
+    def _has_slot(self):
+        return not self.max_sessions or self.active < self.max_sessions
+
+    def estimate_wait(self, position):
+        """Seconds until the waiter at ``position`` (1-based) gets a slot."""
+        if not self.max_sessions:
+            return 0.0
+        return position * self.mean_session / self.max_sessions
+
+    def retry_after(self):
+        """Suggested seconds before a rejected client tries again."""
+        estimate = self.estimate_wait(len(self.queue) + 1)
+        estimate *= random.uniform(1.0, 1.5)
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, estimate))
+
+    def positions(self):
+        """Waiters in admission order."""
+        return sorted(self.queue)
+
+    async def admit(self, priority=PRIORITY_DEFAULT, on_queued=None):
+        """
+        Wait for a session slot. Returns the time the slot was granted, to
+        pass to ``release()``.
+
+        ``on_queued(position, eta)`` is awaited when the connection is
+        queued and whenever its position changes. Raises ``Rejected`` if the
+        queue is full, the wait times out or the server is shutting down.
+        """
+        if self._closed:
+            raise self._reject("shutting_down", priority)
+        if self._has_slot() and not self.queue:
+            self.active += 1
+            _decision("admitted", priority).inc()
+            return time.monotonic()
+
+        if len(self.queue) >= self.max_queue:
+            # Shed the lowest-ranked waiter if this arrival outranks it
+            lowest = max(self.queue, default=None)
+            if lowest is None or lowest.priority <= priority:
+                raise self._reject("queue_full", priority)
+            self._remove(lowest)
+            lowest.future.set_exception(self._reject("shed", lowest.priority))
+
+        waiter = _Waiter(priority, next(self._seq))
+        heapq.heappush(self.queue, waiter)
+        self._moved()
+        self._grant()  # A slot may have opened with the queue non-empty
+        _decision("queued", priority).inc()
+        deadline = waiter.enqueued + self.max_wait
+        reported = None
+        try:
+            while not waiter.future.done():
+                waiter.moved.clear()
+                position = self.positions().index(waiter) + 1
+                if on_queued is not None and position != reported:
+                    reported = position
+                    await on_queued(position, self.estimate_wait(position))
+                if waiter.future.done():
+                    break
+                moved = asyncio.ensure_future(waiter.moved.wait())
+                try:
+                    await asyncio.wait(
+                        [waiter.future, moved],
+                        timeout=deadline - time.monotonic(),
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                finally:
+                    moved.cancel()
+                if not waiter.future.done() and time.monotonic() >= deadline:
+                    self._remove(waiter)
+                    raise self._reject("timeout", priority)
+            granted = waiter.future.result()
+        except BaseException:
+            # Rejected, or the client went away while waiting
+            if waiter.future.done() and not waiter.future.exception():
+                self.release(waiter.future.result())  # Granted meanwhile
+            elif waiter in self.queue:
+                self._remove(waiter)
+                _decision("abandoned", priority).inc()
+            raise
+        finally:
+            wait_seconds.observe(time.monotonic() - waiter.enqueued)
+        _decision("admitted", priority).inc()
+        return granted
+
+    def release(self, granted):
+        """Free the slot of a session admitted at ``granted``."""
+        self.active -= 1
+        held = time.monotonic() - granted
+        self.mean_session += 0.1 * (held - self.mean_session)
+        self._grant()
+
+    def _grant(self):
+        granted = False
+        while self.queue and self._has_slot():
+            waiter = heapq.heappop(self.queue)
+            self.active += 1
+            waiter.future.set_result(time.monotonic())
+            granted = True
+        if granted:
+            self._moved()
+
+    def _remove(self, waiter):
+        self.queue.remove(waiter)
+        heapq.heapify(self.queue)
+        self._moved()
+
+    def _moved(self):
+        for waiter in self.queue:
+            waiter.moved.set()
+
+    def _reject(self, reason, priority):
+        _decision(f"rejected_{reason}", priority).inc()
+        return Rejected(reason, self.retry_after())
+
+    def close(self):
+        """Reject everyone waiting and any new arrival, for shutdown."""
+        self._closed = True
+        while self.queue:
+            waiter = heapq.heappop(self.queue)
+            waiter.future.set_exception(self._reject("shutting_down", waiter.priority))
@@ -0,0 +1,427 @@
+"""
+Compressed encodings for model audio sent to clients.
+
+Model audio arrives as 24 kHz 16-bit PCM, about 48 KB/s per speaking
+session before base64. Clients can ask for a smaller encoding at session
+start (``{"type": "codec", "accept": [...]}``, in preference order) and the
+server picks the first one it supports:
+
+``mulaw`` / ``alaw``
+    G.711 companding, 8 bits per sample (2x). Encoding is one lookup in a
+    64K-entry table indexed by the raw sample; decoding one lookup in a
+    256-entry table. Both are single vectorized NumPy operations.
+``ima-adpcm``
+    IMA ADPCM, 4 bits per sample (about 3.4x with block headers). Each chunk
+    is cut into short independent blocks with a small header (first sample,
+    step index), so every frame decodes on its own. The codec is sequential
+    within a block, so all blocks of a chunk are coded in lockstep: one
+    vectorized step per sample position of a block, a fixed 32 steps per
+    chunk instead of one Python step per sample.
+``opus``
+    Only offered when ``opuslib`` is installed. 20 ms packets; samples that
+    don't fill a packet are carried to the next chunk and flushed at the end
+    of the turn.
+
+Encoders are streaming and per session: ``encode`` takes each PCM chunk as
+it arrives, ``flush`` ends a turn, ``reset`` drops buffered audio after an
+interruption. Each encoder counts the PCM and encoded bytes it handled.
+"""
+
+import struct
+
+import numpy as np
+
+from framing import (
+    CODEC_ALAW,
+    CODEC_IMA_ADPCM,
+    CODEC_MULAW,
+    CODEC_OPUS,
+    CODEC_PCM16,
+)
+from metrics import counter
+
+try:
+    import opuslib
+except ImportError:  # Optional: Opus is only offered when the library exists
+    opuslib = None
+
+PCM16 = "pcm16"
+MULAW = "mulaw"
+ALAW = "alaw"
+IMA_ADPCM = "ima-adpcm"
+OPUS = "opus"
+
+CODEC_IDS = {
+    PCM16: CODEC_PCM16,
+    MULAW: CODEC_MULAW,
+    ALAW: CODEC_ALAW,
+    IMA_ADPCM: CODEC_IMA_ADPCM,
+    OPUS: CODEC_OPUS,
+}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+
+def available_codecs():
+    """Codec names this process can encode, smallest output first."""
+    codecs = [IMA_ADPCM, MULAW, ALAW, PCM16]
+    if opuslib is not None:
+        codecs.insert(0, OPUS)
+    return codecs
+
+
+def negotiate(accept, offered):
+    """Return the client's most preferred codec among ``offered``, else PCM."""
+    for name in accept or ():
+        if name in offered:
+            return name
+    return PCM16
+
+
+# --- G.711 -----------------------------------------------------------------
+
+_MULAW_BIAS = 0x84
+_MULAW_CLIP = 8159
+_MULAW_SEGMENT_ENDS = np.array(
+    [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], dtype=np.int32
+)
+_ALAW_SEGMENT_ENDS = np.array(
+    [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF], dtype=np.int32
+)
+
+
+def _mulaw_encode_all(x):
+    x = x >> 2  # mu-law works on 14-bit samples
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    x = np.minimum(np.abs(x), _MULAW_CLIP) + (_MULAW_BIAS >> 2)
+    segment = np.searchsorted(_MULAW_SEGMENT_ENDS, x)
+    value = (np.minimum(segment, 7) << 4) | ((x >> (segment + 1)) & 0x0F)
+    value = np.where(segment >= 8, 0x7F, value)
+    return (value ^ mask).astype(np.uint8)
+
+
+def _mulaw_decode_all(u):
+    u = ~u & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = (((u & 0x0F) << 3) + _MULAW_BIAS << exponent) - _MULAW_BIAS
+    return np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_encode_all(x):
+    x = x >> 3  # A-law works on 13-bit samples
+    mask = np.where(x >= 0, 0xD5, 0x55)
+    x = np.where(x >= 0, x, -x - 1)
+    segment = np.searchsorted(_ALAW_SEGMENT_ENDS, x)
+    shift = np.where(segment < 2, 1, segment)
+    value = (np.minimum(segment, 7) << 4) | ((x >> shift) & 0x0F)
+    value = np.where(segment >= 8, 0x7F, value)
+    return (value ^ mask).astype(np.uint8)
+
+
+def _alaw_decode_all(a):
+    a = a ^ 0x55
+    segment = (a & 0x70) >> 4
+    t = (a & 0x0F) << 4
+    t = np.where(segment == 0, t + 8, (t + 0x108) << np.maximum(segment - 1, 0))
+    return np.where(a & 0x80, t, -t).astype(np.int16)
+
+
+_ALL_SAMPLES = np.arange(-32768, 32768, dtype=np.int32)
+_ALL_CODES = np.arange(256, dtype=np.int32)
+# Encode tables are indexed by the sample's bits read as uint16
+_MULAW_ENCODE = np.roll(_mulaw_encode_all(_ALL_SAMPLES), -32768)
+_ALAW_ENCODE = np.roll(_alaw_encode_all(_ALL_SAMPLES), -32768)
+_MULAW_DECODE = _mulaw_decode_all(_ALL_CODES)
+_ALAW_DECODE = _alaw_decode_all(_ALL_CODES)
+
+
+def _samples(pcm):
+    return np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+
+
+def mulaw_encode(pcm):
+    return _MULAW_ENCODE[_samples(pcm).view("<u2")].tobytes()
+
+
+def mulaw_decode(data):
+    return _MULAW_DECODE[np.frombuffer(data, dtype=np.uint8)].astype("<i2").tobytes()
+
+
+def alaw_encode(pcm):
+    return _ALAW_ENCODE[_samples(pcm).view("<u2")].tobytes()
+
+
+def alaw_decode(data):
+    return _ALAW_DECODE[np.frombuffer(data, dtype=np.uint8)].astype("<i2").tobytes()
+
+
+# --- IMA ADPCM -------------------------------------------------------------
+
+_STEPS = np.array(
+    [
+        7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37,
+        41, 45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173,
+        190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658,
+        724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+        2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894,
+        6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289,
+        16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+    ],
+    dtype=np.int32,
+)  # fmt: skip
+_INDEX_ADJUST = np.array([-1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int32)
+# Reconstructed difference for every (step index, 3-bit magnitude), exactly
+# as the standard decoder adds it up bit by bit
+_VPDIFF = (
+    (_STEPS[:, None] >> 3)
+    + np.where(np.arange(8) & 4, _STEPS[:, None], 0)
+    + np.where(np.arange(8) & 2, _STEPS[:, None] >> 1, 0)
+    + np.where(np.arange(8) & 1, _STEPS[:, None] >> 2, 0)
+)
+
+# Short blocks keep the lockstep loop short: 32 vectorized steps per chunk
+# whatever its length, for a 3-byte header per 16 bytes of nibbles
+ADPCM_BLOCK_SAMPLES = 33
+_ADPCM_BLOCK_HEADER_SIZE = 3  # int16 first sample, uint8 step index
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_FLAT_VPDIFF = _VPDIFF.ravel()
+
+
+def _clamp(values, low, high):
+    np.maximum(values, low, out=values)
+    np.minimum(values, high, out=values)
+
+
+def adpcm_encode(pcm, block_samples=ADPCM_BLOCK_SAMPLES):
+    """
+    Encode PCM as independent IMA ADPCM blocks.
+
+    Payload: uint32 sample count, then per block its first sample (int16),
+    initial step index (uint8) and the remaining samples as nibbles, low
+    nibble first. The last block is padded by repeating the last sample.
+    """
+    x = _samples(pcm).astype(np.int32)
+    count = len(x)
+    if count == 0:
+        return _UINT32.pack(0)
+    blocks = -(-count // block_samples)
+    padded = np.empty(blocks * block_samples, dtype=np.int32)
+    padded[:count] = x
+    padded[count:] = x[-1]
+    x = padded.reshape(blocks, block_samples)
+
+    # Start each block at the step closest to its mean sample delta, so no
+    # block spends its first samples adapting from a bad guess
+    deltas = np.abs(np.diff(x, axis=1)).mean(axis=1)
+    step_index = np.minimum(np.searchsorted(_STEPS, deltas), 88)
+    header_index = step_index.astype(np.uint8)
+
+    # One row per sample position: each loop step codes that position of
+    # every block at once
+    columns = np.ascontiguousarray(x.T)
+    predictor = columns[0].copy()
+    magnitudes = np.empty((block_samples - 1, blocks), dtype=np.int32)
+    negatives = np.empty((block_samples - 1, blocks), dtype=bool)
+    step = _STEPS.take(step_index)
+    for i in range(1, block_samples):
+        diff = columns[i] - predictor
+        negative = negatives[i - 1]
+        np.less(diff, 0, out=negative)
+        magnitude = magnitudes[i - 1]
+        np.abs(diff, out=magnitude)
+        magnitude <<= 2
+        magnitude //= step
+        np.minimum(magnitude, 7, out=magnitude)
+        vpdiff = _FLAT_VPDIFF.take(step_index * 8 + magnitude)
+        np.negative(vpdiff, out=vpdiff, where=negative)
+        predictor += vpdiff
+        _clamp(predictor, -32768, 32767)
+        step_index += _INDEX_ADJUST.take(magnitude)
+        _clamp(step_index, 0, 88)
+        step = _STEPS.take(step_index)
+
+    codes = (magnitudes | (negatives << 3)).T.astype(np.uint8)
+    packed = codes[:, 0::2] | (codes[:, 1::2] << 4)
+    headers = np.empty((blocks, _ADPCM_BLOCK_HEADER_SIZE), dtype=np.uint8)
+    headers[:, 0:2] = x[:, :1].astype("<i2").view(np.uint8)
+    headers[:, 2] = header_index
+    return _UINT32.pack(count) + np.hstack([headers, packed]).tobytes()
+
+
+def adpcm_decode(payload, block_samples=ADPCM_BLOCK_SAMPLES):
+    """Decode an ``adpcm_encode`` payload back to 16-bit PCM."""
+    (count,) = _UINT32.unpack_from(payload)
+    if count == 0:
+        return b""
+    block_bytes = _ADPCM_BLOCK_HEADER_SIZE + (block_samples - 1) // 2
+    data = np.frombuffer(payload, dtype=np.uint8, offset=_UINT32.size)
+    blocks = data.reshape(-1, block_bytes)
+    predictor = blocks[:, 0:2].copy().view("<i2")[:, 0].astype(np.int32)
+    step_index = blocks[:, 2].astype(np.int32)
+    packed = blocks[:, _ADPCM_BLOCK_HEADER_SIZE:]
+    codes = np.empty((block_samples - 1, len(blocks)), dtype=np.int32)
+    codes[0::2] = (packed & 0x0F).T
+    codes[1::2] = (packed >> 4).T
+
+    out = np.empty((block_samples, len(blocks)), dtype=np.int32)
+    out[0] = predictor
+    for i in range(1, block_samples):
+        code = codes[i - 1]
+        magnitude = code & 7
+        vpdiff = _FLAT_VPDIFF.take(step_index * 8 + magnitude)
+        np.negative(vpdiff, out=vpdiff, where=code >= 8)
+        predictor += vpdiff
+        _clamp(predictor, -32768, 32767)
+        out[i] = predictor
+        step_index += _INDEX_ADJUST.take(magnitude)
+        _clamp(step_index, 0, 88)
+    return out.T.reshape(-1)[:count].astype("<i2").tobytes()
+
+
+# --- Streaming encoders ----------------------------------------------------
+
+
+class StreamEncoder:
+    """Per-session encoder for one codec; the base class passes PCM through."""
+
+    name = PCM16
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.codec_id = CODEC_IDS[self.name]
+        self.pcm_bytes = 0
+        self.encoded_bytes = 0
+        labels = {"codec": self.name}
+        self._pcm_counter = counter(
+            "egress_codec_pcm_bytes_total", "Model audio PCM bytes encoded", labels
+        )
+        self._encoded_counter = counter(
+            "egress_codec_encoded_bytes_total",
+            "Model audio bytes after encoding",
+            labels,
+        )
+
+    def _encode(self, pcm):
+        return pcm
+
+    def encode(self, pcm):
+        """Encode one PCM chunk; may return b"" while a packet fills up."""
+        data = self._encode(pcm)
+        self.pcm_bytes += len(pcm)
+        self.encoded_bytes += len(data)
+        self._pcm_counter.inc(len(pcm))
+        self._encoded_counter.inc(len(data))
+        return data
+
+    def flush(self):
+        """Return any buffered audio at the end of a turn."""
+        return b""
+
+    def reset(self):
+        """Drop buffered audio, e.g. after an interruption."""
+
+    @property
+    def saved_bytes(self):
+        return self.pcm_bytes - self.encoded_bytes
+
+
+class MulawEncoder(StreamEncoder):
+    name = MULAW
+
+    def _encode(self, pcm):
+        return mulaw_encode(pcm)
+
+
+class AlawEncoder(StreamEncoder):
+    name = ALAW
+
+    def _encode(self, pcm):
+        return alaw_encode(pcm)
+
+
+class AdpcmEncoder(StreamEncoder):
+    name = IMA_ADPCM
+
+    def _encode(self, pcm):
+        return adpcm_encode(pcm)
+
+
+class OpusEncoder(StreamEncoder):
+    """20 ms Opus packets, each prefixed with its uint16 length."""
+
+    name = OPUS
+    FRAME_MS = 20
+
+    def __init__(self, sample_rate, bitrate=24000):
+        super().__init__(sample_rate)
+        self.frame_bytes = sample_rate * self.FRAME_MS // 1000 * 2
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.pending = b""
+
+    def _packets(self, pcm):
+        out = []
+        for start in range(0, len(pcm) - self.frame_bytes + 1, self.frame_bytes):
+            packet = self.encoder.encode(
+                pcm[start : start + self.frame_bytes], self.frame_bytes // 2
+            )
+            out.append(_UINT16.pack(len(packet)) + packet)
+        return b"".join(out)
+
+    def _encode(self, pcm):
+        pcm = self.pending + pcm
+        usable = len(pcm) - len(pcm) % self.frame_bytes
+        self.pending = pcm[usable:]
+        return self._packets(pcm[:usable])
+
+    def flush(self):
+        if not self.pending:
+            return b""
+        tail = self.pending.ljust(self.frame_bytes, b"\0")
+        self.pending = b""
+        data = self._packets(tail)
+        self.encoded_bytes += len(data)
+        self._encoded_counter.inc(len(data))
+        return data
+
+    def reset(self):
+        self.pending = b""
+
+
+class OpusDecoder:
+    """Decode ``OpusEncoder`` payloads (a stateful decoder per stream)."""
+
+    def __init__(self, sample_rate):
+        self.frame_samples = sample_rate * OpusEncoder.FRAME_MS // 1000
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+
+    def decode(self, payload):
+        out = []
+        offset = 0
+        while offset < len(payload):
+            (length,) = _UINT16.unpack_from(payload, offset)
+            offset += _UINT16.size
+            packet = payload[offset : offset + length]
+            offset += length
+            out.append(self.decoder.decode(packet, self.frame_samples))
+        return b"".join(out)
+
+
+ENCODERS = {
+    PCM16: StreamEncoder,
+    MULAW: MulawEncoder,
+    ALAW: AlawEncoder,
+    IMA_ADPCM: AdpcmEncoder,
+    OPUS: OpusEncoder,
+}
+
+DECODERS = {
+    PCM16: bytes,
+    MULAW: mulaw_decode,
+    ALAW: alaw_decode,
+    IMA_ADPCM: adpcm_decode,
+}
+
+
+def create_encoder(name, sample_rate):
+    return ENCODERS[name](sample_rate)
@@ -0,0 +1,61 @@
+"""
+Upstream Live API backends.
+
+A backend opens the upstream realtime session that a server streams client
+audio into. ``LiveAPIWebSocketServer`` talks to whatever backend it is given,
+so the same pipeline can run against Gemini on Vertex AI or against the
+offline stand-in in ``mock_live.py`` for load tests and benchmarks.
+"""
+
+from common import PROJECT_ID, LOCATION
+
+
+class LiveBackend:
+    """Interface for upstream Live session providers."""
+
+    name = "base"
+
+    def connect(self, model, config):
+        """
+        Return an async context manager that yields a live session.
+
+        The session must provide ``send_realtime_input(...)`` and an async
+        ``receive()`` iterator shaped like ``google.genai`` live sessions.
+        """
+        raise NotImplementedError("Backends must implement connect")
+
+
+class GeminiLiveBackend(LiveBackend):
+    """Backend that connects to the Gemini Live API via google-genai."""
+
+    name = "gemini"
+
+    def __init__(self, project=PROJECT_ID, location=LOCATION):
+        self.project = project
+        self.location = location
+        self._client = None
+
+    @property
+    def client(self):
+        # Create the client lazily so importing the server stays cheap
+        if self._client is None:
+            from google import genai
+
+            self._client = genai.Client(
+                vertexai=True, project=self.project, location=self.location
+            )
+        return self._client
+
+    def connect(self, model, config):
+        return self.client.aio.live.connect(model=model, config=config)
+
+
+def create_backend(name, **kwargs):
+    """Create a backend by name ("gemini" or "mock")."""
+    if name == GeminiLiveBackend.name:
+        return GeminiLiveBackend(**kwargs)
+    if name == "mock":
+        from mock_live import MockLiveBackend
+
+        return MockLiveBackend(**kwargs)
+    raise ValueError(f"Unknown backend: {name}")
@@ -0,0 +1,113 @@
+"""
+Upstream audio coalescing.
+
+Browsers deliver microphone audio in frames whose size depends on the
+client. Sending each frame upstream as its own realtime input means one API
+message per frame, so small frames multiply per-message overhead. The
+coalescer batches queued PCM until a target duration is buffered, and
+flushes whatever it holds once the oldest buffered byte has waited
+``max_delay_ms``, so batching never adds more than that much latency.
+Frames already larger than the target pass through unchanged; they are
+never split.
+"""
+
+import asyncio
+import time
+
+from metrics import counter
+
+BYTES_PER_SAMPLE = 2  # 16-bit mono PCM
+
+frames_in = counter(
+    "upstream_audio_frames_in_total", "Client audio frames before coalescing"
+)
+chunks_out = counter(
+    "upstream_audio_chunks_out_total", "Audio chunks sent upstream after coalescing"
+)
+
+
+class AudioCoalescer:
+    """Batch PCM frames into chunks of at least ``target_ms``."""
+
+    def __init__(self, sample_rate, target_ms=60, max_delay_ms=100):
+        bytes_per_ms = sample_rate * BYTES_PER_SAMPLE / 1000
+        self.target_bytes = int(target_ms * bytes_per_ms)
+        self.max_delay = max_delay_ms / 1000
+        self._buffer = bytearray()
+        self._first_at = None
+
+        # Per-session stats
+        self.started = time.monotonic()
+        self.frames_in = 0
+        self.chunks_out = 0
+
+    def add(self, data):
+        """Buffer a frame; return a chunk if the target size is reached."""
+        self.frames_in += 1
+        frames_in.inc()
+        if not self._buffer:
+            if len(data) >= self.target_bytes:
+                return self._emit(data)
+            self._first_at = time.monotonic()
+        self._buffer += data
+        if len(self._buffer) >= self.target_bytes:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return everything buffered, or None if the buffer is empty."""
+        if not self._buffer:
+            return None
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._first_at = None
+        return self._emit(data)
+
+    def _emit(self, data):
+        self.chunks_out += 1
+        chunks_out.inc()
+        return data
+
+    def time_until_deadline(self):
+        """Seconds until buffered audio must be flushed, or None if empty."""
+        if self._first_at is None:
+            return None
+        return max(0.0, self._first_at + self.max_delay - time.monotonic())
+
+    def rates(self):
+        """Return (frames/s in, chunks/s out) since the coalescer started."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return self.frames_in / elapsed, self.chunks_out / elapsed
+
+
+async def forward_coalesced(audio_queue, send, coalescer, should_stop, idle_poll=1.0):
+    """
+    Drain ``audio_queue`` into ``send`` through ``coalescer``.
+
+    ``send`` is an async callable taking PCM bytes. ``should_stop`` is polled
+    at least every ``idle_poll`` seconds so the loop exits with its session.
+    """
+    while not should_stop():
+        timeout = coalescer.time_until_deadline()
+        try:
+            data = await asyncio.wait_for(
+                audio_queue.get(), timeout=idle_poll if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            chunk = coalescer.flush()
+            if chunk:
+                await send(chunk)
+            continue
+
+        chunk = coalescer.add(data)
+        audio_queue.task_done()
+        # Fold any backlog into the same upstream message
+        while chunk is None and not audio_queue.empty():
+            chunk = coalescer.add(audio_queue.get_nowait())
+            audio_queue.task_done()
+        if chunk:
+            await send(chunk)
+
+    chunk = coalescer.flush()
+    if chunk:
+        await send(chunk)
@@ -1,14 +1,53 @@
 import asyncio
 import json
-import base64
 import logging
+import os
+import secrets
 import websockets
+import time
 import traceback
 from websockets.exceptions import ConnectionClosed
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+from admission import (
+    PRIORITY_AUTHENTICATED,
+    PRIORITY_DEFAULT,
+    PRIORITY_NAMES,
+    PRIORITY_RESUMING,
+    AdmissionController,
+    Rejected,
+    is_priority_key,
+    key_from_request,
+)
+from audio_codecs import PCM16, available_codecs, create_encoder, negotiate
+from coalescer import AudioCoalescer, forward_coalesced
+from egress import OutboundScheduler
+from flow_control import BoundedAudioQueue, POLICY_DROP_OLDEST
+from framing import (
+    CODEC_PCM16,
+    FRAMING_BINARY,
+    FRAMING_JSON,
+    SUPPORTED_FRAMINGS,
+    decode_message,
+    encode_audio_frame,
+    encode_json_audio,
+)
+from metrics import counter, gauge, monitor_loop_lag
+from order_store import OrderStore
+from resampler import ENCODING_INT16, IngressNormalizer
+from resumption import ResumptionStore, new_token, token_from_request
+from scheduler import DeadlineScheduler
+from structured_logging import RATE_LIMITER, log_event, setup_logging
+from tool_registry import ToolRegistry
+from tracing import TurnTracer
+from vad import VoiceActivityDetector
+
+# Set up logging: JSON lines written off the event loop. LOG_FORMAT=text
+# keeps the classic format; LOG_LEVELS sets per-logger levels, e.g.
+# "common=DEBUG,upstream_pool=WARNING"
+setup_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    json_output=os.environ.get("LOG_FORMAT", "json") != "text",
+    levels=os.environ.get("LOG_LEVELS"),
 )
 logger = logging.getLogger(__name__)
 
@@ -22,135 +61,150 @@ VOICE_NAME = "Puck"
 RECEIVE_SAMPLE_RATE = 24000  # Rate of audio received from Gemini
 SEND_SAMPLE_RATE = 16000  # Rate of audio sent to Gemini
 
+# Pipeline metrics, bound once so per-frame paths only pay an attribute update
+client_messages_in = counter(
+    "client_messages_in_total", "WebSocket messages received from clients"
+)
+client_bytes_in = counter(
+    "client_bytes_in_total", "WebSocket payload bytes received from clients"
+)
+client_audio_frames_in = counter(
+    "client_audio_frames_in_total", "Audio frames received from clients"
+)
+client_audio_unsupported_bytes = counter(
+    "client_audio_unsupported_bytes_total",
+    "Client audio bytes dropped because their declared format is unsupported",
+)
+client_audio_frames_out = counter(
+    "client_audio_frames_out_total", "Audio frames sent to clients"
+)
+client_audio_bytes_out = counter(
+    "client_audio_bytes_out_total", "Audio payload bytes sent to clients (wire size)"
+)
+upstream_audio_bytes_out = counter(
+    "upstream_audio_bytes_out_total", "PCM bytes sent to the model"
+)
+upstream_messages_in = counter(
+    "upstream_messages_in_total", "Messages or events received from the model"
+)
+upstream_audio_bytes_in = counter(
+    "upstream_audio_bytes_in_total", "PCM bytes received from the model"
+)
+interruptions = counter("interruptions_total", "Model turns interrupted by the user")
+inactivity_warnings = counter(
+    "inactivity_warnings_total", "Idle clients sent an are-you-there prompt"
+)
+
 
-# Mock functions for Cubby storage management - shared across implementations
-def get_order_status(order_id):
-    """Mock order status API that returns data for an order ID."""
-    if order_id == "SH1005":
-        return {
-            "order_id": order_id,
-            "status": "shipped",
-            "order_date": "2024-05-20",
-            "shipment_method": "express",
-            "estimated_delivery": "2024-05-30",
-            "shipped_date": "2024-05-25",
-            "items": ["Vanilla candles", "BOKHYLLA Stor"],
-        }
-    # else:
-    #    return "order not found"
-
-    print(order_id)
-
-    # Generate some random data for other order IDs
-    import random
-
-    statuses = ["processing", "shipped", "delivered"]
-    shipment_methods = ["standard", "express", "next day", "international"]
-
-    # Generate random data based on the order ID to ensure consistency
-    seed = sum(ord(c) for c in str(order_id))
-    random.seed(seed)
-
-    status = random.choice(statuses)
-    shipment = random.choice(shipment_methods)
-    order_date = "2024-05-" + str(random.randint(12, 28)).zfill(2)
-
-    estimated_delivery = None
-    shipped_date = None
-    delivered_date = None
-
-    if status == "processing":
-        estimated_delivery = "2024-06-" + str(random.randint(1, 15)).zfill(2)
-    elif status == "shipped":
-        shipped_date = "2024-05-" + str(random.randint(1, 28)).zfill(2)
-        estimated_delivery = "2024-06-" + str(random.randint(1, 15)).zfill(2)
-    elif status == "delivered":
-        shipped_date = "2024-05-" + str(random.randint(1, 20)).zfill(2)
-        delivered_date = "2024-05-" + str(random.randint(21, 28)).zfill(2)
-
-    # Reset random seed
-    random.seed()
+# Tools available to the model, shared by both server implementations
+TOOLS = ToolRegistry()
 
-    result = {
-        "order_id": order_id,
-        "status": status,
-        "order_date": order_date,
-        "shipment_method": shipment,
-        "estimated_delivery": estimated_delivery,
-    }
+# Orders and inventory behind the tools. Point ORDER_STORE_PATH at a database
+# built with order_store.py to serve real or large synthetic data; by default
+# an in-memory store is seeded with demo inventory and synthetic orders when
+# the server starts.
+ORDER_STORE_PATH = os.environ.get("ORDER_STORE_PATH", ":memory:")
+STORE = OrderStore(ORDER_STORE_PATH)
 
-    if shipped_date:
-        result["shipped_date"] = shipped_date
+STORAGE_FEATURES = [
+    "Climate-controlled",
+    "24/7 access",
+    "Security cameras",
+    "On-site manager",
+]
 
-    if delivered_date:
-        result["delivered_date"] = delivered_date
 
-    return result
+# Cubby storage management tools - shared across implementations
+@TOOLS.register(cache_ttl=300)
+def get_order_status(order_id: str):
+    """Get the current status and details of an order.
 
+    Args:
+        order_id: The order ID to look up
+    """
+    order = STORE.get_order(order_id.strip().upper())
+    if order is None:
+        return {"order_id": order_id, "error": "Order not found"}
 
-def check_storage_availability(size=None, location=None):
-    """Mock storage availability API that returns available units."""
-    import random
+    result = {
+        "order_id": order["order_id"],
+        "status": order["status"],
+        "order_date": order["order_date"],
+        "shipment_method": order["shipment_method"],
+        "estimated_delivery": order["estimated_delivery"],
+    }
+    for key in ("shipped_date", "delivered_date", "items"):
+        if order[key]:
+            result[key] = order[key]
+    return result
 
-    # Mock data for different locations and sizes
-    locations = ["Downtown", "Midtown", "Airport", "Suburbs"]
-    sizes = ["Small (5x5)", "Medium (10x10)", "Large (10x20)", "Extra Large (20x20)"]
 
-    if not location:
-        location = random.choice(locations)
-    if not size:
-        size = random.choice(sizes)
+@TOOLS.register(cache_ttl=30)  # Availability changes; keep it short
+def check_storage_availability(size: str | None = None, location: str | None = None):
+    """Check available storage units by size and location.
 
-    # Generate availability based on location and size
-    available_units = random.randint(1, 15)
-    price_per_month = random.randint(50, 300)
+    Args:
+        size: Storage unit size (e.g., 'Small (5x5)', 'Medium (10x10)', 'Large (10x20)')
+        location: Location preference (e.g., 'Downtown', 'Midtown', 'Airport', 'Suburbs')
+    """
+    try:
+        unit = STORE.find_availability(location=location, size=size)
+    except ValueError as e:
+        return {"error": str(e)}
+    if unit is None:
+        return {"location": location, "size": size, "available_units": 0}
 
     return {
-        "location": location,
-        "size": size,
-        "available_units": available_units,
-        "price_per_month": f"${price_per_month}",
-        "features": [
-            "Climate-controlled",
-            "24/7 access",
-            "Security cameras",
-            "On-site manager",
-        ],
+        "location": unit["location"],
+        "size": unit["size"],
+        "available_units": unit["available_units"],
+        "price_per_month": f"${unit['price_per_month']}",
+        "features": STORAGE_FEATURES,
     }
 
 
+# Creates a booking: never cached, and availability answers are stale after it
+@TOOLS.register(
+    timeout=20.0, cache_ttl=None, invalidates=["check_storage_availability"]
+)
 def book_storage_reservation(
-    customer_name, size, location, start_date, duration_months
+    customer_name: str, size: str, location: str, start_date: str, duration_months: int
 ):
-    """Mock booking API that creates a storage reservation."""
-    import random
-
-    # Generate a reservation ID
-    reservation_id = f"CUB{random.randint(1000, 9999)}"
-
-    # Calculate total cost (mock pricing)
-    monthly_rates = {
-        "Small (5x5)": 75,
-        "Medium (10x10)": 125,
-        "Large (10x20)": 200,
-        "Extra Large (20x20)": 300,
-    }
+    """Create a new storage reservation for a customer.
 
-    monthly_rate = monthly_rates.get(size, 125)
-    total_cost = monthly_rate * duration_months
+    Args:
+        customer_name: Name of the customer
+        size: Storage unit size
+        location: Preferred location
+        start_date: When the rental starts (YYYY-MM-DD format)
+        duration_months: How many months to book
+    """
+    try:
+        location, size = STORE.resolve(location=location, size=size)
+    except ValueError as e:
+        return {"error": str(e)}
 
-    return {
-        "reservation_id": reservation_id,
+    reservation = {
+        "reservation_id": f"CUB{secrets.token_hex(6).upper()}",
         "customer_name": customer_name,
         "size": size,
         "location": location,
         "start_date": start_date,
         "duration_months": duration_months,
+        "unit_number": f"Unit {secrets.randbelow(900) + 100}",
+        "access_code": f"{secrets.randbelow(9000) + 1000}",
+    }
+    unit = STORE.find_availability(location=location, size=size)
+    reservation["monthly_rate"] = unit["price_per_month"] if unit else 0
+    if STORE.reserve(reservation) is None:
+        return {"error": f"No {size} units available at {location}"}
+
+    monthly_rate = reservation["monthly_rate"]
+    return {
+        **reservation,
         "monthly_rate": f"${monthly_rate}",
-        "total_cost": f"${total_cost}",
+        "total_cost": f"${monthly_rate * duration_months}",
         "status": "confirmed",
-        "unit_number": f"Unit {random.randint(100, 999)}",
-        "access_code": f"{random.randint(1000, 9999)}",
     }
 
 
@@ -191,49 +245,341 @@ If customers ask about storage unit sizes, recommend:
 
 # Base WebSocket server class that handles common functionality
 class BaseWebSocketServer:
-    def __init__(self, host="0.0.0.0", port=8765):
+    def __init__(self, host="0.0.0.0", port=8765, backend=None):
         self.host = host
         self.port = port
+        self.backend = backend  # Upstream Live session provider (see backends.py)
         self.active_clients = {}  # Store client websockets
-        self.last_activity = {}  # Track last activity time for each client
+        self.last_activity = {}  # Last activity per client (monotonic seconds)
+        self.inactivity_warned = {}  # Whether an idle client was already warned
         self.should_stop = {}  # Track if session should stop
-        self.INACTIVITY_WARNING_TIMEOUT = 5  # Seconds before warning
-        self.INACTIVITY_DISCONNECT_TIMEOUT = 8  # Seconds before disconnect
+        self.stop_events = {}  # Set when a client's session should end
+        self.upstream_sessions = {}  # Upstream Live session per client
+        self.scheduler = DeadlineScheduler()  # Inactivity deadlines, all clients
+        self.framing = {}  # Negotiated audio framing for each client
+        self.egress_seq = {}  # Outgoing binary audio frame counter per client
+        self.encoders = {}  # Negotiated model audio encoder per client, if not PCM
+        self.ingress = {}  # Client audio format converter per client, if not native
+        self.ingress_formats = {}  # Audio format each client last declared
+        self.ingress_rejected = {}  # Audio bytes dropped since a bad declaration
+        self.vad = {}  # Voice activity detector per client
+        self.audio_queues = {}  # Bounded ingress audio buffer per client
+        self.outbound = {}  # Prioritized outbound message queue per client
+        self.client_tokens = {}  # Reconnect token per client
+        self.resumption = ResumptionStore()  # Token -> upstream resumption handle
+        self.admission = AdmissionController()  # Concurrent session cap and queue
+        self._background_tasks = set()  # Fire-and-forget sends
+        self.shutdown_event = None  # Set by request_shutdown() once serving
+        self.end_reasons = {}  # Why each client's session ended, for metrics
+        self.tracers = {}  # Per-turn latency tracer per client
+        self.span_exporter = None  # Where finished turn spans go, if anywhere
+        self.INACTIVITY_WARNING_TIMEOUT = 10  # Seconds before warning
+        self.INACTIVITY_DISCONNECT_TIMEOUT = 15  # Seconds before disconnect
+        self.COALESCE_TARGET_MS = 60  # Upstream audio chunk size, 0 disables
+        self.COALESCE_MAX_DELAY_MS = 100  # Max time audio waits to be batched
+        self.VAD_ENABLED = True  # Gate silent client audio before upstream
+        self.VAD_PREROLL_MS = 300  # Audio kept before a speech onset
+        self.VAD_HANGOVER_MS = 1000  # Silence forwarded after speech ends
+        self.VAD_THIN_EVERY = 0  # Forward every Nth silent frame, 0 drops them
+        self.AUDIO_QUEUE_MAX_MS = 2000  # Ingress audio buffered per client
+        self.AUDIO_QUEUE_POLICY = POLICY_DROP_OLDEST  # Overflow policy
+        self.REUSE_PORT = False  # SO_REUSEPORT, for multi-process workers
+        self.DRAIN_TIMEOUT = 30  # Seconds sessions get to finish on shutdown
+        self.AUDIO_CODECS = available_codecs()  # Model audio codecs offered
+        self.EGRESS_QUEUE_MAX_MS = 10000  # Model audio buffered per client
+        self.EGRESS_QUEUE_POLICY = POLICY_DROP_OLDEST  # Overflow policy
+        self.EGRESS_COALESCE_MS = 200  # Largest frame built from a backlog
+        self.PRIORITY_KEYS = set()  # Keys that admit clients ahead of the queue
+
+        # Computed at scrape time, so they cost nothing per frame
+        gauge(
+            "active_sessions",
+            "Connected client sessions",
+            fn=lambda: len(self.active_clients),
+        )
+        gauge(
+            "ingress_queue_bytes",
+            "Client audio buffered before upstream, all sessions",
+            fn=lambda: sum(q.bytes for q in self.audio_queues.values()),
+        )
+        gauge(
+            "ingress_queue_frames",
+            "Client audio frames buffered before upstream, all sessions",
+            fn=lambda: sum(q.qsize() for q in self.audio_queues.values()),
+        )
+        gauge(
+            "inactivity_deadlines",
+            "Sessions with a pending inactivity deadline",
+            fn=lambda: len(self.scheduler),
+        )
+        gauge(
+            "egress_queue_bytes",
+            "Model audio queued for clients, all sessions",
+            fn=lambda: sum(q.bytes for q in self.outbound.values()),
+        )
+        gauge(
+            "egress_oldest_message_seconds",
+            "Age of the oldest queued outbound message, worst session",
+            fn=lambda: max((q.oldest_age() for q in self.outbound.values()), default=0),
+        )
 
     async def start(self):
-        logger.info(f"Starting WebSocket server on {self.host}:{self.port}")
-        async with websockets.serve(self.handle_client, self.host, self.port):
-            await asyncio.Future()  # Run forever
+        """Serve until request_shutdown(), then drain sessions and return"""
+        logger.info("Starting WebSocket server on %s:%s", self.host, self.port)
+        self.shutdown_event = asyncio.Event()
+        STORE.ensure_seeded()  # Before any session can call a tool
+        lag_monitor = asyncio.create_task(monitor_loop_lag())
+        try:
+            async with websockets.serve(
+                self.handle_client, self.host, self.port, reuse_port=self.REUSE_PORT
+            ) as server:
+                await self.shutdown_event.wait()
+                # Stop accepting; let sessions in progress finish
+                server.close(close_connections=False)
+                await self.drain()
+        finally:
+            lag_monitor.cancel()
+
+    def request_shutdown(self):
+        """Begin a graceful shutdown; safe to call from a signal handler"""
+        if self.shutdown_event is not None and not self.shutdown_event.is_set():
+            logger.info("Shutdown requested, draining sessions")
+            self.shutdown_event.set()
+
+    async def drain(self):
+        """Wait up to DRAIN_TIMEOUT for sessions to end, then stop the rest"""
+        self.admission.close()
+        deadline = time.monotonic() + self.DRAIN_TIMEOUT
+        while self.active_clients and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        if self.active_clients:
+            logger.info("Stopping %d sessions after drain", len(self.active_clients))
+        for client_id in list(self.active_clients):
+            self.set_end_reason(client_id, "shutdown")
+            self.request_stop(client_id)
 
     async def handle_client(self, websocket):
         """Handle a new WebSocket client connection"""
         client_id = id(websocket)
-        logger.info(f"New client connected: {client_id}")
+        logger.info(
+            "New client connected: %s", client_id, extra={"client_id": client_id}
+        )
+
+        # The token identifies this conversation if the client reconnects.
+        # Only tokens with something to resume are honoured.
+        token = token_from_request(websocket)
+        resuming = token is not None and await self.can_resume(token)
+        if not resuming:
+            token = new_token()
+
+        # Wait for a session slot before anything upstream is opened
+        if resuming:
+            priority = PRIORITY_RESUMING
+        elif is_priority_key(key_from_request(websocket), self.PRIORITY_KEYS):
+            priority = PRIORITY_AUTHENTICATED
+        else:
+            priority = PRIORITY_DEFAULT
+        granted = await self.admit(websocket, client_id, priority)
+        if granted is None:
+            return
+        try:
+            await self.serve_client(websocket, client_id, token)
+        finally:
+            self.admission.release(granted)
+
+    async def admit(self, websocket, client_id, priority):
+        """
+        Wait for admission, keeping a queued client informed of its place.
+        Returns the admission time, or None if the client was turned away or
+        left while waiting.
+        """
 
+        async def on_queued(position, eta):
+            await websocket.send(
+                json.dumps({"type": "queued", "position": position, "eta": round(eta)})
+            )
+
+        admission = asyncio.ensure_future(self.admission.admit(priority, on_queued))
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        try:
+            await asyncio.wait([admission, closed], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closed.cancel()
+        if not admission.done():
+            # Left while queued
+            admission.cancel()
+            try:
+                await admission
+            except asyncio.CancelledError:
+                pass
+            return None
+        try:
+            return admission.result()
+        except Rejected as e:
+            logger.info(
+                "Client %s (%s) rejected: %s",
+                client_id,
+                PRIORITY_NAMES[priority],
+                e,
+                extra={"client_id": client_id},
+            )
+            try:
+                await websocket.send(
+                    json.dumps(
+                        {
+                            "type": "rejected",
+                            "reason": e.reason,
+                            "retry_after": round(e.retry_after),
+                        }
+                    )
+                )
+                await websocket.close(1013, "Try again later")
+            except ConnectionClosed:
+                pass
+            return None
+        except ConnectionClosed:
+            return None
+
+    async def serve_client(self, websocket, client_id, token):
+        """Run an admitted client's session"""
         # Initialize client tracking
         self.active_clients[client_id] = websocket
         self.last_activity[client_id] = None  # Will be set in process_audio
         self.should_stop[client_id] = False
+        self.stop_events[client_id] = asyncio.Event()
+        self.framing[client_id] = FRAMING_JSON
+        self.egress_seq[client_id] = 0
+        self.tracers[client_id] = TurnTracer(client_id, self.span_exporter)
+        self.client_tokens[client_id] = token
 
-        # Send ready message to client
-        await websocket.send(json.dumps({"type": "ready"}))
+        # Send ready message to client, offering binary audio framing and
+        # compressed codecs. Clients that don't answer with "framing" and
+        # "codec" messages stay on JSON and PCM.
+        await websocket.send(
+            json.dumps(
+                {
+                    "type": "ready",
+                    "framing": SUPPORTED_FRAMINGS,
+                    "codecs": self.AUDIO_CODECS,
+                    "token": token,
+                }
+            )
+        )
 
         try:
             # Start the audio processing for this client
             await self.process_audio(websocket, client_id)
         except ConnectionClosed:
-            logger.info(f"Client disconnected: {client_id}")
+            logger.info(
+                "Client disconnected: %s", client_id, extra={"client_id": client_id}
+            )
+            self.set_end_reason(client_id, "client_closed")
         except Exception as e:
-            logger.error(f"Error handling client {client_id}: {e}")
+            self.set_end_reason(client_id, "error")
+            logger.error(
+                "Error handling client %s: %s",
+                client_id,
+                e,
+                extra={"client_id": client_id},
+            )
             logger.error(traceback.format_exc())
         finally:
             # Clean up client data
             await self.cleanup_client(client_id)
 
+    async def can_resume(self, token):
+        """Whether a reconnect token has a stored upstream resumption handle"""
+        return token in self.resumption
+
+    def set_end_reason(self, client_id, reason):
+        """Record why a session is ending; the first reason recorded wins"""
+        self.end_reasons.setdefault(client_id, reason)
+
     async def cleanup_client(self, client_id):
         """Clean up client data when connection ends"""
+        reason = self.end_reasons.pop(client_id, "closed")
+        counter(
+            "sessions_ended_total", "Client sessions by end reason", {"reason": reason}
+        ).inc()
         self.should_stop[client_id] = True
+        self.scheduler.cancel(client_id)
         self.last_activity.pop(client_id, None)
+        self.inactivity_warned.pop(client_id, None)
+        self.stop_events.pop(client_id, None)
+        self.upstream_sessions.pop(client_id, None)
+        self.client_tokens.pop(client_id, None)
+        self.framing.pop(client_id, None)
+        self.egress_seq.pop(client_id, None)
+        self.ingress_formats.pop(client_id, None)
+        rejected = self.ingress_rejected.pop(client_id, None)
+        if rejected:
+            logger.warning(
+                "Client %s ingress audio: %d bytes dropped in an unsupported format",
+                client_id,
+                rejected,
+                extra={"client_id": client_id},
+            )
+        normalizer = self.ingress.pop(client_id, None)
+        if normalizer and normalizer.bytes_in:
+            logger.info(
+                "Client %s ingress audio (%s): %d bytes normalized to %d",
+                client_id,
+                normalizer.describe(),
+                normalizer.bytes_in,
+                normalizer.bytes_out,
+                extra={"client_id": client_id},
+            )
+        encoder = self.encoders.pop(client_id, None)
+        if encoder and encoder.pcm_bytes:
+            logger.info(
+                "Client %s %s audio: %d PCM bytes sent as %d (%.0f%% saved)",
+                client_id,
+                encoder.name,
+                encoder.pcm_bytes,
+                encoder.encoded_bytes,
+                100 * encoder.saved_bytes / encoder.pcm_bytes,
+                extra={"client_id": client_id},
+            )
+        audio_queue = self.audio_queues.pop(client_id, None)
+        if audio_queue and (audio_queue.dropped_frames or audio_queue.pauses):
+            logger.info(
+                "Client %s ingress queue: peak %d bytes, %d frames dropped, "
+                "%d pauses",
+                client_id,
+                audio_queue.peak_bytes,
+                audio_queue.dropped_frames,
+                audio_queue.pauses,
+                extra={"client_id": client_id},
+            )
+        outbound = self.outbound.pop(client_id, None)
+        if outbound is not None and outbound.lag_count:
+            logger.info(
+                "Client %s egress: %s",
+                client_id,
+                outbound.summary(),
+                extra={"client_id": client_id},
+            )
+        RATE_LIMITER.forget(client_id)
+        tracer = self.tracers.pop(client_id, None)
+        if tracer:
+            tracer.close()
+            summary = tracer.summary()
+            if summary["turns"]:
+                logger.info(
+                    "Client %s turn latency: %s",
+                    client_id,
+                    summary,
+                    extra={"client_id": client_id},
+                )
+        vad = self.vad.pop(client_id, None)
+        if vad and vad.bytes_in:
+            logger.info(
+                "Client %s VAD forwarded %.0f%% of %d audio bytes",
+                client_id,
+                100 * vad.bytes_forwarded / vad.bytes_in,
+                vad.bytes_in,
+                extra={"client_id": client_id},
+            )
         websocket = self.active_clients.pop(client_id, None)
         if websocket:
             try:
@@ -241,55 +587,476 @@ class BaseWebSocketServer:
             except:
                 pass  # Ignore errors during cleanup
 
-    async def update_activity(self, client_id):
-        """Update the last activity timestamp for a client"""
-        from datetime import datetime
+    def decode_message(self, client_id, message):
+        """
+        Decode a client message in either framing.
+
+        Audio messages come back as {"type": "audio", "data": <pcm bytes>},
+        already converted to mono 16-bit PCM at SEND_SAMPLE_RATE. A
+        {"type": "format", "sample_rate": ..., "channels": ..., "encoding":
+        ...} message declares the format the client sends and takes
+        precedence over binary frame headers, whose 16-bit rate field cannot
+        carry 88.2/96 kHz; without one, binary frames at another rate are
+        converted according to their header. After an unsupported declaration the client's audio comes
+        back as {"type": "audio_dropped"} until it declares a supported
+        format. A {"type": "framing", "mode": ...} message switches the audio
+        framing used towards this client; {"type": "codec", "accept": [...]}
+        picks its model audio codec.
+        """
+        client_messages_in.inc()
+        client_bytes_in.inc(len(message))
+        data = decode_message(message)
+        if data.get("type") == "audio":
+            client_audio_frames_in.inc()
+            normalizer = self.ingress.get(client_id)
+            rate = data.get("sample_rate")
+            declared = client_id in self.ingress_formats
+            if not declared and rate and rate != SEND_SAMPLE_RATE:
+                normalizer = self.declare_ingress_format(client_id, rate)
+            if client_id in self.ingress_rejected:
+                # Forwarding it as 16 kHz PCM would feed the model noise
+                self.ingress_rejected[client_id] += len(data["data"])
+                client_audio_unsupported_bytes.inc(len(data["data"]))
+                return {"type": "audio_dropped"}
+            if normalizer is not None:
+                data["data"] = normalizer.process(data["data"])
+        elif data.get("type") == "format":
+            self.declare_ingress_format(
+                client_id,
+                data.get("sample_rate", SEND_SAMPLE_RATE),
+                data.get("channels", 1),
+                data.get("encoding", ENCODING_INT16),
+            )
+        elif data.get("type") == "framing":
+            mode = data.get("mode")
+            if mode in SUPPORTED_FRAMINGS:
+                self.framing[client_id] = mode
+                logger.info(
+                    "Client %s using %s audio framing",
+                    client_id,
+                    mode,
+                    extra={"client_id": client_id},
+                )
+            else:
+                logger.warning(
+                    "Client %s requested unknown framing: %s",
+                    client_id,
+                    mode,
+                    extra={"client_id": client_id},
+                )
+        elif data.get("type") == "codec":
+            codec = negotiate(data.get("accept"), self.AUDIO_CODECS)
+            if codec == PCM16:
+                self.encoders.pop(client_id, None)
+            else:
+                self.encoders[client_id] = create_encoder(codec, RECEIVE_SAMPLE_RATE)
+            logger.info(
+                "Client %s using %s model audio",
+                client_id,
+                codec,
+                extra={"client_id": client_id},
+            )
+        return data
+
+    def declare_ingress_format(self, client_id, *args):
+        """
+        Apply a client's format declaration, as ``set_ingress_format()``.
+        An unsupported format is logged and the client's audio is dropped
+        until it declares a supported one.
+        """
+        try:
+            return self.set_ingress_format(client_id, *args)
+        except ValueError as e:
+            logger.warning(
+                "Client %s declared an unsupported audio format, dropping its "
+                "audio: %s",
+                client_id,
+                e,
+                extra={"client_id": client_id},
+            )
+            return None
+
+    def set_ingress_format(
+        self, client_id, sample_rate, channels=1, encoding=ENCODING_INT16
+    ):
+        """
+        Convert a client's audio from the given format from now on.
+
+        Returns the converter, or None for the native format. Declaring the
+        current format again keeps the converter and its stream state.
+        Raises ValueError for unsupported formats, and marks the client's
+        ingress invalid until a supported format is set.
+        """
+        declared = (sample_rate, channels, encoding)
+        if self.ingress_formats.get(client_id) == declared:
+            return self.ingress.get(client_id)
+        self.ingress_formats[client_id] = declared
+        try:
+            normalizer = IngressNormalizer(
+                sample_rate, channels, encoding, rate_out=SEND_SAMPLE_RATE
+            )
+        except ValueError:
+            self.ingress.pop(client_id, None)
+            self.ingress_rejected.setdefault(client_id, 0)
+            raise
+        self.ingress_rejected.pop(client_id, None)
+        if normalizer.passthrough:
+            self.ingress.pop(client_id, None)
+            normalizer = None
+        else:
+            self.ingress[client_id] = normalizer
+        logger.info(
+            "Client %s sending %d Hz, %d ch, %s audio",
+            client_id,
+            sample_rate,
+            channels,
+            encoding,
+            extra={"client_id": client_id},
+        )
+        return normalizer
+
+    def create_outbound(self, client_id, websocket):
+        """
+        Create the outbound scheduler for a client. The caller runs its
+        ``run()`` as one of the session's tasks.
+        """
+        bytes_per_ms = RECEIVE_SAMPLE_RATE * 2 / 1000
+
+        async def send_audio(pcm):
+            await self._encode_and_send(client_id, websocket, pcm)
+
+        outbound = OutboundScheduler(
+            websocket.send,
+            send_audio,
+            int(bytes_per_ms * self.EGRESS_QUEUE_MAX_MS),
+            self.EGRESS_QUEUE_POLICY,
+            coalesce_bytes=int(bytes_per_ms * self.EGRESS_COALESCE_MS),
+        )
+        self.outbound[client_id] = outbound
+        return outbound
+
+    async def close_outbound(self, client_id):
+        """Send control messages still queued for a client that is leaving"""
+        outbound = self.outbound.get(client_id)
+        if outbound is not None:
+            await outbound.flush_control()
+
+    async def send_message(self, client_id, websocket, message, control=False):
+        """
+        Send a JSON message to a client through its outbound scheduler.
+
+        Control messages jump ahead of queued audio; others stay in order
+        with it. Without a scheduler the message is sent directly.
+        """
+        outbound = self.outbound.get(client_id)
+        if outbound is None:
+            await websocket.send(message)
+        elif control:
+            outbound.send_control(message)
+        else:
+            outbound.send_message(message)
+
+    async def send_audio(self, client_id, websocket, audio_bytes):
+        """Queue model audio for a client; it is encoded when it is sent"""
+        outbound = self.outbound.get(client_id)
+        if outbound is None:
+            await self._encode_and_send(client_id, websocket, audio_bytes)
+        else:
+            await outbound.put_audio(audio_bytes)
+
+    async def _encode_and_send(self, client_id, websocket, audio_bytes):
+        """Send model audio to a client using its negotiated framing and codec"""
+        encoder = self.encoders.get(client_id)
+        if encoder is not None:
+            audio_bytes = encoder.encode(audio_bytes)
+            if not audio_bytes:
+                return  # The codec is still filling a packet
+        await self._send_audio_frame(client_id, websocket, audio_bytes, encoder)
 
-        self.last_activity[client_id] = datetime.utcnow()
+    async def end_audio_turn(self, client_id, websocket, interrupted=False):
+        """
+        Flush audio the client's codec is holding at the end of a turn, in
+        order after the turn's queued audio. An interrupted turn's queued
+        audio and codec state are dropped at once instead.
+        """
+        outbound = self.outbound.get(client_id)
+        encoder = self.encoders.get(client_id)
+        if interrupted:
+            if outbound is not None:
+                outbound.interrupt()
+            if encoder is not None:
+                encoder.reset()
+            return
+        if encoder is None:
+            return
 
-    async def check_inactivity(self, client_id, session=None, websocket=None):
-        """Check for client inactivity and handle timeouts"""
-        from datetime import datetime
+        async def flush():
+            tail = encoder.flush()
+            if tail:
+                await self._send_audio_frame(client_id, websocket, tail, encoder)
 
-        if client_id not in self.last_activity or self.last_activity[client_id] is None:
-            return False
+        if outbound is None:
+            await flush()
+        else:
+            outbound.call(flush)
 
-        now = datetime.utcnow()
-        last = self.last_activity[client_id]
-        idle_seconds = (now - last).total_seconds()
+    async def _send_audio_frame(self, client_id, websocket, payload, encoder):
+        if self.framing.get(client_id) == FRAMING_BINARY:
+            seq = self.egress_seq.get(client_id, 0)
+            self.egress_seq[client_id] = seq + 1
+            frame = encode_audio_frame(
+                payload,
+                RECEIVE_SAMPLE_RATE,
+                seq,
+                encoder.codec_id if encoder else CODEC_PCM16,
+            )
+        else:
+            frame = encode_json_audio(payload, encoder.name if encoder else None)
+        client_audio_frames_out.inc()
+        client_audio_bytes_out.inc(len(frame))
+        await websocket.send(frame)
+
+    def create_audio_queue(self, client_id, websocket):
+        """
+        Create the bounded ingress audio buffer for a client.
 
-        # Skip if we don't have a session to send messages
-        if not session or not websocket:
-            return False
+        Crossing the high watermark sends {"type": "pause"} to the client;
+        draining below the low watermark sends {"type": "resume"}.
+        """
 
-        if idle_seconds >= self.INACTIVITY_DISCONNECT_TIMEOUT:
+        def on_flow_change(paused):
+            message = json.dumps({"type": "pause" if paused else "resume"})
             logger.info(
-                f"🔴 Client {client_id} inactive for {idle_seconds}s - disconnecting"
+                "Client %s flow control: %s",
+                client_id,
+                "pause" if paused else "resume",
+                extra={"client_id": client_id},
             )
-            try:
-                await session.send_realtime_input(
-                    text="Since you're not responding, I'm ending this session now. Talk to you later!"
+            outbound = self.outbound.get(client_id)
+            if outbound is not None:
+                outbound.send_control(message)
+                return
+            task = asyncio.ensure_future(self._send_quietly(websocket, message))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+        max_bytes = int(SEND_SAMPLE_RATE * 2 * self.AUDIO_QUEUE_MAX_MS / 1000)
+        audio_queue = BoundedAudioQueue(
+            max_bytes, self.AUDIO_QUEUE_POLICY, on_flow_change=on_flow_change
+        )
+        self.audio_queues[client_id] = audio_queue
+        return audio_queue
+
+    async def _send_quietly(self, websocket, message):
+        try:
+            await websocket.send(message)
+        except Exception:
+            pass  # Client is gone; cleanup happens elsewhere
+
+    def gate_audio(self, client_id, audio_bytes):
+        """
+        Run client audio through the session's VAD.
+
+        Returns the audio to forward upstream (possibly empty). Detected
+        speech counts as client activity immediately.
+        """
+        tracer = self.tracers.get(client_id)
+        if not self.VAD_ENABLED:
+            if tracer:
+                tracer.user_audio()
+            return audio_bytes
+        vad = self.vad.get(client_id)
+        if vad is None:
+            vad = self.vad[client_id] = VoiceActivityDetector(
+                SEND_SAMPLE_RATE,
+                preroll_ms=self.VAD_PREROLL_MS,
+                hangover_ms=self.VAD_HANGOVER_MS,
+                thin_every=self.VAD_THIN_EVERY,
+            )
+        was_speaking = vad.in_speech
+        audio_bytes, speech = vad.process(audio_bytes)
+        if speech:
+            self.update_activity(client_id, from_client=True)
+            if not was_speaking:
+                log_event(
+                    logger,
+                    logging.INFO,
+                    client_id,
+                    "activity",
+                    "🗣️ Activity updated - speech detected",
                 )
-                await websocket.send(
-                    json.dumps(
-                        {"type": "timeout", "data": "Session ended due to inactivity"}
-                    )
+        if tracer:
+            if speech:
+                tracer.speech()
+            elif audio_bytes:
+                tracer.user_audio()
+        return audio_bytes
+
+    async def forward_audio(self, client_id, audio_queue, send):
+        """
+        Send queued client audio upstream in coalesced chunks.
+
+        ``send`` is an async callable that delivers one PCM chunk to the
+        model. Runs until the client's session is stopped.
+        """
+        coalescer = AudioCoalescer(
+            SEND_SAMPLE_RATE, self.COALESCE_TARGET_MS, self.COALESCE_MAX_DELAY_MS
+        )
+
+        async def counted_send(data):
+            upstream_audio_bytes_out.inc(len(data))
+            await send(data)
+
+        try:
+            await forward_coalesced(
+                audio_queue,
+                counted_send,
+                coalescer,
+                lambda: self.should_stop.get(client_id, True),
+            )
+        finally:
+            frames_per_s, chunks_per_s = coalescer.rates()
+            if coalescer.frames_in:
+                logger.info(
+                    "Client %s upstream audio: %d frames (%.1f/s) coalesced into "
+                    "%d chunks (%.1f/s)",
+                    client_id,
+                    coalescer.frames_in,
+                    frames_per_s,
+                    coalescer.chunks_out,
+                    chunks_per_s,
+                    extra={"client_id": client_id},
                 )
-            except:
-                pass  # Ignore errors during disconnect message
-            await self.cleanup_client(client_id)
-            return True
-        elif idle_seconds >= self.INACTIVITY_WARNING_TIMEOUT:
-            logger.info(f"🟡 Client {client_id} inactive for {idle_seconds}s - warning")
+
+    def request_stop(self, client_id):
+        """Ask a client's session to end; supervise_session cancels its tasks"""
+        self.should_stop[client_id] = True
+        stop_event = self.stop_events.get(client_id)
+        if stop_event:
+            stop_event.set()
+
+    async def supervise_session(self, client_id, tasks):
+        """
+        Cancel a client's session tasks once request_stop is called or any
+        of them finishes, so no task outlives its session.
+        """
+        stop_event = self.stop_events.setdefault(client_id, asyncio.Event())
+        stop_waiter = asyncio.ensure_future(stop_event.wait())
+        try:
+            await asyncio.wait(
+                [stop_waiter, *tasks], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            stop_waiter.cancel()
+            self.should_stop[client_id] = True
+            for task in tasks:
+                task.cancel()
+
+    def update_activity(self, client_id, from_client=False):
+        """
+        Record activity for a client.
+
+        Only the timestamp changes; the scheduler picks up the new deadline
+        when the current one fires. Activity from the client itself (speech,
+        text) also re-arms the inactivity warning.
+        """
+        self.last_activity[client_id] = time.monotonic()
+        if from_client:
+            self.inactivity_warned[client_id] = False
+
+    def start_inactivity_timer(self, client_id):
+        """Start tracking inactivity for a client on the shared scheduler"""
+        self.update_activity(client_id, from_client=True)
+        self.scheduler.schedule(
+            client_id,
+            self.last_activity[client_id] + self.INACTIVITY_WARNING_TIMEOUT,
+            self.check_inactivity,
+        )
+
+    async def check_inactivity(self, client_id):
+        """Scheduler callback: warn or disconnect an idle client, or reschedule"""
+        last = self.last_activity.get(client_id)
+        if last is None or self.should_stop.get(client_id, True):
+            return
+
+        idle_seconds = time.monotonic() - last
+        if idle_seconds < self.INACTIVITY_WARNING_TIMEOUT:
+            # Activity since this deadline was set; push it forward
+            self.scheduler.schedule(
+                client_id, last + self.INACTIVITY_WARNING_TIMEOUT, self.check_inactivity
+            )
+        elif idle_seconds < self.INACTIVITY_DISCONNECT_TIMEOUT or not (
+            self.inactivity_warned.get(client_id)
+        ):
+            if not self.inactivity_warned.get(client_id):
+                logger.info(
+                    "🟡 Client %s inactive for %.1fs - warning",
+                    client_id,
+                    idle_seconds,
+                    extra={"client_id": client_id},
+                )
+                self.inactivity_warned[client_id] = True
+                inactivity_warnings.inc()
+                try:
+                    await self.prompt_model(
+                        client_id,
+                        "Are you still there? Let me know if you need help with anything else.",
+                    )
+                except Exception as e:
+                    logger.error(
+                        "Error sending inactivity warning: %s",
+                        e,
+                        extra={"client_id": client_id},
+                    )
+            grace = self.INACTIVITY_DISCONNECT_TIMEOUT - self.INACTIVITY_WARNING_TIMEOUT
+            self.scheduler.schedule(
+                client_id,
+                max(
+                    last + self.INACTIVITY_DISCONNECT_TIMEOUT, time.monotonic() + grace
+                ),
+                self.check_inactivity,
+            )
+        else:
+            logger.info(
+                "🔴 Client %s inactive for %.1fs - disconnecting",
+                client_id,
+                idle_seconds,
+                extra={"client_id": client_id},
+            )
             try:
-                await session.send_realtime_input(
-                    text="Are you still there? Let me know if you need help with anything else."
+                await self.prompt_model(
+                    client_id,
+                    "Since you're not responding, I'm ending this session now. Talk to you later!",
                 )
-            except:
-                pass  # Ignore errors during warning message
-            return False
+                websocket = self.active_clients.get(client_id)
+                if websocket:
+                    await self.send_message(
+                        client_id,
+                        websocket,
+                        json.dumps(
+                            {
+                                "type": "timeout",
+                                "data": "Session ended due to inactivity",
+                            }
+                        ),
+                        control=True,
+                    )
+            except Exception as e:
+                logger.error(
+                    "Error sending inactivity disconnect: %s",
+                    e,
+                    extra={"client_id": client_id},
+                )
+            # A session ended for inactivity should not be resumed
+            self.resumption.discard(self.client_tokens.pop(client_id, None))
+            self.set_end_reason(client_id, "inactivity")
+            self.request_stop(client_id)
 
-        return False
+    async def prompt_model(self, client_id, text):
+        """Send a text prompt to the client's upstream session"""
+        session = self.upstream_sessions.get(client_id)
+        if session is not None:
+            await session.send_realtime_input(text=text)
 
     async def process_audio(self, websocket, client_id):
         """
@@ -1,28 +1,324 @@
-from pydub import AudioSegment
+"""
+Batch conversion of recordings to the audio format the servers ingest.
+
+Inputs may be files, directories (searched recursively for audio files) or
+glob patterns. Each file is read and converted chunk by chunk with the
+server's own ingress normalizer (see resampler.py), so memory stays bounded
+by the chunk size however long the recording is, and files are spread over
+a process pool. WAV files are read with the standard library; other formats
+are streamed through ffmpeg. Outputs at least as new as their input are
+skipped, so reruns only convert what changed.
+
+Output is 16 kHz mono 16-bit PCM, as WAV or as headerless raw PCM.
+
+Examples:
+
+    python convert_audio.py test_audio.wav
+    python convert_audio.py recordings/ "extra/**/*.mp3" -o converted/ -j 8
+    python convert_audio.py recordings/ -o replay/ --format raw
+"""
+
+import argparse
+import glob
 import os
+import shutil
+import subprocess
+import sys
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from resampler import ENCODING_FLOAT32, ENCODING_INT16, IngressNormalizer
+
+SAMPLE_RATE = 16000  # Rate the servers expect from clients
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+FORMAT_WAV = "wav"
+FORMAT_RAW = "raw"
+OUTPUT_EXTENSIONS = {FORMAT_WAV: ".wav", FORMAT_RAW: ".pcm"}
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".webm"}
+
+# Outputs written next to their input get this suffix, and inputs that
+# already carry it are not converted again
+OUTPUT_SUFFIX = "_converted"
+
+DEFAULT_INPUT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "test_audio.wav"
+)
+
+
+def find_inputs(patterns):
+    """
+    Expand files, directories and glob patterns into audio files.
+
+    Returns a list of (path, base) pairs, where ``base`` is the directory
+    that output paths are made relative to.
+    """
+    found = {}
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = [(p, path) for p in sorted(path.rglob("*")) if _is_audio_input(p)]
+        elif path.is_file():
+            matches = [(path, path.parent)]
+        else:
+            # The base of a glob is its leading part without wildcards
+            parts = path.parts
+            fixed = next(
+                (i for i, part in enumerate(parts) if glob.has_magic(part)), len(parts)
+            )
+            base = Path(*parts[:fixed]) if fixed else Path(".")
+            matches = [
+                (Path(p), base)
+                for p in sorted(glob.glob(pattern, recursive=True))
+                if _is_audio_input(Path(p))
+            ]
+        if not matches:
+            print(f"No audio files match {pattern}", file=sys.stderr)
+        for match, base in matches:
+            found.setdefault(match.resolve(), (match, base))
+    return list(found.values())
+
+
+def _is_audio_input(path):
+    return (
+        path.is_file()
+        and path.suffix.lower() in AUDIO_EXTENSIONS
+        and not path.stem.endswith(OUTPUT_SUFFIX)
+    )
+
+
+def output_path(path, base, output_dir, fmt):
+    """Where the converted form of ``path`` goes."""
+    extension = OUTPUT_EXTENSIONS[fmt]
+    if output_dir is None:
+        return path.with_name(path.stem + OUTPUT_SUFFIX + extension)
+    relative = path.relative_to(base) if path.is_relative_to(base) else path.name
+    return Path(output_dir) / Path(relative).with_suffix(extension)
+
+
+def is_up_to_date(source, target):
+    try:
+        return target.stat().st_mtime >= source.stat().st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def _wav_chunks(path, chunk_ms):
+    """
+    Stream a PCM WAV file as (normalizer, chunks). 16-bit audio is passed on
+    as is; other sample widths are converted to float32 per chunk.
+    """
+    wav_file = wave.open(str(path), "rb")
+    rate = wav_file.getframerate()
+    channels = wav_file.getnchannels()
+    width = wav_file.getsampwidth()
+    frames = max(1, rate * chunk_ms // 1000)
+    encoding = ENCODING_INT16 if width == 2 else ENCODING_FLOAT32
+    try:
+        normalizer = IngressNormalizer(rate, channels, encoding, rate_out=SAMPLE_RATE)
+    except ValueError:
+        wav_file.close()
+        raise
+
+    def chunks():
+        with wav_file:
+            while True:
+                data = wav_file.readframes(frames)
+                if not data:
+                    return
+                yield data if width == 2 else _to_float32(data, width)
+
+    return normalizer, chunks()
+
+
+def _to_float32(data, width):
+    """Integer PCM of 1, 3 or 4 bytes per sample to float32 bytes."""
+    if width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 3:
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3)
+        packed = np.zeros((len(raw), 4), np.uint8)
+        packed[:, 1:] = raw  # Little-endian: the low byte stays zero
+        samples = packed.view("<i4")[:, 0].astype(np.float32) / 2**31
+    elif width == 4:
+        samples = np.frombuffer(data, "<i4").astype(np.float32) / 2**31
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width} bytes")
+    return samples.astype("<f4").tobytes()
+
+
+def _ffmpeg_chunks(path, chunk_ms):
+    """Stream any format ffmpeg can decode, converted by ffmpeg itself."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError(f"ffmpeg is needed to read {path.suffix} files")
+    normalizer = IngressNormalizer(SAMPLE_RATE, rate_out=SAMPLE_RATE)
+    chunk_bytes = SAMPLE_RATE * SAMPLE_WIDTH * chunk_ms // 1000
+
+    def chunks():
+        process = subprocess.Popen(
+            [ffmpeg, "-v", "error", "-i", str(path), "-f", "s16le"]
+            + ["-ac", "1", "-ar", str(SAMPLE_RATE), "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            while data := process.stdout.read(chunk_bytes):
+                yield data
+            stderr = process.stderr.read().decode(errors="replace").strip()
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg failed: {stderr}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+
+    return normalizer, chunks()
+
+
+def open_audio(path, chunk_ms):
+    """Return (normalizer, iterator of raw chunks) for an input file."""
+    if path.suffix.lower() == ".wav":
+        try:
+            return _wav_chunks(path, chunk_ms)
+        except wave.Error:
+            pass  # Compressed or float WAV: let ffmpeg decode it
+    return _ffmpeg_chunks(path, chunk_ms)
+
+
+def convert_file(source, target, fmt=FORMAT_WAV, chunk_ms=1000):
+    """
+    Convert one file to 16 kHz mono PCM, one chunk in memory at a time.
+
+    The output is written to a temporary name and renamed into place, so an
+    interrupted run never leaves a truncated file that looks up to date.
+    Returns (input bytes, output bytes).
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".part")
+    normalizer, chunks = open_audio(source, chunk_ms)
+    try:
+        if fmt == FORMAT_WAV:
+            out = wave.open(str(partial), "wb")
+            out.setnchannels(1)
+            out.setsampwidth(SAMPLE_WIDTH)
+            out.setframerate(SAMPLE_RATE)
+            write = out.writeframes
+        else:
+            out = open(partial, "wb")
+            write = out.write
+        with out:
+            for chunk in chunks:
+                write(normalizer.process(chunk))
+        os.replace(partial, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    return source.stat().st_size, normalizer.bytes_out
+
 
-input_file = "test_audio.wav"
-output_file = "test_audio_converted.wav"
+def convert_all(jobs, workers, fmt, chunk_ms):
+    """
+    Convert (source, target) pairs, in a process pool if ``workers`` > 1.
 
+    Yields (source, result or exception) as files finish.
+    """
+    if workers <= 1:
+        for source, target in jobs:
+            try:
+                yield source, convert_file(source, target, fmt, chunk_ms)
+            except Exception as e:
+                yield source, e
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(convert_file, source, target, fmt, chunk_ms): source
+            for source, target in jobs
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
 
-def convert_audio():
-    # Load the audio file
-    audio = AudioSegment.from_wav(input_file)
 
-    # Convert to mono if stereo
-    if audio.channels > 1:
-        audio = audio.set_channels(1)
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert recordings to 16 kHz mono 16-bit PCM for the servers"
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        default=[DEFAULT_INPUT],
+        help="Files, directories or glob patterns (default: test_audio.wav)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help=f"Mirror inputs here; by default outputs go next to their input "
+        f"with a {OUTPUT_SUFFIX} suffix",
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(OUTPUT_EXTENSIONS),
+        default=FORMAT_WAV,
+        help="WAV, or headerless little-endian PCM (.pcm)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    parser.add_argument(
+        "--chunk-ms", type=int, default=1000, help="Audio read per step per file"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Convert even if outputs are up to date"
+    )
+    args = parser.parse_args()
 
-    # Convert sample rate to 16kHz
-    audio = audio.set_frame_rate(16000)
+    start = time.perf_counter()
+    jobs = []
+    skipped = 0
+    for source, base in find_inputs(args.inputs):
+        target = output_path(source, base, args.output_dir, args.format)
+        if not args.force and is_up_to_date(source, target):
+            skipped += 1
+        else:
+            jobs.append((source, target))
 
-    # Export the converted file
-    audio.export(output_file, format="wav")
+    converted = failed = bytes_in = bytes_out = 0
+    workers = min(args.jobs, len(jobs))
+    for source, result in convert_all(jobs, workers, args.format, args.chunk_ms):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"Failed to convert {source}: {result}", file=sys.stderr)
+            continue
+        converted += 1
+        bytes_in += result[0]
+        bytes_out += result[1]
+    elapsed = time.perf_counter() - start
 
-    print(f"Converted {input_file} to mono, 16kHz and saved as {output_file}")
-    print(f"Original file size: {os.path.getsize(input_file) / 1024:.2f}KB")
-    print(f"Converted file size: {os.path.getsize(output_file) / 1024:.2f}KB")
+    audio_seconds = bytes_out / (SAMPLE_RATE * SAMPLE_WIDTH)
+    print(
+        f"Converted {converted} files ({skipped} up to date, {failed} failed) "
+        f"with {workers} workers in {elapsed:.2f}s"
+    )
+    if converted:
+        print(
+            f"{audio_seconds / 60:.1f} min of audio, "
+            f"{audio_seconds / elapsed:.0f}x real time, "
+            f"{converted / elapsed:.1f} files/s, "
+            f"{bytes_in / 1e6:.1f} MB read ({bytes_in / 1e6 / elapsed:.1f} MB/s), "
+            f"{bytes_out / 1e6:.1f} MB written"
+        )
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    convert_audio()
+    sys.exit(main())
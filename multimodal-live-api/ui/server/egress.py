@@ -0,0 +1,234 @@
+"""
+Per-session outbound message scheduling.
+
+Sending to the client inline in the upstream receive loop means a slow
+client stalls upstream consumption, and model audio produced before an
+interruption is still sent although the client throws it away. With an
+``OutboundScheduler`` the receive loop only enqueues; a per-session task
+writes to the socket. Messages go in one of two lanes:
+
+    control  interrupted, timeout, session_id, pause/resume: sent ahead of
+             everything already queued
+    stream   model audio, transcripts and turn_complete, sent in order so
+             turn_complete never overtakes the audio of its turn
+
+Audio in the stream lane is raw PCM, encoded only when it is sent. When the
+client falls behind, consecutive queued chunks are coalesced into one frame
+of up to ``coalesce_bytes``. Buffered audio is bounded in bytes, with the
+same overflow policies as the ingress queue (see flow_control.py), and
+``interrupt()`` discards it at once. Egress lag, the time from enqueueing a
+message to handing it to the socket, is tracked per session and exported as
+a histogram per lane.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from flow_control import POLICIES, POLICY_BLOCK, POLICY_DROP_NEWEST
+from metrics import counter, histogram
+
+_AUDIO = 0
+_MESSAGE = 1
+_CALL = 2
+
+control_lag = histogram(
+    "egress_lag_seconds", "Time from enqueue to socket send", {"lane": "control"}
+)
+stream_lag = histogram(
+    "egress_lag_seconds", "Time from enqueue to socket send", {"lane": "stream"}
+)
+audio_dropped = counter(
+    "egress_audio_bytes_dropped_total", "Model audio bytes dropped on overflow"
+)
+audio_discarded = counter(
+    "egress_audio_bytes_discarded_total",
+    "Queued model audio bytes discarded on interruption",
+)
+audio_coalesced = counter(
+    "egress_audio_chunks_coalesced_total",
+    "Queued model audio chunks merged into a preceding frame",
+)
+
+
+class OutboundScheduler:
+    """Prioritized, bounded outbound queue for one client session."""
+
+    def __init__(self, send, send_audio, max_bytes, policy, coalesce_bytes=0):
+        """
+        Args:
+            send: async callable that writes one message to the socket
+            send_audio: async callable that encodes and sends a PCM chunk
+            max_bytes: PCM buffered before the overflow policy applies
+            policy: ``flow_control`` overflow policy
+            coalesce_bytes: largest frame built from queued chunks, 0
+                disables coalescing
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.send = send
+        self.send_audio = send_audio
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.coalesce_bytes = coalesce_bytes
+        self.control = deque()  # (message, enqueued at)
+        self.stream = deque()  # (kind, payload, enqueued at)
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+
+        # Per-session stats
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.audio_sent = 0
+        self.dropped_bytes = 0
+        self.discarded_bytes = 0
+        self.coalesced = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_count = 0
+
+    def __len__(self):
+        return len(self.control) + len(self.stream)
+
+    def send_control(self, message):
+        """Queue a message ahead of everything in the stream lane."""
+        self.control.append((message, time.monotonic()))
+        self._ready.set()
+
+    def send_message(self, message):
+        """Queue a message in order with the model audio."""
+        self.stream.append((_MESSAGE, message, time.monotonic()))
+        self._ready.set()
+
+    def call(self, fn):
+        """Queue an async callable to run in order with the model audio."""
+        self.stream.append((_CALL, fn, time.monotonic()))
+        self._ready.set()
+
+    async def put_audio(self, pcm):
+        """Queue model audio, applying the overflow policy when full."""
+        if self.bytes and self.bytes + len(pcm) > self.max_bytes:
+            if self.policy == POLICY_BLOCK:
+                while self.bytes and self.bytes + len(pcm) > self.max_bytes:
+                    self._space.clear()
+                    await self._space.wait()
+            elif self.policy == POLICY_DROP_NEWEST:
+                self._drop(len(pcm))
+                return
+            else:
+                self._drop_oldest(len(pcm))
+        self.stream.append((_AUDIO, pcm, time.monotonic()))
+        self.bytes += len(pcm)
+        if self.bytes > self.peak_bytes:
+            self.peak_bytes = self.bytes
+        self._ready.set()
+
+    def _drop(self, size):
+        self.dropped_bytes += size
+        audio_dropped.inc(size)
+
+    def _drop_oldest(self, incoming):
+        kept = deque()
+        for item in self.stream:
+            if item[0] == _AUDIO and self.bytes + incoming > self.max_bytes:
+                self.bytes -= len(item[1])
+                self._drop(len(item[1]))
+            else:
+                kept.append(item)
+        self.stream = kept
+
+    def interrupt(self):
+        """Discard all queued model audio; messages stay queued."""
+        if not self.bytes:
+            return
+        self.discarded_bytes += self.bytes
+        audio_discarded.inc(self.bytes)
+        self.stream = deque(item for item in self.stream if item[0] != _AUDIO)
+        self.bytes = 0
+        self._space.set()
+
+    def oldest_age(self, now=None):
+        """Seconds the oldest queued message has waited, 0 if none."""
+        heads = [lane[0][-1] for lane in (self.control, self.stream) if lane]
+        if not heads:
+            return 0.0
+        return (now or time.monotonic()) - min(heads)
+
+    def _observe(self, histogram, queued_at):
+        lag = time.monotonic() - queued_at
+        histogram.observe(lag)
+        self.lag_total += lag
+        self.lag_count += 1
+        if lag > self.lag_max:
+            self.lag_max = lag
+
+    def _take_audio(self, pcm):
+        # Merge audio queued behind this chunk while it fits in one frame
+        self.bytes -= len(pcm)
+        if not self.coalesce_bytes:
+            return pcm
+        parts = [pcm]
+        size = len(pcm)
+        stream = self.stream
+        while stream and stream[0][0] == _AUDIO:
+            following = stream[0][1]
+            if size + len(following) > self.coalesce_bytes:
+                break
+            stream.popleft()
+            self.bytes -= len(following)
+            parts.append(following)
+            size += len(following)
+        if len(parts) == 1:
+            return pcm
+        self.coalesced += len(parts) - 1
+        audio_coalesced.inc(len(parts) - 1)
+        return b"".join(parts)
+
+    async def run(self):
+        """Write queued messages to the socket until cancelled."""
+        while True:
+            if not self.control and not self.stream:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.control:
+                message, queued_at = self.control.popleft()
+                self._observe(control_lag, queued_at)
+                await self.send(message)
+                continue
+            kind, payload, queued_at = self.stream.popleft()
+            self._observe(stream_lag, queued_at)
+            if kind == _AUDIO:
+                payload = self._take_audio(payload)
+                self._space.set()
+                self.audio_sent += len(payload)
+                await self.send_audio(payload)
+            elif kind == _MESSAGE:
+                await self.send(payload)
+            else:
+                await payload()
+
+    async def flush_control(self, timeout=1.0):
+        """
+        Send control messages still queued when the session ends, such as
+        the inactivity timeout notice. Best effort: errors are swallowed.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                while self.control:
+                    message, _ = self.control.popleft()
+                    await self.send(message)
+        except Exception:
+            pass  # Client is gone
+
+    def summary(self):
+        """Per-session egress stats for the disconnect log."""
+        return {
+            "audio_bytes": self.audio_sent,
+            "lag_avg": self.lag_total / self.lag_count if self.lag_count else 0.0,
+            "lag_max": self.lag_max,
+            "peak_bytes": self.peak_bytes,
+            "coalesced": self.coalesced,
+            "dropped_bytes": self.dropped_bytes,
+            "discarded_bytes": self.discarded_bytes,
+        }
@@ -0,0 +1,104 @@
+"""
+Bounded per-session ingress audio buffer with client flow control.
+
+When upstream stalls, an unbounded queue grows without limit and every
+new frame waits behind stale audio. ``BoundedAudioQueue`` caps the buffered
+audio in bytes and applies one of three overflow policies:
+
+    block        producers wait for space (backpressure on the socket)
+    drop_oldest  discard the oldest buffered frame to make room
+    drop_newest  discard the incoming frame
+
+It also tracks high/low watermarks and reports crossings through a
+callback, which the server turns into ``pause``/``resume`` messages so the
+client can throttle capture before anything is dropped.
+"""
+
+import asyncio
+
+from metrics import counter
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+POLICIES = [POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST]
+
+frames_dropped = counter(
+    "ingress_audio_frames_dropped_total", "Client audio frames dropped on overflow"
+)
+flow_pauses = counter("ingress_flow_pauses_total", "Pause messages sent to clients")
+
+
+class BoundedAudioQueue(asyncio.Queue):
+    """asyncio.Queue of PCM frames bounded by total buffered bytes."""
+
+    def __init__(
+        self,
+        max_bytes,
+        policy=POLICY_DROP_OLDEST,
+        high_watermark=0.75,
+        low_watermark=0.25,
+        on_flow_change=None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.high_bytes = int(max_bytes * high_watermark)
+        self.low_bytes = int(max_bytes * low_watermark)
+        self.on_flow_change = on_flow_change  # Called with True (pause) / False
+        self.paused = False
+
+        # Per-session stats
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.pauses = 0
+
+    def full(self):
+        return self.bytes >= self.max_bytes
+
+    def _put(self, item):
+        super()._put(item)
+        self.bytes += len(item)
+        if self.bytes > self.peak_bytes:
+            self.peak_bytes = self.bytes
+        if not self.paused and self.bytes >= self.high_bytes:
+            self.paused = True
+            self.pauses += 1
+            flow_pauses.inc()
+            if self.on_flow_change:
+                self.on_flow_change(True)
+
+    def _get(self):
+        item = super()._get()
+        self.bytes -= len(item)
+        if self.paused and self.bytes <= self.low_bytes:
+            self.paused = False
+            if self.on_flow_change:
+                self.on_flow_change(False)
+        return item
+
+    def _drop(self, item):
+        self.dropped_frames += 1
+        self.dropped_bytes += len(item)
+        frames_dropped.inc()
+
+    def put_nowait(self, item):
+        if self.full():
+            if self.policy == POLICY_DROP_NEWEST:
+                self._drop(item)
+                return
+            if self.policy == POLICY_DROP_OLDEST:
+                while self.full() and not self.empty():
+                    self._drop(self.get_nowait())
+                    self.task_done()
+        super().put_nowait(item)
+
+    async def put(self, item):
+        if self.policy == POLICY_BLOCK:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
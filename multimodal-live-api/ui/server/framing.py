@@ -0,0 +1,101 @@
+"""
+Binary WebSocket framing for audio.
+
+Audio travels as raw PCM in binary WebSocket frames prefixed with a small
+fixed header, while control messages (ready, text, turn_complete, ...) stay
+JSON text frames. Clients opt in by answering the server's ``ready`` offer
+with ``{"type": "framing", "mode": "binary"}``; clients that never answer
+keep the original base64-in-JSON protocol.
+
+Header layout (network byte order, 8 bytes):
+
+    kind         uint8   frame kind (FRAME_AUDIO)
+    codec        uint8   payload encoding (CODEC_*; see audio_codecs.py)
+    sample_rate  uint16  sample rate of the payload in Hz, 0 if unspecified
+    seq          uint32  per-direction frame counter, wraps at 2**32
+
+Rates above 65535 Hz (88.2/96 kHz) do not fit the header; senders put 0
+there and declare the rate with a ``format`` message instead.
+"""
+
+import base64
+import json
+import struct
+
+FRAMING_JSON = "json"
+FRAMING_BINARY = "binary"
+SUPPORTED_FRAMINGS = [FRAMING_BINARY, FRAMING_JSON]
+
+FRAME_HEADER = struct.Struct("!BBHI")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_HEADER_SAMPLE_RATE = 0xFFFF
+
+FRAME_AUDIO = 1
+
+CODEC_PCM16 = 0
+CODEC_MULAW = 1
+CODEC_ALAW = 2
+CODEC_IMA_ADPCM = 3
+CODEC_OPUS = 4
+
+
+class FramingError(ValueError):
+    """Raised when a binary frame cannot be decoded."""
+
+
+def encode_audio_frame(payload, sample_rate, seq, codec=CODEC_PCM16):
+    """Build a binary audio frame: header followed by the raw payload."""
+    if sample_rate > MAX_HEADER_SAMPLE_RATE:
+        sample_rate = 0
+    header = FRAME_HEADER.pack(FRAME_AUDIO, codec, sample_rate, seq & 0xFFFFFFFF)
+    return header + payload
+
+
+def decode_frame(frame):
+    """Split a binary frame into (kind, codec, sample_rate, seq, payload)."""
+    if len(frame) < FRAME_HEADER_SIZE:
+        raise FramingError(f"Frame too short: {len(frame)} bytes")
+    kind, codec, sample_rate, seq = FRAME_HEADER.unpack_from(frame)
+    payload = bytes(frame[FRAME_HEADER_SIZE:])
+    return kind, codec, sample_rate, seq, payload
+
+
+def encode_json_audio(payload, codec=None):
+    """
+    Encode audio with the legacy base64-in-JSON protocol.
+
+    ``codec`` names a negotiated compressed encoding; PCM omits it so
+    clients that predate codec negotiation keep working.
+    """
+    message = {"type": "audio", "data": base64.b64encode(payload).decode("utf-8")}
+    if codec is not None:
+        message["codec"] = codec
+    return json.dumps(message)
+
+
+def decode_message(message):
+    """
+    Decode an incoming WebSocket message into a message dict.
+
+    Binary frames become ``{"type": "audio", "data": <bytes>, ...}``; JSON
+    audio messages are base64-decoded into the same shape, so callers handle
+    both framings identically. Other JSON messages are returned as parsed.
+    Raises json.JSONDecodeError for malformed text frames and FramingError
+    for malformed binary frames.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        kind, codec, sample_rate, seq, payload = decode_frame(message)
+        if kind != FRAME_AUDIO:
+            raise FramingError(f"Unknown frame kind: {kind}")
+        return {
+            "type": "audio",
+            "data": payload,
+            "codec": codec,
+            "sample_rate": sample_rate,
+            "seq": seq,
+        }
+
+    data = json.loads(message)
+    if data.get("type") == "audio":
+        data["data"] = base64.b64decode(data.get("data", ""))
+    return data
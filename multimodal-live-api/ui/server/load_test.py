@@ -1,123 +1,507 @@
+"""
+Latency/throughput benchmark for the audio WebSocket servers.
+
+Each simulated client connects, waits for ``ready`` (and optionally the
+greeting turn), then streams a WAV file in client-sized chunks paced in real
+time, followed by trailing silence so server-side end-of-speech detection can
+fire. Clients arrive according to a load profile:
+
+    constant  fixed arrival rate (--rate clients/s) for --duration seconds
+    ramp      --clients clients started linearly over --ramp-seconds
+    step      --step-clients new clients every --step-seconds, --steps times
+
+Per client it records connect time, time spent in the server's admission
+queue, time-to-first-audio and time-to-turn-complete (both measured from
+the end of the streamed speech, for the first model turn that starts after
+it), inter-chunk jitter of the model audio, and error/timeout/rejected
+outcomes. Results are written as per-client CSV rows and a JSON summary with
+p50/p95/p99 so runs can be diffed for regressions.
+
+Example, against the offline mock backend:
+
+    python server.py --backend mock &
+    python load_test.py --profile ramp --clients 200 --ramp-seconds 20 \\
+        --json results.json --csv results.csv
+"""
+
+import argparse
 import asyncio
-import websockets
+import csv
 import json
-import base64
-import time
 import logging
+import math
+import random
+import time
 import wave
 import os
+from array import array
 from pathlib import Path
 
+import websockets
+
+from framing import (
+    FRAMING_BINARY,
+    FRAMING_JSON,
+    decode_message,
+    encode_audio_frame,
+    encode_json_audio,
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
-# Test configuration
-NUM_CLIENTS = 100
-WEBSOCKET_URL = "ws://localhost:8765"
-SAMPLE_AUDIO_PATH = os.path.join(
+DEFAULT_AUDIO_PATH = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "test_audio.wav"
 )
-CONNECTION_TIMEOUT = 30  # Connection timeout in seconds
+SAMPLE_RATE = 16000  # Rate the servers expect from clients
+SAMPLE_WIDTH = 2  # 16-bit PCM
+
+# Metrics summarized with percentiles, in seconds unless noted
+LATENCY_METRICS = [
+    "connect_s",
+    "queue_wait_s",
+    "greeting_first_audio_s",
+    "first_audio_s",
+    "turn_complete_s",
+    "jitter_ms",
+    "max_gap_ms",
+]
+CSV_FIELDS = [
+    "client_id",
+    "start_offset_s",
+    "outcome",
+    "error",
+    *LATENCY_METRICS,
+    "audio_chunks",
+    "audio_bytes",
+    "sent_chunks",
+    "timeouts",
+    "errors",
+]
+
+
+def load_audio(path):
+    """Load 16 kHz mono 16-bit PCM from a WAV file, or synthesize a tone."""
+    if path and Path(path).exists():
+        with wave.open(path, "rb") as wav_file:
+            if (
+                wav_file.getframerate() != SAMPLE_RATE
+                or wav_file.getnchannels() != 1
+                or wav_file.getsampwidth() != SAMPLE_WIDTH
+            ):
+                logger.warning(
+                    f"{path} is not 16 kHz mono 16-bit PCM; convert it with "
+                    "convert_audio.py for meaningful results"
+                )
+            logger.info(f"Found WAV file: {path}")
+            return wav_file.readframes(wav_file.getnframes())
+
+    logger.warning(f"Test audio file {path} not found. Using a 2 s synthetic tone.")
+    step = 2 * math.pi * 440 / SAMPLE_RATE
+    return array(
+        "h", (int(8000 * math.sin(step * i)) for i in range(SAMPLE_RATE * 2))
+    ).tobytes()
 
 
-async def simulate_client(client_id):
-    """Simulate a single client connection and audio streaming."""
+def split_chunks(audio, chunk_ms):
+    chunk_bytes = int(SAMPLE_RATE * chunk_ms / 1000) * SAMPLE_WIDTH
+    return [audio[i : i + chunk_bytes] for i in range(0, len(audio), chunk_bytes)]
+
+
+def arrival_offsets(args):
+    """Return client start offsets (seconds from test start) for a profile."""
+    if args.profile == "constant":
+        offsets = []
+        t = 0.0
+        rng = random.Random(args.seed)
+        while t < args.duration:
+            offsets.append(t)
+            # Poisson arrivals keep the same mean rate but add realistic bursts
+            t += rng.expovariate(args.rate) if args.poisson else 1.0 / args.rate
+        return offsets
+    if args.profile == "ramp":
+        if args.clients <= 1:
+            return [0.0] * args.clients
+        return [args.ramp_seconds * i / (args.clients - 1) for i in range(args.clients)]
+    if args.profile == "step":
+        return [
+            step * args.step_seconds
+            for step in range(args.steps)
+            for _ in range(args.step_clients)
+        ]
+    raise ValueError(f"Unknown profile: {args.profile}")
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a non-empty list."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class ClientResult:
+    """Timings and outcome for one simulated client."""
+
+    def __init__(self, client_id, start_offset):
+        self.client_id = client_id
+        self.start_offset_s = start_offset
+        self.outcome = "pending"
+        self.error = ""
+        self.connect_s = None
+        self.queue_wait_s = None
+        self.greeting_first_audio_s = None
+        self.first_audio_s = None
+        self.turn_complete_s = None
+        self.jitter_ms = None
+        self.max_gap_ms = None
+        self.audio_chunks = 0
+        self.audio_bytes = 0
+        self.sent_chunks = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def as_row(self):
+        return {field: getattr(self, field) for field in CSV_FIELDS}
+
+
+class JitterTracker:
+    """RFC 3550-style interarrival jitter over model audio chunks."""
+
+    def __init__(self):
+        self.last_arrival = None
+        self.last_gap = None
+        self.jitter = 0.0
+        self.max_gap = 0.0
+
+    def reset_turn(self):
+        self.last_arrival = None
+        self.last_gap = None
+
+    def add(self, now):
+        if self.last_arrival is not None:
+            gap = now - self.last_arrival
+            self.max_gap = max(self.max_gap, gap)
+            if self.last_gap is not None:
+                self.jitter += (abs(gap - self.last_gap) - self.jitter) / 16
+            self.last_gap = gap
+        self.last_arrival = now
+
+
+async def simulate_client(client_id, start_offset, chunks, args):
+    """Simulate a single client streaming audio in real time."""
+    result = ClientResult(client_id, start_offset)
+    jitter = JitterTracker()
+    chunk_seconds = args.chunk_ms / 1000
+    silence = bytes(len(chunks[0])) if chunks else b""
+    silence_chunks = int(args.trailing_silence_ms / args.chunk_ms)
+
+    connect_start = time.perf_counter()
     try:
-        # Configure WebSocket with optimized settings for real-time streaming
         async with websockets.connect(
-            WEBSOCKET_URL,
+            args.url,
             ping_interval=20,
             ping_timeout=20,
-            max_size=2**23,  # 8MB max message size
+            max_size=2**23,
             compression=None,  # Disable compression for better real-time performance
-            close_timeout=10,
+            close_timeout=5,
+            open_timeout=args.connect_timeout,
         ) as websocket:
-            logger.info(f"Client {client_id} connected")
-
-            # Read and process audio file
-            if Path(SAMPLE_AUDIO_PATH).exists():
-                with wave.open(SAMPLE_AUDIO_PATH, "rb") as wav_file:
-                    audio_data = wav_file.readframes(wav_file.getnframes())
-            else:
-                # Use dummy audio if no file exists
-                audio_data = bytes([0] * 16000)  # 1 second of silence
-                logger.warning(
-                    f"Client {client_id} using dummy audio (no WAV file found)"
-                )
+            ready = json.loads(
+                await asyncio.wait_for(websocket.recv(), timeout=args.connect_timeout)
+            )
+            # A server at capacity queues us (bounded by its own max wait)
+            # or turns us away before sending ready
+            queued_at = time.perf_counter()
+            while ready.get("type") == "queued":
+                ready = json.loads(await websocket.recv())
+                result.queue_wait_s = time.perf_counter() - queued_at
+            if ready.get("type") == "rejected":
+                result.outcome = "rejected"
+                result.error = f"{ready['reason']}, retry after {ready['retry_after']}s"
+                return result
+            result.connect_s = time.perf_counter() - connect_start
+            ready_at = time.perf_counter()
 
-            # Base64 encode the audio data
-            b64_audio = base64.b64encode(audio_data).decode("utf-8")
+            framing = FRAMING_JSON
+            if args.framing == FRAMING_BINARY and FRAMING_BINARY in ready.get(
+                "framing", []
+            ):
+                await websocket.send(
+                    json.dumps({"type": "framing", "mode": FRAMING_BINARY})
+                )
+                framing = FRAMING_BINARY
 
-            # Send audio data
-            await websocket.send(json.dumps({"type": "audio", "data": b64_audio}))
+            greeting_done = asyncio.Event()
+            speech_end = None
+            # Model turns can start before the speech ends (the mock answers
+            # after a fixed amount of input). The response is measured from
+            # the first turn that starts after speech_end.
+            in_turn = False
+            stale_turn = False  # The turn in progress at speech_end
+            done = asyncio.Event()
 
-            # Listen for responses with timeout
-            try:
-                while True:
+            async def receive():
+                nonlocal in_turn, stale_turn
+                while not done.is_set():
                     try:
-                        response = await asyncio.wait_for(
-                            websocket.recv(), timeout=CONNECTION_TIMEOUT
+                        message = await asyncio.wait_for(
+                            websocket.recv(), timeout=args.response_timeout
                         )
-                        data = json.loads(response)
-
-                        if data.get("type") == "turn_complete":
-                            logger.info(f"Client {client_id} received turn complete")
-                            break
-                        elif data.get("type") == "text":
-                            logger.debug(
-                                f"Client {client_id} received text: {data.get('data')}"
-                            )
-                        elif data.get("type") == "audio":
-                            logger.debug(f"Client {client_id} received audio response")
-
                     except asyncio.TimeoutError:
+                        result.timeouts += 1
+                        result.outcome = "timeout"
                         logger.warning(
                             f"Client {client_id} timeout waiting for response"
                         )
                         break
-                    except websockets.exceptions.ConnectionClosed:
-                        logger.warning(f"Client {client_id} connection closed")
+                    now = time.perf_counter()
+                    data = decode_message(message)
+                    msg_type = data.get("type")
+
+                    if msg_type == "audio":
+                        result.audio_chunks += 1
+                        result.audio_bytes += len(data["data"])
+                        jitter.add(now)
+                        in_turn = True
+                        if speech_end is None:
+                            if result.greeting_first_audio_s is None:
+                                result.greeting_first_audio_s = now - ready_at
+                        elif result.first_audio_s is None and not stale_turn:
+                            result.first_audio_s = now - speech_end
+                    elif msg_type in ("turn_complete", "interrupted"):
+                        jitter.reset_turn()
+                        in_turn = False
+                        if speech_end is None:
+                            greeting_done.set()
+                        elif stale_turn:
+                            stale_turn = False
+                        elif msg_type == "turn_complete" and (
+                            result.first_audio_s is not None
+                        ):
+                            result.turn_complete_s = now - speech_end
+                            done.set()
+                    elif msg_type in ("timeout", "error"):
+                        result.errors += 1
+                        result.error = str(data.get("data", msg_type))
                         break
 
-            except Exception as e:
-                logger.error(f"Client {client_id} error during response handling: {e}")
+            async def send():
+                nonlocal speech_end, stale_turn
+                if args.wait_greeting:
+                    try:
+                        await asyncio.wait_for(
+                            greeting_done.wait(), timeout=args.response_timeout
+                        )
+                    except asyncio.TimeoutError:
+                        pass  # Servers without a greeting just start streaming
+
+                # Pace against absolute deadlines so scheduling delays don't accumulate
+                stream_start = time.perf_counter()
+                for i, chunk in enumerate(chunks + [silence] * silence_chunks):
+                    if done.is_set():
+                        return
+                    if i == len(chunks):
+                        speech_end = time.perf_counter()
+                        stale_turn = in_turn
+                    if framing == FRAMING_BINARY:
+                        await websocket.send(encode_audio_frame(chunk, SAMPLE_RATE, i))
+                    else:
+                        await websocket.send(encode_json_audio(chunk))
+                    result.sent_chunks += 1
+                    delay = stream_start + (i + 1) * chunk_seconds - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if speech_end is None:
+                    speech_end = time.perf_counter()
+                    stale_turn = in_turn
+
+            receiver = asyncio.create_task(receive())
+            sender = asyncio.create_task(send())
+            await receiver
+            done.set()
+            sender.cancel()
+            try:
+                await sender
+            except asyncio.CancelledError:
+                pass
+
+            if result.outcome == "pending":
+                result.outcome = "ok" if result.turn_complete_s is not None else "error"
 
+    except (asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as e:
+        result.timeouts += 1
+        result.outcome = "timeout"
+        result.error = repr(e)
+    except websockets.exceptions.ConnectionClosed as e:
+        result.errors += 1
+        result.outcome = "error" if result.turn_complete_s is None else "ok"
+        result.error = repr(e)
     except Exception as e:
+        result.errors += 1
+        result.outcome = "error"
+        result.error = repr(e)
         logger.error(f"Client {client_id} connection error: {e}")
 
+    if jitter.max_gap:
+        result.jitter_ms = jitter.jitter * 1000
+        result.max_gap_ms = jitter.max_gap * 1000
+    return result
 
-async def run_load_test():
-    """Run the load test with true concurrent connections."""
-    start_time = time.time()
 
-    # Create all client tasks at once for true concurrency
-    tasks = [simulate_client(i) for i in range(NUM_CLIENTS)]
-
-    # Run all tasks concurrently
+async def run_load_test(args):
+    """Run the load test following the selected arrival profile."""
+    audio = load_audio(args.audio)
+    chunks = split_chunks(audio, args.chunk_ms)
+    offsets = arrival_offsets(args)
     logger.info(
-        f"Starting load test with {NUM_CLIENTS} concurrent real-time connections"
+        f"Starting {args.profile} load test: {len(offsets)} clients over "
+        f"{offsets[-1] if offsets else 0:.1f}s, {len(chunks)} chunks of "
+        f"{args.chunk_ms}ms each, {args.framing} framing"
     )
-    await asyncio.gather(*tasks)
 
-    end_time = time.time()
-    duration = end_time - start_time
+    async def delayed_client(client_id, offset):
+        await asyncio.sleep(max(0.0, test_start + offset - time.perf_counter()))
+        return await simulate_client(client_id, offset, chunks, args)
 
-    logger.info(f"Load test completed in {duration:.2f} seconds")
-    logger.info(f"Average response time per client: {duration/NUM_CLIENTS:.2f} seconds")
+    test_start = time.perf_counter()
+    results = await asyncio.gather(
+        *(delayed_client(i, offset) for i, offset in enumerate(offsets))
+    )
+    duration = time.perf_counter() - test_start
+    return results, duration, len(audio) / (SAMPLE_RATE * SAMPLE_WIDTH)
 
 
-if __name__ == "__main__":
-    # Check audio file
-    if not Path(SAMPLE_AUDIO_PATH).exists():
-        logger.warning(
-            f"Test audio file {SAMPLE_AUDIO_PATH} not found. Will use dummy audio data."
+def summarize(results, duration, audio_seconds, args):
+    """Build the JSON summary with percentiles for every latency metric."""
+    outcomes = {}
+    for result in results:
+        outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+
+    metrics = {}
+    for name in LATENCY_METRICS:
+        values = [getattr(r, name) for r in results if getattr(r, name) is not None]
+        if not values:
+            continue
+        metrics[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": max(values),
+        }
+
+    completed = outcomes.get("ok", 0)
+    return {
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("csv", "json")
+        },
+        "clients": len(results),
+        "outcomes": outcomes,
+        "timeouts": sum(r.timeouts for r in results),
+        "errors": sum(r.errors for r in results),
+        "duration_s": duration,
+        "completed_per_s": completed / duration if duration else 0.0,
+        "audio_seconds_streamed": audio_seconds * completed,
+        "audio_bytes_received": sum(r.audio_bytes for r in results),
+        "metrics": metrics,
+    }
+
+
+def write_outputs(results, summary, args):
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for result in results:
+                writer.writerow(result.as_row())
+        logger.info(f"Wrote per-client results to {args.csv}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Wrote summary to {args.json}")
+
+
+def log_summary(summary):
+    logger.info(
+        f"Load test completed in {summary['duration_s']:.2f}s: "
+        f"{summary['clients']} clients, outcomes {summary['outcomes']}"
+    )
+    for name, stats in summary["metrics"].items():
+        logger.info(
+            f"{name:24} p50={stats['p50']:.3f} p95={stats['p95']:.3f} "
+            f"p99={stats['p99']:.3f} max={stats['max']:.3f} (n={stats['count']})"
         )
-    else:
-        logger.info(f"Found WAV file: {SAMPLE_AUDIO_PATH}")
 
+
+def positive_float(value):
+    """argparse type for a finite float greater than zero."""
+    number = float(value)
+    if not 0 < number < math.inf:
+        raise argparse.ArgumentTypeError(f"must be a positive number: {value}")
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Real-time latency/throughput benchmark for the audio servers"
+    )
+    parser.add_argument("--url", default="ws://localhost:8765")
+    parser.add_argument("--audio", default=DEFAULT_AUDIO_PATH, help="16 kHz mono WAV")
+    parser.add_argument(
+        "--chunk-ms",
+        type=int,
+        default=256,
+        help="Audio per message; the browser client sends 4096 samples (256 ms)",
+    )
+    parser.add_argument("--trailing-silence-ms", type=int, default=1000)
+    parser.add_argument(
+        "--framing", choices=[FRAMING_BINARY, FRAMING_JSON], default=FRAMING_JSON
+    )
+    parser.add_argument(
+        "--no-wait-greeting",
+        dest="wait_greeting",
+        action="store_false",
+        help="Start streaming without waiting for the greeting turn",
+    )
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+    parser.add_argument("--response-timeout", type=float, default=30.0)
+
+    parser.add_argument(
+        "--profile", choices=["constant", "ramp", "step"], default="ramp"
+    )
+    parser.add_argument("--clients", type=int, default=100, help="ramp: total clients")
+    parser.add_argument("--ramp-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--rate", type=positive_float, default=5.0, help="constant: clients/s"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="constant: seconds"
+    )
+    parser.add_argument(
+        "--poisson", action="store_true", help="constant: Poisson arrivals"
+    )
+    parser.add_argument("--step-clients", type=int, default=10)
+    parser.add_argument("--step-seconds", type=float, default=10.0)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+
+    parser.add_argument("--json", help="Write the percentile summary to this file")
+    parser.add_argument("--csv", help="Write per-client results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
     try:
         # Increase the maximum number of open files for the process
         import resource
@@ -126,7 +510,10 @@ if __name__ == "__main__":
         resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
         logger.info(f"Increased file limit from {soft} to {hard}")
 
-        asyncio.run(run_load_test())
+        results, duration, audio_seconds = asyncio.run(run_load_test(args))
+        summary = summarize(results, duration, audio_seconds, args)
+        log_summary(summary)
+        write_outputs(results, summary, args)
     except KeyboardInterrupt:
         logger.info("Load test interrupted by user")
     except Exception as e:
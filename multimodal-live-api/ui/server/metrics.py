@@ -0,0 +1,315 @@
+"""
+Lightweight in-process metrics.
+
+Counters and histograms are plain attribute updates so they are cheap
+enough to leave on in per-frame code paths. Gauges can instead be computed
+from a callback at scrape time, which keeps values like queue depths off the
+hot path entirely. All metrics register themselves in REGISTRY, keyed by
+name and labels.
+
+``serve_metrics`` exposes the registry in the Prometheus text format from a
+small HTTP server thread, so scrapes keep working even when the event loop
+is busy (which is exactly when its lag metric matters).
+"""
+
+import asyncio
+import bisect
+import ipaddress
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond to tool-call scale
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def __init__(self, name, help="", labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down, or is computed by ``fn`` when read."""
+
+    type = "gauge"
+
+    def __init__(self, name, help="", labels=None, fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values."""
+
+    type = "histogram"
+
+    def __init__(self, name, help="", labels=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def value(self):
+        return {"count": self.count, "sum": self.sum}
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of its bucket."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    """Holds every metric created through the module helpers."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        key = (metric.name, tuple(sorted(metric.labels.items())))
+        existing = self.metrics.get(key)
+        if existing is not None:
+            return existing
+        self.metrics[key] = metric
+        return metric
+
+    def snapshot(self):
+        """Return {"name{label=value,...}": value} for all registered metrics."""
+        snapshot = {}
+        for (name, labels), metric in self.metrics.items():
+            if labels:
+                name += "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+            snapshot[name] = metric.value
+        return snapshot
+
+    def collect(self):
+        """
+        Return a picklable dump of every metric for rendering or merging.
+
+        Each sample is (name, type, help, labels, value); histogram values are
+        (bucket bounds, per-bucket counts, sum, count).
+        """
+        samples = []
+        for (name, labels), metric in list(self.metrics.items()):
+            if metric.type == "histogram":
+                value = (metric.buckets, list(metric.counts), metric.sum, metric.count)
+            else:
+                try:
+                    value = metric.value
+                except Exception:
+                    continue  # A gauge callback failed; skip it this scrape
+            samples.append((name, metric.type, metric.help, labels, value))
+        return samples
+
+
+def merge(collections):
+    """Sum several ``Registry.collect()`` dumps, e.g. one per worker process."""
+    merged = {}
+    for samples in collections:
+        for name, kind, help, labels, value in samples:
+            key = (name, labels)
+            if key not in merged:
+                if kind == "histogram":
+                    value = (value[0], list(value[1]), value[2], value[3])
+                merged[key] = [name, kind, help, labels, value]
+                continue
+            entry = merged[key]
+            if kind == "histogram":
+                bounds, counts, total, count = entry[4]
+                for i, amount in enumerate(value[1]):
+                    counts[i] += amount
+                entry[4] = (bounds, counts, total + value[2], count + value[3])
+            else:
+                entry[4] += value
+    return [tuple(entry) for entry in merged.values()]
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render_prometheus(samples):
+    """Render a ``collect()`` dump in the Prometheus text exposition format."""
+    lines = []
+    described = set()
+    for name, kind, help, labels, value in sorted(samples, key=lambda s: s[0]):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            bounds, counts, total, count = value
+            cumulative = 0
+            for bound, amount in zip(bounds, counts):
+                cumulative += amount
+                bucket_labels = _format_labels(labels, [("le", repr(float(bound)))])
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(labels, [("le", "+Inf")])
+            lines.append(f"{name}_bucket{inf_labels} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        else:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _is_loopback(address):
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def serve_metrics(host, port, collect=None, routes=None, remote_admin=False):
+    """
+    Serve ``GET /metrics`` in a daemon thread; returns the HTTP server, or
+    None if the port can't be bound, which is logged but doesn't stop the
+    caller from serving clients.
+
+    ``collect`` returns the samples to render and defaults to this process's
+    registry; the multi-process supervisor passes a merge of its workers.
+    ``routes`` adds small admin endpoints: ``{path: handler(method, query)}``
+    where the handler returns (status, JSON body). A POST's form body is
+    appended to its query. Admin endpoints only answer clients connecting
+    from the loopback interface unless ``remote_admin`` is set.
+    """
+    collect = collect or REGISTRY.collect
+    routes = routes or {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, content_type):
+            body = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path == "/metrics" and self.command == "GET":
+                self._reply(
+                    200, render_prometheus(collect()), "text/plain; version=0.0.4"
+                )
+            elif path in routes:
+                if not remote_admin and not _is_loopback(self.client_address[0]):
+                    self.send_error(403)
+                    return
+                if self.command == "POST":
+                    length = int(self.headers.get("Content-Length") or 0)
+                    form = self.rfile.read(length).decode()
+                    query = "&".join(filter(None, (query, form)))
+                status, body = routes[path](self.command, query)
+                self._reply(status, body, "application/json")
+            else:
+                self.send_error(404)
+
+        do_POST = do_GET
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would flood the log
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning("Metrics endpoint disabled, can't bind %s:%d: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+async def monitor_loop_lag(interval=0.25):
+    """Record how late the event loop wakes up from a fixed sleep."""
+    lag = histogram(
+        "event_loop_lag_seconds",
+        "Delay between a scheduled wakeup and when the event loop ran it",
+    )
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag.observe(max(0.0, time.monotonic() - start - interval))
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help="", labels=None):
+    """Get or create a counter in the global registry."""
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help="", labels=None, fn=None):
+    """Get or create a gauge in the global registry."""
+    return REGISTRY.register(Gauge(name, help, labels, fn))
+
+
+def histogram(name, help="", labels=None, buckets=DEFAULT_BUCKETS):
+    """Get or create a histogram in the global registry."""
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
@@ -0,0 +1,408 @@
+"""
+Offline stand-in for the Gemini Live API.
+
+``MockLiveBackend`` hands out ``MockLiveSession`` objects that speak the same
+subset of the google-genai live session interface the servers use
+(``send_realtime_input`` and ``receive``), and emit scripted audio chunks,
+transcriptions, function calls, interruptions, turn completions, session
+resumption updates and go-away notices with configurable timing. Everything
+is driven by a seeded ``random.Random`` so runs are reproducible and no
+network or credentials are needed.
+"""
+
+import asyncio
+import contextlib
+import math
+import random
+import time
+from array import array
+from types import SimpleNamespace
+
+from backends import LiveBackend
+from common import logger, RECEIVE_SAMPLE_RATE, SEND_SAMPLE_RATE
+from rate_limit import TokenBucket
+
+# Bytes of 16-bit mono PCM per millisecond of client audio
+INPUT_BYTES_PER_MS = SEND_SAMPLE_RATE * 2 / 1000
+# Client audio peaking below this (about -36 dBFS) counts as silence
+SPEECH_PEAK = 500
+
+DEFAULT_TRANSCRIPT = (
+    "Hi there! Welcome to Cubby Storage Management. "
+    "My name is Alex. How can I help you today?"
+)
+DEFAULT_INPUT_TRANSCRIPT = "I'd like to check on my order please."
+DEFAULT_FUNCTION_CALLS = [
+    ("get_order_status", {"order_id": "SH1005"}),
+    ("check_storage_availability", {"size": "Small (5x5)", "location": "Downtown"}),
+]
+
+
+def _message(
+    server_content=None, session_resumption_update=None, go_away=None, tool_call=None
+):
+    """Build an object shaped like a LiveServerMessage."""
+    return SimpleNamespace(
+        server_content=server_content,
+        session_resumption_update=session_resumption_update,
+        go_away=go_away,
+        tool_call=tool_call,
+        setup_complete=None,
+        usage_metadata=None,
+    )
+
+
+def _content(
+    parts=None,
+    input_text=None,
+    output_text=None,
+    interrupted=None,
+    turn_complete=None,
+):
+    """Build an object shaped like LiveServerContent."""
+    return SimpleNamespace(
+        model_turn=SimpleNamespace(role="model", parts=parts) if parts else None,
+        input_transcription=SimpleNamespace(text=input_text) if input_text else None,
+        output_transcription=(
+            SimpleNamespace(text=output_text) if output_text else None
+        ),
+        interrupted=interrupted,
+        turn_complete=turn_complete,
+        generation_complete=turn_complete,
+    )
+
+
+def _audio_part(data):
+    return SimpleNamespace(
+        inline_data=SimpleNamespace(
+            data=data, mime_type=f"audio/pcm;rate={RECEIVE_SAMPLE_RATE}"
+        ),
+        function_call=None,
+        text=None,
+    )
+
+
+def _tool_call(calls):
+    """Build an object shaped like LiveServerToolCall."""
+    return SimpleNamespace(
+        function_calls=[
+            SimpleNamespace(id=call_id, name=name, args=dict(args))
+            for call_id, name, args in calls
+        ]
+    )
+
+
+def _is_speech(data):
+    samples = array("h", data[: len(data) - len(data) % 2])
+    return bool(samples) and max(max(samples), -min(samples)) >= SPEECH_PEAK
+
+
+def _tone(duration_ms, frequency=220.0, amplitude=0.3):
+    """Generate a 16-bit PCM sine tone at RECEIVE_SAMPLE_RATE."""
+    n = int(RECEIVE_SAMPLE_RATE * duration_ms / 1000)
+    scale = 32767 * amplitude
+    step = 2 * math.pi * frequency / RECEIVE_SAMPLE_RATE
+    return array("h", (int(scale * math.sin(step * i)) for i in range(n))).tobytes()
+
+
+class MockRateLimitError(Exception):
+    """Connect refused over the simulated quota, shaped like a genai 429."""
+
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+    def __init__(self):
+        super().__init__("429 RESOURCE_EXHAUSTED. Mock upstream quota exceeded.")
+
+
+class MockLiveSession:
+    """A scripted live session that reacts to the audio it is sent."""
+
+    def __init__(self, backend, session_number, handle=None):
+        self.backend = backend
+        self.rng = random.Random(backend.seed + session_number)
+        self.resumed_from = handle
+        self.turn_count = 0
+        self.input_ms = 0.0
+        self.silence_ms = 0.0  # Client silence since the last speech
+        self.barge_in_ms = 0.0
+        self.speaking = False
+        self.interrupted = False
+        self.closed = False
+        self.started = time.monotonic()
+        self.go_away_sent = False
+        self.received_texts = []
+        self.function_responses = {}
+        self._turn_ready = asyncio.Event()
+        self._response_ready = asyncio.Event()
+        self._user_turn = False
+
+        # Greet new sessions like the real agent does; resumed ones stay quiet
+        if backend.greeting and handle is None:
+            self._turn_ready.set()
+
+    async def send_realtime_input(
+        self, media=None, audio=None, text=None, function_response=None, **kwargs
+    ):
+        """Accept client audio, text prompts and function responses."""
+        blob = media if media is not None else audio
+        if blob is not None:
+            data = blob["data"] if isinstance(blob, dict) else blob.data
+            duration_ms = len(data) / INPUT_BYTES_PER_MS
+            if self.speaking:
+                self.barge_in_ms += duration_ms
+                interrupt_after = self.backend.interrupt_after_ms
+                if interrupt_after is not None and self.barge_in_ms >= interrupt_after:
+                    self.interrupted = True
+            else:
+                end_of_speech_ms = self.backend.end_of_speech_ms
+                if not end_of_speech_ms:
+                    self.input_ms += duration_ms
+                elif _is_speech(data):
+                    self.input_ms += duration_ms
+                    self.silence_ms = 0.0
+                else:
+                    self.silence_ms += duration_ms
+                # Like the Live API's own activity detection, answer once
+                # the user has spoken and then paused
+                if (
+                    self.input_ms >= self.backend.turn_trigger_ms
+                    and self.silence_ms >= end_of_speech_ms
+                ):
+                    self._user_turn = True
+                    self._turn_ready.set()
+
+        if text:
+            self.received_texts.append(text)
+            self._turn_ready.set()
+
+        if function_response is not None:
+            self._record_function_responses(function_response)
+
+    async def send_tool_response(self, function_responses=None, **kwargs):
+        """Accept function responses sent through the tool response API."""
+        self._record_function_responses(function_responses)
+
+    def _record_function_responses(self, responses):
+        if not isinstance(responses, (list, tuple)):
+            responses = [responses]
+        for response in responses:
+            if isinstance(response, dict):
+                call_id, result = response.get("id"), response.get("response")
+            else:
+                call_id, result = response.id, response.response
+            self.function_responses[call_id] = result
+        self._response_ready.set()
+
+    async def _sleep(self, seconds):
+        jitter = self.backend.timing_jitter
+        if jitter:
+            seconds *= self.rng.uniform(1 - jitter, 1 + jitter)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def _go_away_due(self):
+        go_away_after = self.backend.go_away_after
+        return (
+            go_away_after is not None
+            and not self.go_away_sent
+            and time.monotonic() - self.started >= go_away_after
+        )
+
+    async def receive(self):
+        """Yield the server messages of the next model turn."""
+        backend = self.backend
+        while not self.closed:
+            if self._go_away_due():
+                self.go_away_sent = True
+                yield _message(
+                    go_away=SimpleNamespace(time_left=f"{backend.go_away_notice}s")
+                )
+            try:
+                await asyncio.wait_for(self._turn_ready.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if self.closed:
+                return
+
+            self._turn_ready.clear()
+            self.turn_count += 1
+            self.input_ms = 0.0
+            self.silence_ms = 0.0
+
+            if self._user_turn:
+                self._user_turn = False
+                yield _message(_content(input_text=backend.input_transcript))
+
+            await self._sleep(backend.response_delay)
+
+            if (
+                backend.function_call_every
+                and self.turn_count % backend.function_call_every == 0
+            ):
+                calls = [
+                    (
+                        f"mock-call-{self.turn_count}-{i}",
+                        *self.rng.choice(backend.function_calls),
+                    )
+                    for i in range(backend.function_calls_per_turn)
+                ]
+                self._response_ready.clear()
+                yield _message(tool_call=_tool_call(calls))
+                try:
+                    while any(c[0] not in self.function_responses for c in calls):
+                        await asyncio.wait_for(
+                            self._response_ready.wait(),
+                            timeout=backend.function_response_timeout,
+                        )
+                        self._response_ready.clear()
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        "Mock session: missing function responses in turn %d",
+                        self.turn_count,
+                    )
+                await self._sleep(backend.response_delay)
+
+            self.speaking = True
+            self.interrupted = False
+            self.barge_in_ms = 0.0
+            words = backend.transcript.split()
+            chunks = backend.audio_chunks
+            try:
+                for i in range(chunks):
+                    if self.interrupted or self.closed:
+                        break
+                    start = len(words) * i // chunks
+                    end = len(words) * (i + 1) // chunks
+                    text = " ".join(words[start:end])
+                    yield _message(
+                        _content(
+                            parts=[_audio_part(backend.chunk_audio)],
+                            output_text=(" " + text) if text else None,
+                        )
+                    )
+                    await self._sleep(backend.chunk_interval)
+            finally:
+                self.speaking = False
+
+            if self.interrupted:
+                yield _message(_content(interrupted=True))
+
+            if backend.resumption_updates:
+                yield _message(
+                    session_resumption_update=SimpleNamespace(
+                        resumable=True,
+                        new_handle=f"mock-{backend.seed}-{id(self):x}-{self.turn_count}",
+                    )
+                )
+
+            yield _message(_content(turn_complete=True))
+            return
+
+
+class MockLiveBackend(LiveBackend):
+    """
+    Network-free backend that serves scripted MockLiveSessions.
+
+    Timing knobs (seconds unless noted):
+        connect_delay       simulated upstream connect/setup time
+        response_delay      gap before the model starts answering
+        chunk_interval      gap between audio chunks; defaults to real time
+        timing_jitter       +/- fraction applied to every delay
+    Content knobs:
+        audio_chunks        audio chunks per model turn
+        chunk_ms            audio duration per chunk in milliseconds
+        turn_trigger_ms     client speech (ms) needed before a model turn
+        end_of_speech_ms    client silence (ms) after that speech which
+                            triggers the turn; 0 triggers on the amount of
+                            audio alone, silent or not
+        interrupt_after_ms  client audio (ms) during a turn that interrupts it
+        function_call_every emit function calls every Nth turn (0 = never)
+        function_calls_per_turn  parallel function calls in such a turn
+        go_away_after       seconds into the session to send go_away
+    Quota knobs:
+        rate_limit          sessions per second accepted before connects fail
+                            with a 429 (0 = unlimited)
+        rate_limit_burst    sessions accepted at once
+    """
+
+    name = "mock"
+
+    def __init__(
+        self,
+        connect_delay=0.0,
+        response_delay=0.3,
+        audio_chunks=25,
+        chunk_ms=40,
+        chunk_interval=None,
+        timing_jitter=0.0,
+        turn_trigger_ms=1000,
+        end_of_speech_ms=500,
+        interrupt_after_ms=None,
+        greeting=True,
+        transcript=DEFAULT_TRANSCRIPT,
+        input_transcript=DEFAULT_INPUT_TRANSCRIPT,
+        function_call_every=0,
+        function_calls=None,
+        function_calls_per_turn=1,
+        function_response_timeout=10.0,
+        resumption_updates=True,
+        go_away_after=None,
+        go_away_notice=10,
+        rate_limit=0.0,
+        rate_limit_burst=None,
+        seed=0,
+    ):
+        self.connect_delay = connect_delay
+        self.response_delay = response_delay
+        self.audio_chunks = audio_chunks
+        self.chunk_ms = chunk_ms
+        self.chunk_interval = (
+            chunk_ms / 1000 if chunk_interval is None else chunk_interval
+        )
+        self.timing_jitter = timing_jitter
+        self.turn_trigger_ms = turn_trigger_ms
+        self.end_of_speech_ms = end_of_speech_ms
+        self.interrupt_after_ms = interrupt_after_ms
+        self.greeting = greeting
+        self.transcript = transcript
+        self.input_transcript = input_transcript
+        self.function_call_every = function_call_every
+        self.function_calls = function_calls or DEFAULT_FUNCTION_CALLS
+        self.function_calls_per_turn = function_calls_per_turn
+        self.function_response_timeout = function_response_timeout
+        self.resumption_updates = resumption_updates
+        self.go_away_after = go_away_after
+        self.go_away_notice = go_away_notice
+        self.seed = seed
+
+        self.quota = (
+            TokenBucket(rate_limit, rate_limit_burst or rate_limit)
+            if rate_limit
+            else None
+        )
+
+        self.chunk_audio = _tone(chunk_ms)
+        self.sessions_opened = 0
+        self.active_sessions = 0
+        self.rate_limited = 0
+
+    @contextlib.asynccontextmanager
+    async def connect(self, model, config):
+        resumption = getattr(config, "session_resumption", None)
+        handle = getattr(resumption, "handle", None)
+        if self.quota is not None and not self.quota.try_acquire():
+            self.rate_limited += 1
+            raise MockRateLimitError()
+        if self.connect_delay:
+            await asyncio.sleep(self.connect_delay)
+
+        session = MockLiveSession(self, self.sessions_opened, handle=handle)
+        self.sessions_opened += 1
+        self.active_sessions += 1
+        try:
+            yield session
+        finally:
+            session.closed = True
+            session._turn_ready.set()
+            self.active_sessions -= 1
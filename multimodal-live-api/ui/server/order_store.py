@@ -0,0 +1,428 @@
+"""
+Embedded SQLite store behind the Cubby tool functions.
+
+Holds orders, storage inventory (location x unit size with availability and
+price) and reservations. Lookups go through primary keys or indexes, so tool
+latency stays flat from a handful of demo rows to millions of synthetic ones.
+One connection is shared by the tool threads behind a lock; SQLite lookups
+take microseconds, so the lock is never held long.
+
+Also a small CLI to build, load and benchmark a database file:
+
+    python order_store.py generate --db cubby.db --orders 2000000
+    python order_store.py load --db cubby.db orders.jsonl --table orders
+    python order_store.py bench --db cubby.db --lookups 100000
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+LOCATIONS = ["Downtown", "Midtown", "Airport", "Suburbs"]
+SIZES = ["Small (5x5)", "Medium (10x10)", "Large (10x20)", "Extra Large (20x20)"]
+BASE_PRICES = {
+    "Small (5x5)": 75,
+    "Medium (10x10)": 125,
+    "Large (10x20)": 200,
+    "Extra Large (20x20)": 300,
+}
+STATUSES = ["processing", "shipped", "delivered"]
+SHIPMENT_METHODS = ["standard", "express", "next day", "international"]
+ITEMS = [
+    "Vanilla candles",
+    "BOKHYLLA Stor",
+    "Moving boxes (10 pack)",
+    "Packing tape",
+    "Bubble wrap roll",
+    "Padlock",
+    "Mattress cover",
+    "Shelving unit",
+]
+
+ORDER_COLUMNS = [
+    "order_id",
+    "status",
+    "order_date",
+    "shipment_method",
+    "estimated_delivery",
+    "shipped_date",
+    "delivered_date",
+    "items",
+]
+INVENTORY_COLUMNS = ["location", "size", "available_units", "price_per_month"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    order_date TEXT,
+    shipment_method TEXT,
+    estimated_delivery TEXT,
+    shipped_date TEXT,
+    delivered_date TEXT,
+    items TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS inventory (
+    location TEXT NOT NULL,
+    size TEXT NOT NULL,
+    available_units INTEGER NOT NULL,
+    price_per_month INTEGER NOT NULL,
+    PRIMARY KEY (location, size)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS inventory_by_size ON inventory (size, available_units);
+CREATE INDEX IF NOT EXISTS inventory_by_units ON inventory (available_units);
+-- Case-insensitive exact and prefix name matching
+CREATE INDEX IF NOT EXISTS inventory_location_name ON inventory (lower(location));
+CREATE INDEX IF NOT EXISTS inventory_size_name ON inventory (lower(size));
+CREATE TABLE IF NOT EXISTS reservations (
+    reservation_id TEXT PRIMARY KEY,
+    customer_name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    size TEXT NOT NULL,
+    start_date TEXT,
+    duration_months INTEGER,
+    monthly_rate INTEGER,
+    unit_number TEXT,
+    access_code TEXT,
+    created_at REAL
+);
+"""
+
+# The order the demo script and the mock backend refer to
+DEMO_ORDER = {
+    "order_id": "SH1005",
+    "status": "shipped",
+    "order_date": "2024-05-20",
+    "shipment_method": "express",
+    "estimated_delivery": "2024-05-30",
+    "shipped_date": "2024-05-25",
+    "delivered_date": None,
+    "items": ["Vanilla candles", "BOKHYLLA Stor"],
+}
+
+
+def order_id_for(n):
+    return f"SH{n:04d}"
+
+
+def generate_orders(count, seed=0, start=0):
+    """Yield ``count`` synthetic order rows (tuples in ORDER_COLUMNS order)."""
+    rng = random.Random(seed)
+    base = datetime.date(2024, 5, 1)
+    for n in range(start, start + count):
+        status = rng.choice(STATUSES)
+        ordered = base + datetime.timedelta(days=rng.randint(0, 27))
+        shipped = estimated = delivered = None
+        if status == "processing":
+            estimated = ordered + datetime.timedelta(days=rng.randint(7, 21))
+        elif status == "shipped":
+            shipped = ordered + datetime.timedelta(days=rng.randint(1, 5))
+            estimated = shipped + datetime.timedelta(days=rng.randint(2, 10))
+        else:
+            shipped = ordered + datetime.timedelta(days=rng.randint(1, 5))
+            delivered = shipped + datetime.timedelta(days=rng.randint(1, 7))
+        items = rng.sample(ITEMS, rng.randint(1, 3))
+        yield (
+            order_id_for(n),
+            status,
+            ordered.isoformat(),
+            rng.choice(SHIPMENT_METHODS),
+            estimated and estimated.isoformat(),
+            shipped and shipped.isoformat(),
+            delivered and delivered.isoformat(),
+            json.dumps(items),
+        )
+
+
+def generate_inventory(extra_locations=0, seed=0):
+    """Yield inventory rows for the named locations plus synthetic sites."""
+    rng = random.Random(seed)
+    locations = LOCATIONS + [f"Site {n:05d}" for n in range(extra_locations)]
+    for location in locations:
+        for size in SIZES:
+            price = BASE_PRICES[size] + rng.randint(-15, 40)
+            yield (location, size, rng.randint(0, 15), price)
+
+
+def _order_row(record):
+    """Convert a CSV/JSONL record into a row tuple; items may be a list or JSON."""
+    items = record.get("items")
+    if isinstance(items, str) and not items.startswith("["):
+        items = [item.strip() for item in items.split(";") if item.strip()]
+    if isinstance(items, list):
+        items = json.dumps(items)
+    row = [record.get(column) or None for column in ORDER_COLUMNS[:-1]]
+    return (*row, items)
+
+
+def _inventory_row(record):
+    return (
+        record["location"],
+        record["size"],
+        int(record["available_units"]),
+        int(record["price_per_month"]),
+    )
+
+
+def read_records(path):
+    """Yield dict records from a .csv or .jsonl file."""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class OrderStore:
+    """Thread-safe SQLite store of orders, inventory and reservations."""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # Bulk loading
+
+    def _bulk_insert(self, table, columns, rows, batch_size=50_000):
+        sql = (
+            f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+        total = 0
+        batch = []
+        with self.lock:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    with self.conn:
+                        self.conn.executemany(sql, batch)
+                    total += len(batch)
+                    batch.clear()
+            if batch:
+                with self.conn:
+                    self.conn.executemany(sql, batch)
+                total += len(batch)
+        return total
+
+    def load_orders(self, rows):
+        """Insert order row tuples (ORDER_COLUMNS order); returns the count."""
+        return self._bulk_insert("orders", ORDER_COLUMNS, rows)
+
+    def load_inventory(self, rows):
+        """Insert inventory row tuples (INVENTORY_COLUMNS order)."""
+        return self._bulk_insert("inventory", INVENTORY_COLUMNS, rows)
+
+    def load_file(self, path, table):
+        """Bulk-load a CSV or JSONL file into ``orders`` or ``inventory``."""
+        records = read_records(path)
+        if table == "orders":
+            return self.load_orders(_order_row(r) for r in records)
+        if table == "inventory":
+            return self.load_inventory(_inventory_row(r) for r in records)
+        raise ValueError(f"Unknown table: {table}")
+
+    def ensure_seeded(self, orders=10_000, seed=0):
+        """Populate an empty store with demo inventory and synthetic orders."""
+        with self.lock:
+            empty = self.conn.execute("SELECT 1 FROM inventory LIMIT 1").fetchone()
+        if empty is None:
+            self.load_inventory(generate_inventory(seed=seed))
+            self.load_orders(generate_orders(orders, seed=seed))
+            self.load_orders([_order_row(DEMO_ORDER)])
+
+    def count(self, table):
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    # Lookups used by the tools
+
+    def get_order(self, order_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM orders WHERE order_id = ?", (order_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        order = dict(zip(ORDER_COLUMNS, row))
+        if order["items"]:
+            order["items"] = json.loads(order["items"])
+        return order
+
+    def _match(self, column, value):
+        """Stored name in ``column`` for ``value``, or the first few choices."""
+        wanted = value.strip()
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {column} FROM inventory WHERE {column} = ? LIMIT 1",
+                (wanted,),
+            ).fetchone()
+            if row is None:
+                # Case-insensitive prefix match as a range over the lower()
+                # index; an exact match sorts first
+                row = self.conn.execute(
+                    f"SELECT {column} FROM inventory "
+                    f"WHERE lower({column}) >= lower(?1) "
+                    f"AND lower({column}) < lower(?1) || char(1114111) "
+                    f"ORDER BY lower({column}) LIMIT 1",
+                    (wanted,),
+                ).fetchone()
+            if row is not None:
+                return row[0], None
+            choices = [
+                r[0]
+                for r in self.conn.execute(
+                    f"SELECT DISTINCT {column} FROM inventory "
+                    f"ORDER BY lower({column}) LIMIT 11"
+                )
+            ]
+        return None, choices
+
+    def resolve(self, location=None, size=None):
+        """
+        Map loosely spoken names ("small", "airport") to stored ones.
+
+        Returns (location, size); a name that matches nothing raises ValueError
+        listing the valid choices.
+        """
+
+        def match(value, column):
+            if not value:
+                return None
+            name, choices = self._match(column, value)
+            if name is None:
+                shown = ", ".join(choices[:10]) + (", ..." if len(choices) > 10 else "")
+                raise ValueError(f"Unknown {column} '{value}'. Available: {shown}")
+            return name
+
+        return match(location, "location"), match(size, "size")
+
+    def find_availability(self, location=None, size=None):
+        """Best inventory row for the given (optional) location and size."""
+        location, size = self.resolve(location, size)
+        sql = "SELECT location, size, available_units, price_per_month FROM inventory"
+        clauses, params = [], []
+        if location:
+            clauses.append("location = ?")
+            params.append(location)
+        if size:
+            clauses.append("size = ?")
+            params.append(size)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY available_units DESC LIMIT 1"
+        with self.lock:
+            row = self.conn.execute(sql, params).fetchone()
+        return dict(zip(INVENTORY_COLUMNS, row)) if row else None
+
+    def reserve(self, reservation):
+        """
+        Take one unit out of inventory and record the reservation atomically.
+
+        Returns the inventory row used, or None if no unit was available.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT available_units, price_per_month FROM inventory "
+                "WHERE location = ? AND size = ?",
+                (reservation["location"], reservation["size"]),
+            ).fetchone()
+            if row is None or row[0] <= 0:
+                return None
+            self.conn.execute(
+                "UPDATE inventory SET available_units = available_units - 1 "
+                "WHERE location = ? AND size = ?",
+                (reservation["location"], reservation["size"]),
+            )
+            self.conn.execute(
+                "INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    reservation["reservation_id"],
+                    reservation["customer_name"],
+                    reservation["location"],
+                    reservation["size"],
+                    reservation["start_date"],
+                    reservation["duration_months"],
+                    reservation["monthly_rate"],
+                    reservation["unit_number"],
+                    reservation["access_code"],
+                    time.time(),
+                ),
+            )
+        return {"available_units": row[0] - 1, "price_per_month": row[1]}
+
+
+def benchmark(store, lookups, seed=0):
+    """Time random indexed order lookups; returns (p50, p99, max) in microseconds."""
+    rng = random.Random(seed)
+    total = store.count("orders")
+    timings = []
+    for _ in range(lookups):
+        order_id = order_id_for(rng.randrange(total))
+        start = time.perf_counter()
+        store.get_order(order_id)
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return (
+        timings[len(timings) // 2],
+        timings[int(len(timings) * 0.99)],
+        timings[-1],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and inspect the Cubby store")
+    parser.add_argument("--db", default="cubby.db", help="SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write synthetic rows")
+    generate.add_argument("--orders", type=int, default=1_000_000)
+    generate.add_argument("--extra-locations", type=int, default=0)
+    generate.add_argument("--seed", type=int, default=0)
+
+    load = commands.add_parser("load", help="Bulk-load a CSV or JSONL file")
+    load.add_argument("path")
+    load.add_argument("--table", choices=["orders", "inventory"], default="orders")
+
+    bench = commands.add_parser("bench", help="Time indexed order lookups")
+    bench.add_argument("--lookups", type=int, default=100_000)
+    bench.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    store = OrderStore(args.db)
+    start = time.perf_counter()
+    if args.command == "generate":
+        store.load_inventory(generate_inventory(args.extra_locations, seed=args.seed))
+        count = store.load_orders(generate_orders(args.orders, seed=args.seed))
+        store.load_orders([_order_row(DEMO_ORDER)])
+        elapsed = time.perf_counter() - start
+        print(f"Generated {count} orders in {elapsed:.1f}s ({count / elapsed:,.0f}/s)")
+    elif args.command == "load":
+        count = store.load_file(args.path, args.table)
+        print(f"Loaded {count} {args.table} rows in {time.perf_counter() - start:.1f}s")
+    else:
+        p50, p99, worst = benchmark(store, args.lookups, seed=args.seed)
+        print(
+            f"{store.count('orders')} orders, {args.lookups} lookups: "
+            f"p50 {p50:.1f}us, p99 {p99:.1f}us, max {worst:.1f}us"
+        )
+    store.close()
+    print(f"Database: {os.path.abspath(args.db)}")
+
+
+if __name__ == "__main__":
+    main()
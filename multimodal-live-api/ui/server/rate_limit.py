@@ -0,0 +1,339 @@
+"""
+Rate limiting of upstream Live session creation.
+
+After a deploy or a network blip every client reconnects at once, and each
+reconnect opens an upstream session. Past the project's quota the Live API
+answers 429 (RESOURCE_EXHAUSTED), clients retry, and the storm feeds itself.
+``ConnectRateLimiter`` keeps one token bucket per model and location: each
+connect takes a token, so up to ``burst`` sessions open at once and after
+that they open at ``rate`` per second, in arrival order. A connect that is
+still rate limited is retried after a jittered exponential backoff ("full
+jitter": uniform between 0 and the exponential step), and the whole bucket
+pauses for that long, so other connects waiting on the same quota back off
+too instead of piling on.
+
+``RateLimitedBackend`` wraps any backend, so warm pool refills, resumptions
+and inline connects all go through the same buckets. Limits are per
+process; in ``--workers`` mode the server divides them among the workers.
+
+Run this module with ``storm`` to replay a reconnect storm against the mock
+backend with a simulated upstream quota, with and without the limiter.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import random
+import time
+
+from backends import LiveBackend
+from common import LOCATION, logger
+from metrics import counter, gauge, histogram
+
+connect_wait = histogram(
+    "upstream_connect_wait_seconds",
+    "Time upstream connects waited for a rate limit token",
+)
+connects_throttled = counter(
+    "upstream_connects_throttled_total",
+    "Upstream connects that had to wait for a token",
+)
+rate_limited = counter(
+    "upstream_connect_rate_limited_total",
+    "Upstream connects refused by the Live API as rate limited",
+)
+connect_retries = counter(
+    "upstream_connect_retries_total",
+    "Upstream connects retried after being rate limited",
+)
+
+
+def is_rate_limited(error):
+    """Whether an upstream connect failed because of rate limiting (429)."""
+    if getattr(error, "code", None) == 429:
+        return True
+    if getattr(error, "status", None) == "RESOURCE_EXHAUSTED":
+        return True
+    # websockets handshake rejections carry the HTTP response
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def parse_limits(spec):
+    """
+    Parse per-model limits: ``MODEL[@LOCATION]=RATE/BURST`` entries
+    separated by commas. Returns {(model, location or None): (rate, burst)}.
+    """
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = entry.partition("=")
+        model, _, location = key.partition("@")
+        rate, _, burst = value.partition("/")
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else max(1.0, rate)
+        except ValueError:
+            raise ValueError(f"Invalid rate limit: {entry}") from None
+        limits[(model, location or None)] = (rate, burst)
+    return limits
+
+
+class TokenBucket:
+    """Token bucket whose tokens may go negative to queue waiters in order."""
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate: tokens added per second, 0 for no limit
+            burst: most tokens held at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()  # In the future while paused
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+    def available(self, now=None):
+        """Tokens that could be taken now, without queueing."""
+        now = now or time.monotonic()
+        if now < self.updated:
+            return 0.0
+        return max(0.0, min(self.burst, self.tokens + (now - self.updated) * self.rate))
+
+    def reserve(self, now=None):
+        """Take a token; returns seconds to wait before using it."""
+        now = now or time.monotonic()
+        if not self.rate:
+            return max(0.0, self.updated - now)
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def refund(self):
+        """Give back a reserved token that was not used."""
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def try_acquire(self, now=None):
+        """Take a token only if one is available now."""
+        now = now or time.monotonic()
+        if not self.rate:
+            return now >= self.updated
+        self._refill(now)
+        if now < self.updated or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds, now=None):
+        """Hand out nothing for ``seconds``, then refill from empty."""
+        now = now or time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = max(self.updated, now + seconds)
+
+    async def acquire(self):
+        """Wait for a token; returns the seconds waited."""
+        delay = self.reserve()
+        if delay <= 0:
+            return 0.0
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.refund()
+            raise
+        return delay
+
+
+class ConnectRateLimiter:
+    """Token buckets for upstream session creation, per model and location."""
+
+    def __init__(
+        self,
+        rate=0.0,
+        burst=10.0,
+        limits=None,
+        max_retries=3,
+        retry_base=1.0,
+        retry_max=30.0,
+    ):
+        """
+        Args:
+            rate: default connects per second, 0 for no limit
+            burst: default connects allowed at once
+            limits: {(model, location or None): (rate, burst)} overrides
+            max_retries: retries of a rate limited connect before giving up
+            retry_base: first backoff step in seconds
+            retry_max: largest backoff step in seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits or {}
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.buckets = {}  # (model, location) -> TokenBucket
+
+    def bucket(self, model, location=LOCATION):
+        key = (model, location)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            rate, burst = self.limits.get(
+                key, self.limits.get((model, None), (self.rate, self.burst))
+            )
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+            labels = {"model": model, "location": location}
+            gauge(
+                "upstream_connect_tokens",
+                "Upstream connect tokens available",
+                labels,
+                fn=bucket.available,
+            )
+            gauge(
+                "upstream_connect_rate",
+                "Sustained upstream connects per second allowed (0 is unlimited)",
+                labels,
+                fn=lambda: bucket.rate,
+            )
+            gauge(
+                "upstream_connect_burst",
+                "Upstream connects allowed at once",
+                labels,
+                fn=lambda: bucket.burst,
+            )
+        return bucket
+
+    def retry_delay(self, attempt):
+        """Full-jitter exponential backoff for retry number ``attempt``."""
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2**attempt))
+
+    async def acquire(self, bucket):
+        waited = await bucket.acquire()
+        connect_wait.observe(waited)
+        if waited:
+            connects_throttled.inc()
+
+    async def backoff(self, bucket, attempt, error):
+        """
+        Handle a rate limited connect: pause the bucket and wait. Re-raises
+        ``error`` once retries are used up.
+        """
+        rate_limited.inc()
+        if attempt >= self.max_retries:
+            raise error
+        delay = self.retry_delay(attempt)
+        bucket.pause(delay)
+        connect_retries.inc()
+        logger.debug(
+            "Upstream connect rate limited, retry %d in %.2fs", attempt + 1, delay
+        )
+        await asyncio.sleep(delay)
+
+
+class RateLimitedBackend(LiveBackend):
+    """Backend wrapper that meters and retries session creation."""
+
+    def __init__(self, backend, limiter, location=None):
+        self.backend = backend
+        self.limiter = limiter
+        self.location = location or getattr(backend, "location", LOCATION)
+        self.name = backend.name
+
+    def __getattr__(self, name):
+        # Backend specific attributes, such as the mock's counters
+        return getattr(self.backend, name)
+
+    @contextlib.asynccontextmanager
+    async def connect(self, model, config):
+        bucket = self.limiter.bucket(model, self.location)
+        async with contextlib.AsyncExitStack() as stack:
+            attempt = 0
+            while True:
+                await self.limiter.acquire(bucket)
+                try:
+                    session = await stack.enter_async_context(
+                        self.backend.connect(model=model, config=config)
+                    )
+                    break
+                except Exception as e:
+                    if not is_rate_limited(e):
+                        raise
+                    await self.limiter.backoff(bucket, attempt, e)
+                    attempt += 1
+            yield session
+
+
+async def storm(clients, limiter, quota_rate, quota_burst, hold=1.0):
+    """
+    Open ``clients`` mock sessions at once against an upstream quota of
+    ``quota_rate`` per second (``quota_burst`` at once), through ``limiter``
+    or directly if it is None. Returns a summary dict.
+    """
+    from mock_live import MockLiveBackend
+
+    mock = MockLiveBackend(
+        greeting=False, rate_limit=quota_rate, rate_limit_burst=quota_burst
+    )
+    backend = mock if limiter is None else RateLimitedBackend(mock, limiter)
+    latencies = []
+    failures = 0
+
+    async def client():
+        nonlocal failures
+        start = time.monotonic()
+        try:
+            async with backend.connect(model="storm", config=None):
+                latencies.append(time.monotonic() - start)
+                await asyncio.sleep(hold)
+        except Exception as e:
+            if not is_rate_limited(e):
+                raise
+            failures += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    latencies.sort()
+    return {
+        "connected": len(latencies),
+        "failed": failures,
+        "refused_upstream": mock.rate_limited,
+        "p50_s": latencies[len(latencies) // 2] if latencies else None,
+        "max_s": latencies[-1] if latencies else None,
+        "elapsed_s": time.monotonic() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("storm", help="Replay a reconnect storm against the mock")
+    run.add_argument("--clients", type=int, default=200)
+    run.add_argument("--rate", type=float, default=8.0, help="Limiter connects/s")
+    run.add_argument("--burst", type=float, default=10.0, help="Limiter burst")
+    run.add_argument("--quota-rate", type=float, default=10.0, help="Upstream /s")
+    run.add_argument("--quota-burst", type=float, default=20.0)
+    run.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, limiter in (
+        ("no limiter", None),
+        ("retries only", ConnectRateLimiter(max_retries=args.retries)),
+        (
+            "token bucket",
+            ConnectRateLimiter(args.rate, args.burst, max_retries=args.retries),
+        ),
+    ):
+        result = asyncio.run(
+            storm(args.clients, limiter, args.quota_rate, args.quota_burst)
+        )
+        print(f"{name:>18}: {result}")
+
+
+if __name__ == "__main__":
+    main()
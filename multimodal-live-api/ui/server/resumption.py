@@ -0,0 +1,89 @@
+"""
+Server-side store of upstream session resumption handles.
+
+Each browser connection gets an opaque, server-issued token in the ``ready``
+message. The latest ``session_resumption_update.new_handle`` from the Live
+API is stored under that token, and a client that reconnects with
+``?token=...`` resumes its upstream session instead of starting a new
+conversation. Handles never leave the server. The store is an LRU bounded by
+entry count; since every entry has the same TTL, update order is expiry
+order and expired entries are pruned from the front as new ones arrive.
+"""
+
+import secrets
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import counter
+
+
+def new_token():
+    return secrets.token_urlsafe(18)
+
+
+def token_from_request(websocket):
+    """Return the ``token`` query parameter of a WebSocket request, if any."""
+    request = getattr(websocket, "request", None)
+    path = getattr(request, "path", None) or getattr(websocket, "path", "") or ""
+    values = parse_qs(urlsplit(path).query).get("token")
+    return values[0] if values else None
+
+
+class ResumptionStore:
+    """Bounded, expiring map of client token -> latest resumption handle."""
+
+    def __init__(self, max_entries=10000, ttl=600):
+        """
+        Args:
+            max_entries: handles kept before the least recently updated is evicted
+            ttl: seconds a handle stays usable after its last update
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # token -> (handle, expires_at)
+        self.stored = counter(
+            "resumption_handles_stored_total", "Resumption handles received"
+        )
+        self.evicted = counter(
+            "resumption_handles_evicted_total", "Handles dropped by the size bound"
+        )
+        self.expired = counter(
+            "resumption_handles_expired_total", "Handles that expired unused"
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def put(self, token, handle):
+        now = time.monotonic()
+        self.entries.pop(token, None)
+        self.entries[token] = (handle, now + self.ttl)
+        self.stored.inc()
+        while self.entries:
+            oldest = next(iter(self.entries.values()))
+            if oldest[1] > now:
+                break
+            self.entries.popitem(last=False)
+            self.expired.inc()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted.inc()
+
+    def get(self, token):
+        """Return the live handle for ``token``, or None."""
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        handle, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self.entries[token]
+            self.expired.inc()
+            return None
+        return handle
+
+    def discard(self, token):
+        self.entries.pop(token, None)
@@ -0,0 +1,103 @@
+"""
+Server-wide deadline scheduler.
+
+A single task keeps a heap of (deadline, key) entries on the monotonic clock
+and sleeps until the earliest one, so thousands of sessions cost one wakeup
+per expiring deadline instead of one polling loop each. Rescheduling a key
+pushes a new entry and leaves the old one in the heap; stale entries are
+skipped when popped and the heap is compacted when they pile up.
+
+Callers that see frequent activity (like inactivity timers) should not
+reschedule on every event: record the activity time and let the callback
+push the deadline forward when it fires.
+"""
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Fire ``callback(key)`` at monotonic deadlines for many keys."""
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}  # key -> current deadline
+        self._callbacks = {}  # key -> callback
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()  # Callback tasks in flight
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, key, deadline, callback):
+        """Set (or replace) the deadline for ``key``."""
+        self._deadlines[key] = deadline
+        self._callbacks[key] = callback
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+        if self._heap[0][0] == deadline:
+            self._wakeup.set()  # New earliest deadline
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def cancel(self, key):
+        """Drop the deadline for ``key``; its heap entry becomes stale."""
+        self._deadlines.pop(key, None)
+        self._callbacks.pop(key, None)
+
+    def _compact(self):
+        self._heap = [
+            entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]
+        ]
+        heapq.heapify(self._heap)
+
+    def _fire(self, key, callback):
+        try:
+            result = callback(key)
+        except Exception as e:
+            logger.error("Scheduler callback for %s failed: %s", key, e)
+            return
+        if inspect.isawaitable(result):
+            # Run async callbacks as tasks so a slow one can't delay the others
+            task = asyncio.ensure_future(result)
+            self._running.add(task)
+            task.add_done_callback(self._callback_done)
+
+    def _callback_done(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Scheduler callback failed: %s", task.exception())
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, key = heapq.heappop(self._heap)
+                if self._deadlines.get(key) != deadline:
+                    continue  # Rescheduled or cancelled
+                del self._deadlines[key]
+                self._fire(key, self._callbacks.pop(key))
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -1,10 +1,12 @@
+import argparse
 import asyncio
+import contextlib
 import json
-import base64
-from datetime import datetime
+import logging
+import os
+import signal
 
 # Import Google Generative AI components
-from google import genai
 from google.genai import types
 from google.genai.types import (
     LiveConnectConfig,
@@ -17,95 +19,28 @@ from google.genai.types import (
 from common import (
     BaseWebSocketServer,
     logger,
-    PROJECT_ID,
-    LOCATION,
     MODEL,
     VOICE_NAME,
     SEND_SAMPLE_RATE,
     SYSTEM_INSTRUCTION,
-    get_order_status,
-    check_storage_availability,
-    book_storage_reservation,
-    # validate_user_identity,
+    TOOLS,
+    interruptions,
+    upstream_audio_bytes_in,
+    upstream_messages_in,
 )
 
-# Function declarations for LiveAPI
-order_status_function = types.FunctionDeclaration(
-    name="get_order_status",
-    description="Get the current status and details of an order",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "order_id": types.Schema(
-                type=types.Type.STRING, description="The order ID to look up"
-            )
-        },
-        required=["order_id"],
-    ),
-)
-
-storage_availability_function = types.FunctionDeclaration(
-    name="check_storage_availability",
-    description="Check available storage units by size and location",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "size": types.Schema(
-                type=types.Type.STRING,
-                description="Storage unit size (e.g., 'Small (5x5)', 'Medium (10x10)', 'Large (10x20)')",
-            ),
-            "location": types.Schema(
-                type=types.Type.STRING,
-                description="Location preference (e.g., 'Downtown', 'Midtown', 'Airport', 'Suburbs')",
-            ),
-        },
-    ),
-)
-
-book_reservation_function = types.FunctionDeclaration(
-    name="book_storage_reservation",
-    description="Create a new storage reservation for a customer",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "customer_name": types.Schema(
-                type=types.Type.STRING, description="Name of the customer"
-            ),
-            "size": types.Schema(
-                type=types.Type.STRING, description="Storage unit size"
-            ),
-            "location": types.Schema(
-                type=types.Type.STRING, description="Preferred location"
-            ),
-            "start_date": types.Schema(
-                type=types.Type.STRING,
-                description="When the rental starts (YYYY-MM-DD format)",
-            ),
-            "duration_months": types.Schema(
-                type=types.Type.INTEGER, description="How many months to book"
-            ),
-        },
-        required=["customer_name", "size", "location", "start_date", "duration_months"],
-    ),
-)
-
-# validate_identity_function = types.FunctionDeclaration(
-#     name="validate_user_identity",
-#     description="Verify user identity using address information",
-#     parameters=types.Schema(
-#         type=types.Type.OBJECT,
-#         properties={
-#             "address": types.Schema(
-#                 type=types.Type.STRING,
-#                 description="User's address or city (e.g., 'NW Calgary')",
-#             ),
-#         },
-#         required=["address"],
-#     ),
-# )
-
-# Initialize Google client
-client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
+from admission import load_priority_keys
+from audio_codecs import available_codecs
+from backends import GeminiLiveBackend, create_backend
+from flow_control import POLICIES, POLICY_DROP_OLDEST
+from metrics import counter, serve_metrics
+from rate_limit import ConnectRateLimiter, RateLimitedBackend, parse_limits
+from tool_cache import ToolResultCache
+from tool_executor import ToolExecutor
+from structured_logging import level_route, log_event
+from tracing import INPUT_TRANSCRIPTION, MODEL_AUDIO, SpanExporter
+from upstream_pool import UpstreamSessionPool
+from workers import Supervisor, report_stats
 
 # LiveAPI Configuration
 config = LiveConnectConfig(
@@ -121,38 +56,108 @@ config = LiveConnectConfig(
     system_instruction=SYSTEM_INSTRUCTION,
     tools=[
         types.Tool(
-            function_declarations=[
-                order_status_function,
-                storage_availability_function,
-                book_reservation_function,
-                # validate_identity_function,
-            ]
+            # Generated from the shared tool registry
+            function_declarations=TOOLS.function_declarations()
         )
     ],
 )
 
 
+def session_config(handle=None):
+    """LiveAPI config for a new session, or for resuming ``handle``"""
+    if handle is None:
+        return config
+    return config.model_copy(
+        update={"session_resumption": types.SessionResumptionConfig(handle=handle)}
+    )
+
+
+# Tool execution settings
+TOOL_WORKERS = 8  # Threads for blocking tool calls, shared by all sessions
+TOOL_TIMEOUT = 10.0  # Seconds before a tool call is abandoned
+TOOL_CACHE_ENTRIES = 1024  # Cached read-only tool results, shared by all sessions
+TOOL_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+
 class LiveAPIWebSocketServer(BaseWebSocketServer):
     """WebSocket server implementation using Gemini LiveAPI directly."""
 
-    def __init__(self):
-        super().__init__()
-        self.last_activity = {}  # Track last activity time for each client
-        self.should_stop = {}  # Track if session should stop
-        self.has_speech = {}  # Track if audio contains speech
+    def __init__(self, host="0.0.0.0", port=8765, backend=None):
+        super().__init__(host, port, backend or GeminiLiveBackend())
+        self.RESUME_ENABLED = True  # Resume upstream sessions on reconnect
+        self.pool = None  # Optional UpstreamSessionPool of warm sessions
+        self.resumptions = counter(
+            "upstream_resumptions_total", "Reconnects that resumed a session"
+        )
+        self.resumption_failures = counter(
+            "upstream_resumption_failures_total", "Resumption handles rejected"
+        )
+        self.tool_executor = ToolExecutor(
+            TOOLS.dispatch,
+            max_workers=TOOL_WORKERS,
+            default_timeout=TOOL_TIMEOUT,
+            timeouts=TOOLS.timeouts(),
+            async_tools=TOOLS.async_tools(),
+            cache=ToolResultCache(
+                TOOLS.cache_ttls(),
+                max_entries=TOOL_CACHE_ENTRIES,
+                max_bytes=TOOL_CACHE_MAX_BYTES,
+            ),
+            invalidations=TOOLS.invalidations(),
+        )
+
+    async def connect_upstream(self, stack, client_id):
+        """
+        Open the client's upstream session on ``stack``, resuming the previous
+        one if the client reconnected with a token that has a stored handle.
+        Falls back to a fresh session if the handle is rejected. Fresh
+        sessions come from the warm pool when one is configured.
+        """
+        token = self.client_tokens.get(client_id)
+        handle = self.resumption.get(token) if token else None
+        if handle is not None:
+            try:
+                session = await stack.enter_async_context(
+                    self.backend.connect(model=MODEL, config=session_config(handle))
+                )
+                logger.info(
+                    "Client %s resumed its upstream session",
+                    client_id,
+                    extra={"client_id": client_id},
+                )
+                self.resumptions.inc()
+                return session
+            except Exception as e:
+                logger.warning(
+                    "Client %s could not resume session: %s",
+                    client_id,
+                    e,
+                    extra={"client_id": client_id},
+                )
+                self.resumption_failures.inc()
+                self.resumption.discard(token)
+        if self.pool is not None:
+            return await stack.enter_async_context(self.pool.lease())
+        return await stack.enter_async_context(
+            self.backend.connect(model=MODEL, config=config)
+        )
 
     async def process_audio(self, websocket, client_id):
         # Initialize client state
         self.active_clients[client_id] = websocket
-        self.last_activity[client_id] = datetime.utcnow()
-        self.should_stop[client_id] = False
-        self.has_speech[client_id] = False
+        tracer = self.tracers[client_id]
 
-        # Connect to Gemini using LiveAPI
-        async with client.aio.live.connect(model=MODEL, config=config) as session:
+        # Connect to Gemini (or the configured stand-in) using LiveAPI
+        async with contextlib.AsyncExitStack() as stack:
+            session = await self.connect_upstream(stack, client_id)
+            self.upstream_sessions[client_id] = session
+            self.start_inactivity_timer(client_id)
             async with asyncio.TaskGroup() as tg:
                 # Create a queue for audio data from the client
-                audio_queue = asyncio.Queue()
+                audio_queue = self.create_audio_queue(client_id, websocket)
+                # Messages to the client go through a prioritized queue so a
+                # slow client never stalls the upstream receive loop
+                outbound = self.create_outbound(client_id, websocket)
 
                 # Task to process incoming WebSocket messages
                 async def handle_websocket_messages():
@@ -161,106 +166,83 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                             if self.should_stop[client_id]:
                                 break
                             try:
-                                data = json.loads(message)
+                                data = self.decode_message(client_id, message)
                                 if data.get("type") == "audio":
-                                    # Only update activity if we've detected speech
-                                    if self.has_speech[client_id]:
-                                        self.last_activity[client_id] = (
-                                            datetime.utcnow()
-                                        )
-                                        logger.info(
-                                            "🗣️ Activity updated - speech detected"
-                                        )
-                                        self.has_speech[client_id] = False  # Reset flag
-
-                                    # Decode base64 audio data
-                                    audio_bytes = base64.b64decode(data.get("data", ""))
-                                    # Put audio in queue for processing
-                                    await audio_queue.put(audio_bytes)
+                                    # VAD drops long silence and updates activity
+                                    # as soon as speech is heard
+                                    audio_bytes = self.gate_audio(
+                                        client_id, data["data"]
+                                    )
+                                    if audio_bytes:
+                                        await audio_queue.put(audio_bytes)
                                 elif data.get("type") == "text":
                                     # Always update activity for text messages
-                                    self.last_activity[client_id] = datetime.utcnow()
-                                    logger.info("💬 Activity updated by text message")
-                                    logger.info(f"Received text: {data.get('data')}")
+                                    self.update_activity(client_id, from_client=True)
+                                    log_event(
+                                        logger,
+                                        logging.INFO,
+                                        client_id,
+                                        "activity",
+                                        "💬 Received text: %s",
+                                        data.get("data"),
+                                    )
                             except json.JSONDecodeError:
                                 logger.error("Invalid JSON message received")
                             except Exception as e:
-                                logger.error(f"Error processing message: {e}")
-                    except Exception as e:
-                        if not self.should_stop[client_id]:
-                            logger.error(f"WebSocket message handling error: {e}")
-
-                # Task to monitor user inactivity
-                async def monitor_inactivity():
-                    warned = False
-                    try:
-                        while not self.should_stop[client_id]:
-                            await asyncio.sleep(1)  # Check every second
-                            try:
-                                now = datetime.utcnow()
-                                last = self.last_activity.get(client_id)
-                                if not last:  # Skip if no activity recorded yet
-                                    continue
-
-                                idle_seconds = (now - last).total_seconds()
-                                logger.info(
-                                    f"⏰ Idle for {idle_seconds:.1f} seconds"
-                                )  # Debug log
-
-                                if idle_seconds >= 10 and not warned:
-                                    # Warn user with follow-up message
-                                    logger.info(
-                                        "🟡 User inactive for 5s - sending follow-up"
-                                    )
-                                    await session.send_realtime_input(
-                                        text="Are you still there? Let me know if you need help with anything else."
-                                    )
-                                    warned = True
-
-                                if idle_seconds >= 15 and warned:
-                                    logger.info(
-                                        "🔴 User inactive for 8s - disconnecting"
-                                    )
-                                    await session.send_realtime_input(
-                                        text="Since you're not responding, I'm ending this session now. Talk to you later!"
-                                    )
-                                    await websocket.send(
-                                        json.dumps(
-                                            {
-                                                "type": "timeout",
-                                                "data": "Session ended due to inactivity",
-                                            }
-                                        )
-                                    )
-                                    self.should_stop[client_id] = True
-                                    break
-                            except Exception as e:
-                                logger.error(f"Error in inactivity check: {e}")
+                                log_event(
+                                    logger,
+                                    logging.ERROR,
+                                    client_id,
+                                    "message_error",
+                                    "Error processing message: %s",
+                                    e,
+                                )
+                        self.set_end_reason(client_id, "client_closed")
                     except Exception as e:
                         if not self.should_stop[client_id]:
-                            logger.error(f"Inactivity monitor error: {e}")
+                            logger.error(
+                                "WebSocket message handling error: %s",
+                                e,
+                                extra={"client_id": client_id},
+                            )
+                            self.set_end_reason(client_id, "client_error")
 
                 # Task to process and send audio to Gemini
                 async def process_and_send_audio():
+                    async def send(data):
+                        # Send the audio data to Gemini
+                        await session.send_realtime_input(
+                            media={
+                                "data": data,
+                                "mime_type": f"audio/pcm;rate={SEND_SAMPLE_RATE}",
+                            }
+                        )
+
                     try:
-                        while not self.should_stop[client_id]:
-                            try:
-                                data = await asyncio.wait_for(
-                                    audio_queue.get(), timeout=1.0
-                                )
-                                # Send the audio data to Gemini
-                                await session.send_realtime_input(
-                                    media={
-                                        "data": data,
-                                        "mime_type": f"audio/pcm;rate={SEND_SAMPLE_RATE}",
-                                    }
-                                )
-                                audio_queue.task_done()
-                            except asyncio.TimeoutError:
-                                continue  # Check should_stop flag every second
+                        await self.forward_audio(client_id, audio_queue, send)
                     except Exception as e:
                         if not self.should_stop[client_id]:
-                            logger.error(f"Audio processing error: {e}")
+                            logger.error(
+                                "Audio processing error: %s",
+                                e,
+                                extra={"client_id": client_id},
+                            )
+
+                # Tool calls in flight for this session
+                pending_tools = set()
+
+                async def send_function_response(function_call, result):
+                    """Send a tool result back to the model"""
+                    await session.send_tool_response(
+                        function_responses=[
+                            {
+                                "id": function_call.id,
+                                "name": function_call.name,
+                                "response": result,
+                            }
+                        ]
+                    )
+                    tracer.tool_finished(function_call.id)
 
                 # Task to receive and play responses
                 async def receive_and_play():
@@ -273,6 +255,7 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                 async for response in session.receive():
                                     if self.should_stop[client_id]:
                                         break
+                                    upstream_messages_in.inc()
 
                                     # Check for speech in input transcription
                                     input_transcription = getattr(
@@ -281,132 +264,101 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                         None,
                                     )
                                     if input_transcription and input_transcription.text:
-                                        # Set speech flag if we got a transcription
                                         if input_transcription.text.strip() not in [
                                             "<noise>",
                                             "",
                                         ]:
-                                            self.has_speech[client_id] = True
-                                            logger.info(
-                                                f"Speech detected: {input_transcription.text}"
+                                            tracer.mark(INPUT_TRANSCRIPTION)
+                                            log_event(
+                                                logger,
+                                                logging.INFO,
+                                                client_id,
+                                                "speech_detected",
+                                                "Speech detected: %s",
+                                                input_transcription.text,
                                             )
 
                                     # Update activity when receiving any response
-                                    self.last_activity[client_id] = datetime.utcnow()
+                                    self.update_activity(client_id)
 
                                     # Get session resumption update if available
                                     if response.session_resumption_update:
                                         update = response.session_resumption_update
                                         if update.resumable and update.new_handle:
-                                            session_id = update.new_handle
-                                            logger.info(f"New SESSION: {session_id}")
-                                            # Send session ID to client
-                                            session_id_msg = json.dumps(
-                                                {
-                                                    "type": "session_id",
-                                                    "data": session_id,
-                                                }
+                                            # The handle grants access to the
+                                            # conversation: it stays server side
+                                            # and the client only ever sees its
+                                            # reconnect token
+                                            logger.debug(
+                                                "Resumption handle updated",
+                                                extra={"client_id": client_id},
                                             )
-                                            await websocket.send(session_id_msg)
+                                            token = self.client_tokens.get(client_id)
+                                            if token and self.RESUME_ENABLED:
+                                                resumable = token in self.resumption
+                                                self.resumption.put(
+                                                    token, update.new_handle
+                                                )
+                                                if not resumable:
+                                                    # Tell the client once that
+                                                    # its token can now resume
+                                                    session_id_msg = json.dumps(
+                                                        {
+                                                            "type": "session_id",
+                                                            "data": token,
+                                                        }
+                                                    )
+                                                    await self.send_message(
+                                                        client_id,
+                                                        websocket,
+                                                        session_id_msg,
+                                                        control=True,
+                                                    )
 
                                     # Check if connection will be terminated soon
                                     if response.go_away is not None:
                                         logger.info(
-                                            f"Session will terminate in: {response.go_away.time_left}"
+                                            "Session will terminate in: %s",
+                                            response.go_away.time_left,
+                                            extra={"client_id": client_id},
                                         )
 
                                     server_content = response.server_content
 
-                                    # Handle function calls
+                                    # Run function calls concurrently off the
+                                    # receive loop; each response is sent as
+                                    # soon as its tool finishes
+                                    function_calls = []
+                                    tool_call = getattr(response, "tool_call", None)
+                                    if tool_call and tool_call.function_calls:
+                                        function_calls.extend(tool_call.function_calls)
                                     if server_content and server_content.model_turn:
                                         for part in server_content.model_turn.parts:
                                             if (
                                                 hasattr(part, "function_call")
                                                 and part.function_call
                                             ):
-                                                # Handle function call
-                                                function_name = part.function_call.name
-                                                function_args = part.function_call.args
-
-                                                logger.info(
-                                                    f"Function call: {function_name} with args: {function_args}"
+                                                function_calls.append(
+                                                    part.function_call
                                                 )
-
-                                                # Execute the function
-                                                try:
-                                                    if (
-                                                        function_name
-                                                        == "get_order_status"
-                                                    ):
-                                                        result = get_order_status(
-                                                            function_args.get(
-                                                                "order_id"
-                                                            )
-                                                        )
-                                                    elif (
-                                                        function_name
-                                                        == "check_storage_availability"
-                                                    ):
-                                                        result = (
-                                                            check_storage_availability(
-                                                                function_args.get(
-                                                                    "size"
-                                                                ),
-                                                                function_args.get(
-                                                                    "location"
-                                                                ),
-                                                            )
-                                                        )
-                                                    elif (
-                                                        function_name
-                                                        == "book_storage_reservation"
-                                                    ):
-                                                        result = (
-                                                            book_storage_reservation(
-                                                                function_args.get(
-                                                                    "customer_name"
-                                                                ),
-                                                                function_args.get(
-                                                                    "size"
-                                                                ),
-                                                                function_args.get(
-                                                                    "location"
-                                                                ),
-                                                                function_args.get(
-                                                                    "start_date"
-                                                                ),
-                                                                function_args.get(
-                                                                    "duration_months"
-                                                                ),
-                                                            )
-                                                        )
-                                                    else:
-                                                        result = {
-                                                            "error": f"Unknown function: {function_name}"
-                                                        }
-
-                                                    # Send function response back to the model
-                                                    await session.send_realtime_input(
-                                                        function_response={
-                                                            "id": part.function_call.id,
-                                                            "name": function_name,
-                                                            "response": result,
-                                                        }
-                                                    )
-
-                                                except Exception as e:
-                                                    logger.error(
-                                                        f"Error executing function {function_name}: {e}"
-                                                    )
-                                                    await session.send_realtime_input(
-                                                        function_response={
-                                                            "id": part.function_call.id,
-                                                            "name": function_name,
-                                                            "response": {
-                                                                "error": str(e)
-                                                            },
-                                                        }
-                                                    )
+                                    for function_call in function_calls:
+                                        tracer.tool_started(
+                                            function_call.id, function_call.name
+                                        )
+                                        logger.info(
+                                            "Function call: %s with args: %s",
+                                            function_call.name,
+                                            function_call.args,
+                                            extra={"client_id": client_id},
+                                        )
+                                    if function_calls:
+                                        for task in self.tool_executor.run_calls(
+                                            function_calls, send_function_response
+                                        ):
+                                            pending_tools.add(task)
+                                            task.add_done_callback(
+                                                pending_tools.discard
+                                            )
 
                                     # Handle interruption
                                     if (
@@ -414,38 +366,50 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                         and server_content.interrupted
                                     ):
                                         logger.info("🤐 INTERRUPTION DETECTED")
-                                        # Just notify the client - no need to handle audio on server side
-                                        await websocket.send(
+                                        interruptions.inc()
+                                        tracer.end_turn("interrupted")
+                                        await self.end_audio_turn(
+                                            client_id, websocket, interrupted=True
+                                        )
+                                        # Queued model audio was just dropped;
+                                        # tell the client ahead of anything else
+                                        await self.send_message(
+                                            client_id,
+                                            websocket,
                                             json.dumps(
                                                 {
                                                     "type": "interrupted",
                                                     "data": "Response interrupted by user input",
                                                 }
-                                            )
+                                            ),
+                                            control=True,
                                         )
 
                                     # Process model response
                                     if server_content and server_content.model_turn:
                                         for part in server_content.model_turn.parts:
                                             if part.inline_data:
+                                                upstream_audio_bytes_in.inc(
+                                                    len(part.inline_data.data)
+                                                )
+                                                tracer.mark(MODEL_AUDIO)
                                                 # Send audio to client only (don't play locally)
-                                                b64_audio = base64.b64encode(
-                                                    part.inline_data.data
-                                                ).decode("utf-8")
-                                                await websocket.send(
-                                                    json.dumps(
-                                                        {
-                                                            "type": "audio",
-                                                            "data": b64_audio,
-                                                        }
-                                                    )
+                                                await self.send_audio(
+                                                    client_id,
+                                                    websocket,
+                                                    part.inline_data.data,
                                                 )
 
                                     # Handle turn completion
                                     if server_content and server_content.turn_complete:
                                         logger.info("✅ Gemini done talking")
-                                        await websocket.send(
-                                            json.dumps({"type": "turn_complete"})
+                                        tracer.end_turn("turn_complete")
+                                        await self.end_audio_turn(client_id, websocket)
+                                        # In order, after the turn's audio
+                                        await self.send_message(
+                                            client_id,
+                                            websocket,
+                                            json.dumps({"type": "turn_complete"}),
                                         )
 
                                     # Handle transcriptions
@@ -462,13 +426,15 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                             output_transcription.text
                                         )
                                         # Send text to client
-                                        await websocket.send(
+                                        await self.send_message(
+                                            client_id,
+                                            websocket,
                                             json.dumps(
                                                 {
                                                     "type": "text",
                                                     "data": output_transcription.text,
                                                 }
-                                            )
+                                            ),
                                         )
 
                                     input_transcription = getattr(
@@ -482,53 +448,439 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                         )
 
                                 logger.info(
-                                    f"Output transcription: {''.join(output_transcriptions)}"
+                                    "Output transcription: %s",
+                                    "".join(output_transcriptions),
+                                    extra={"client_id": client_id},
                                 )
                                 logger.info(
-                                    f"Input transcription: {''.join(input_transcriptions)}"
+                                    "Input transcription: %s",
+                                    "".join(input_transcriptions),
+                                    extra={"client_id": client_id},
                                 )
 
                             except Exception as e:
                                 if not self.should_stop[client_id]:
-                                    logger.error(f"Error processing response: {e}")
+                                    logger.error(
+                                        "Error processing response: %s",
+                                        e,
+                                        extra={"client_id": client_id},
+                                    )
+                                    self.set_end_reason(client_id, "upstream_error")
                                 break
 
                     except Exception as e:
                         if not self.should_stop[client_id]:
-                            logger.error(f"Error in receive_and_play: {e}")
+                            logger.error(
+                                "Error in receive_and_play: %s",
+                                e,
+                                extra={"client_id": client_id},
+                            )
 
                 # Start all tasks
                 tasks = [
                     tg.create_task(handle_websocket_messages()),
                     tg.create_task(process_and_send_audio()),
                     tg.create_task(receive_and_play()),
-                    tg.create_task(monitor_inactivity()),
+                    tg.create_task(outbound.run()),
                 ]
+                # End the whole session when the client leaves, a task
+                # fails, or the inactivity timer disconnects the client
+                tg.create_task(self.supervise_session(client_id, tasks))
 
             # After task group exits, ensure cleanup
+            for task in pending_tools:
+                task.cancel()
+            await self.close_outbound(client_id)
             self.should_stop[client_id] = True
             self.last_activity.pop(client_id, None)
             self.active_clients.pop(client_id, None)
-            self.has_speech.pop(client_id, None)
             try:
                 await websocket.close()
             except:
                 pass  # Ignore errors during cleanup
 
 
-async def main():
-    """Main function to start the server"""
-    server = LiveAPIWebSocketServer()
-    await server.start()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Gemini LiveAPI WebSocket server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--backend",
+        choices=["gemini", "mock"],
+        default="gemini",
+        help="Upstream Live backend; 'mock' runs fully offline",
+    )
+    parser.add_argument(
+        "--no-vad",
+        dest="vad",
+        action="store_false",
+        help="Forward all client audio upstream, silence included",
+    )
+    parser.add_argument(
+        "--vad-hangover-ms",
+        type=int,
+        default=1000,
+        help="Trailing silence forwarded after speech so the model sees the pause",
+    )
+    parser.add_argument(
+        "--vad-thin-every",
+        type=int,
+        default=0,
+        help="Forward every Nth silent 20 ms frame instead of dropping all",
+    )
+    parser.add_argument(
+        "--queue-max-ms",
+        type=int,
+        default=2000,
+        help="Client audio buffered per session before overflow",
+    )
+    parser.add_argument(
+        "--queue-policy",
+        choices=POLICIES,
+        default=POLICY_DROP_OLDEST,
+        help="What to do when the ingress audio buffer is full",
+    )
+    parser.add_argument(
+        "--coalesce-ms",
+        type=int,
+        default=60,
+        help="Target upstream audio chunk duration (0 disables coalescing)",
+    )
+    parser.add_argument(
+        "--coalesce-max-delay-ms",
+        type=int,
+        default=100,
+        help="Max time audio may wait in the coalescing buffer",
+    )
+    parser.add_argument(
+        "--egress-queue-ms",
+        type=int,
+        default=10000,
+        help="Model audio buffered per session for a slow client before overflow",
+    )
+    parser.add_argument(
+        "--egress-queue-policy",
+        choices=POLICIES,
+        default=POLICY_DROP_OLDEST,
+        help="What to do when the egress audio buffer is full",
+    )
+    parser.add_argument(
+        "--egress-coalesce-ms",
+        type=int,
+        default=200,
+        help="Largest audio frame built from a client's backlog (0 disables)",
+    )
+    parser.add_argument(
+        "--no-tool-cache",
+        dest="tool_cache",
+        action="store_false",
+        help="Run every tool call instead of reusing recent read-only results",
+    )
+    parser.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="Start a new upstream session on every reconnect",
+    )
+    parser.add_argument(
+        "--resume-ttl",
+        type=float,
+        default=600,
+        help="Seconds a reconnecting client can resume its upstream session",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=0,
+        help="Concurrent client sessions per process; more wait in a queue "
+        "(0 admits everyone)",
+    )
+    parser.add_argument(
+        "--admission-queue",
+        type=int,
+        default=100,
+        help="Clients allowed to wait for a session; later ones are rejected",
+    )
+    parser.add_argument(
+        "--admission-max-wait",
+        type=float,
+        default=60,
+        help="Seconds a client waits for a session before being rejected",
+    )
+    parser.add_argument(
+        "--priority-keys-file",
+        default=None,
+        help="File of keys, one per line, that let clients presenting them "
+        "(Authorization: Bearer, or ?key=) skip ahead in the admission queue",
+    )
+    parser.add_argument(
+        "--pool-min",
+        type=int,
+        default=0,
+        help="Upstream sessions kept connected ahead of clients (0 disables the pool)",
+    )
+    parser.add_argument(
+        "--pool-max",
+        type=int,
+        default=8,
+        help="Upper bound for the warm pool as it grows with the arrival rate",
+    )
+    parser.add_argument(
+        "--pool-max-age",
+        type=float,
+        default=300,
+        help="Seconds an idle warm session is kept before it is recycled",
+    )
+    parser.add_argument(
+        "--connect-rate",
+        type=float,
+        default=0,
+        help="Sustained upstream sessions opened per second (0 disables the limit)",
+    )
+    parser.add_argument(
+        "--connect-burst",
+        type=float,
+        default=10,
+        help="Upstream sessions that may be opened at once before --connect-rate "
+        "applies",
+    )
+    parser.add_argument(
+        "--connect-limits",
+        type=parse_limits,
+        default={},
+        help="Per model/location limits overriding the two above, as "
+        "MODEL[@LOCATION]=RATE/BURST,...",
+    )
+    parser.add_argument(
+        "--connect-retries",
+        type=int,
+        default=3,
+        help="Retries, with jittered backoff, of upstream connects refused as "
+        "rate limited (429)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="Port for the Prometheus /metrics endpoint, e.g. 9100 (default: off)",
+    )
+    parser.add_argument(
+        "--remote-admin",
+        action="store_true",
+        help="Let non-local clients use admin endpoints such as POST /loglevel",
+    )
+    parser.add_argument(
+        "--codecs",
+        type=lambda value: [name for name in value.split(",") if name],
+        default=available_codecs(),
+        help="Comma-separated model audio codecs offered to clients "
+        f"(default: {','.join(available_codecs())})",
+    )
+    parser.add_argument(
+        "--trace-export",
+        default=None,
+        help="Export per-turn latency spans as OTLP/JSON to this file, or to an "
+        "OTLP/HTTP collector URL such as http://localhost:4318/v1/traces",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes sharing the port via SO_REUSEPORT",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30,
+        help="Seconds sessions get to finish on shutdown before being stopped",
+    )
+    mock = parser.add_argument_group("mock backend")
+    mock.add_argument("--mock-connect-delay", type=float, default=0.0)
+    mock.add_argument("--mock-response-delay", type=float, default=0.3)
+    mock.add_argument("--mock-audio-chunks", type=int, default=25)
+    mock.add_argument("--mock-chunk-ms", type=int, default=40)
+    mock.add_argument(
+        "--mock-chunk-interval",
+        type=float,
+        default=None,
+        help="Seconds between audio chunks (default: real time)",
+    )
+    mock.add_argument("--mock-jitter", type=float, default=0.0)
+    mock.add_argument("--mock-turn-trigger-ms", type=int, default=1000)
+    mock.add_argument(
+        "--mock-end-of-speech-ms",
+        type=int,
+        default=500,
+        help="Silence after speech that ends the user's turn (0: answer after "
+        "--mock-turn-trigger-ms of any audio)",
+    )
+    mock.add_argument("--mock-interrupt-after-ms", type=int, default=None)
+    mock.add_argument("--mock-function-call-every", type=int, default=0)
+    mock.add_argument("--mock-go-away-after", type=float, default=None)
+    mock.add_argument(
+        "--mock-rate-limit",
+        type=float,
+        default=0,
+        help="Simulated upstream quota: sessions/s before connects fail with 429",
+    )
+    mock.add_argument("--mock-rate-limit-burst", type=float, default=None)
+    mock.add_argument("--mock-seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def build_backend(args):
+    """Create the upstream backend selected on the command line"""
+    if args.backend == "mock":
+        return create_backend(
+            "mock",
+            connect_delay=args.mock_connect_delay,
+            response_delay=args.mock_response_delay,
+            audio_chunks=args.mock_audio_chunks,
+            chunk_ms=args.mock_chunk_ms,
+            chunk_interval=args.mock_chunk_interval,
+            timing_jitter=args.mock_jitter,
+            turn_trigger_ms=args.mock_turn_trigger_ms,
+            end_of_speech_ms=args.mock_end_of_speech_ms,
+            interrupt_after_ms=args.mock_interrupt_after_ms,
+            function_call_every=args.mock_function_call_every,
+            go_away_after=args.mock_go_away_after,
+            rate_limit=args.mock_rate_limit,
+            rate_limit_burst=args.mock_rate_limit_burst,
+            seed=args.mock_seed,
+        )
+    return create_backend(args.backend)
+
+
+async def main(args, worker_index=None, stats_queue=None):
+    """Main function to start the server (or one worker of several)"""
+    # Every upstream connect (inline, warm pool or resumption) is metered.
+    # Limits are for the whole server, so workers split them.
+    workers = max(1, args.workers)
+    limiter = ConnectRateLimiter(
+        args.connect_rate / workers,
+        max(1.0, args.connect_burst / workers),
+        limits={
+            key: (rate / workers, max(1.0, burst / workers))
+            for key, (rate, burst) in args.connect_limits.items()
+        },
+        max_retries=args.connect_retries,
+    )
+    backend = RateLimitedBackend(build_backend(args), limiter)
+    server = LiveAPIWebSocketServer(args.host, args.port, backend)
+    server.REUSE_PORT = args.workers > 1
+    server.DRAIN_TIMEOUT = args.drain_timeout
+    server.COALESCE_TARGET_MS = args.coalesce_ms
+    server.COALESCE_MAX_DELAY_MS = args.coalesce_max_delay_ms
+    server.VAD_ENABLED = args.vad
+    server.AUDIO_QUEUE_MAX_MS = args.queue_max_ms
+    server.AUDIO_QUEUE_POLICY = args.queue_policy
+    server.EGRESS_QUEUE_MAX_MS = args.egress_queue_ms
+    server.EGRESS_QUEUE_POLICY = args.egress_queue_policy
+    server.EGRESS_COALESCE_MS = args.egress_coalesce_ms
+    server.VAD_HANGOVER_MS = args.vad_hangover_ms
+    server.VAD_THIN_EVERY = args.vad_thin_every
+    server.RESUME_ENABLED = args.resume
+    server.AUDIO_CODECS = [name for name in args.codecs if name in available_codecs()]
+    server.resumption.ttl = args.resume_ttl
+    server.admission.max_sessions = args.max_sessions
+    server.admission.max_queue = args.admission_queue
+    server.admission.max_wait = args.admission_max_wait
+    if args.priority_keys_file:
+        server.PRIORITY_KEYS = load_priority_keys(args.priority_keys_file)
+    if not args.tool_cache:
+        server.tool_executor.cache = None
+    if args.pool_min > 0:
+        server.pool = UpstreamSessionPool(
+            lambda: server.backend.connect(model=MODEL, config=config),
+            min_size=args.pool_min,
+            max_size=max(args.pool_min, args.pool_max),
+            max_age=args.pool_max_age,
+        )
+        await server.pool.start()
+    if args.trace_export:
+        target = args.trace_export
+        if worker_index is not None and not target.startswith(("http:", "https:")):
+            target = f"{target}.{worker_index}"  # One file per worker process
+        server.span_exporter = SpanExporter(
+            target, resource={"process.pid": os.getpid()}
+        )
+    if args.metrics_port and stats_queue is None:
+        # In --workers mode the supervisor serves the merged metrics instead
+        serve_metrics(
+            args.host,
+            args.metrics_port,
+            routes={"/loglevel": level_route},
+            remote_admin=args.remote_admin,
+        )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, server.request_shutdown)
+    if stats_queue is not None:
+        reporter = asyncio.create_task(report_stats(stats_queue, worker_index))
+    try:
+        await server.start()
+    finally:
+        if stats_queue is not None:
+            reporter.cancel()
+        if server.pool is not None:
+            logger.info("Upstream pool: %s", server.pool.stats())
+            await server.pool.close()
+        summary = server.tool_executor.latency_summary()
+        for tool, (count, p50, p95, p99) in summary.items():
+            logger.info(
+                "Tool %s: %d calls, latency p50<=%ss p95<=%ss p99<=%ss",
+                tool,
+                count,
+                p50,
+                p95,
+                p99,
+            )
+        cache = server.tool_executor.cache
+        if cache is not None:
+            stats = cache.stats()
+            for tool, (hits, misses, coalesced) in stats["tools"].items():
+                logger.info(
+                    "Tool cache %s: %d hits, %d misses, %d coalesced",
+                    tool,
+                    hits,
+                    misses,
+                    coalesced,
+                )
+            logger.info(
+                "Tool cache: %d entries, %d bytes, %d evictions",
+                stats["entries"],
+                stats["bytes"],
+                cache.evictions.value,
+            )
+        server.tool_executor.shutdown()
+        if server.span_exporter is not None:
+            server.span_exporter.close()
+
+
+def run_worker(args, index, stats_queue):
+    """Entry point of one worker process in --workers mode"""
+    asyncio.run(main(args, index, stats_queue))
 
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.workers > 1:
+            Supervisor(
+                run_worker,
+                (args,),
+                workers=args.workers,
+                drain_timeout=args.drain_timeout,
+                metrics_address=(
+                    (args.host, args.metrics_port) if args.metrics_port else None
+                ),
+            ).run()
+        else:
+            asyncio.run(main(args))
     except KeyboardInterrupt:
         logger.info("Exiting application via KeyboardInterrupt...")
     except Exception as e:
-        logger.error(f"Unhandled exception in main: {e}")
+        logger.error("Unhandled exception in main: %s", e)
         import traceback
 
         traceback.print_exc()
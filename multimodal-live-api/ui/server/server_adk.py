@@ -1,6 +1,7 @@
 import asyncio
 import json
-import base64
+import logging
+import os
 
 # Import Google ADK components
 from google.adk.agents import Agent, LiveRequestQueue
@@ -21,83 +22,29 @@ load_dotenv()
 from common import (
     BaseWebSocketServer,
     logger,
+    LOCATION,
     MODEL,
     VOICE_NAME,
     SEND_SAMPLE_RATE,
     SYSTEM_INSTRUCTION,
-    get_order_status,
-    check_storage_availability,
-    book_storage_reservation,
-    validate_user_identity,
+    TOOLS,
+    interruptions,
+    upstream_audio_bytes_in,
+    upstream_messages_in,
 )
-
-
-# Function tool for order status
-def order_status_tool(order_id: str):
-    """Get the current status and details of an order.
-
-    Args:
-        order_id: The order ID to look up.
-
-    Returns:
-        Dictionary containing order status details
-    """
-    return get_order_status(order_id)
-
-
-# Function tool for storage availability
-def storage_availability_tool(size: str = None, location: str = None):
-    """Check available storage units by size and location.
-
-    Args:
-        size: Storage unit size (e.g., "Small (5x5)", "Medium (10x10)", "Large (10x20)")
-        location: Location preference (e.g., "Downtown", "Midtown", "Airport", "Suburbs")
-
-    Returns:
-        Dictionary containing availability information
-    """
-    return check_storage_availability(size, location)
-
-
-# Function tool for booking reservations
-def book_reservation_tool(
-    customer_name: str, size: str, location: str, start_date: str, duration_months: int
-):
-    """Create a new storage reservation for a customer.
-
-    Args:
-        customer_name: Name of the customer
-        size: Storage unit size
-        location: Preferred location
-        start_date: When the rental starts (YYYY-MM-DD format)
-        duration_months: How many months to book
-
-    Returns:
-        Dictionary containing reservation details
-    """
-    return book_storage_reservation(
-        customer_name, size, location, start_date, duration_months
-    )
-
-
-# Function tool for user identity validation
-def validate_identity_tool(address: str):
-    """Verify user identity using address information.
-
-    Args:
-        address: User's address or city (e.g., "NW Calgary")
-
-    Returns:
-        Dictionary containing validation results
-    """
-    result = validate_user_identity(address=address)
-    return result
+from adk_events import EventDispatcher, EventRecorder
+from adk_sessions import APP_NAME, SessionManager, SqliteSessionService
+from admission import load_priority_keys
+from rate_limit import ConnectRateLimiter, is_rate_limited, parse_limits
+from metrics import serve_metrics
+from structured_logging import level_route, log_event
+from tracing import INPUT_TRANSCRIPTION, MODEL_AUDIO, SpanExporter
 
 
 class ADKWebSocketServer(BaseWebSocketServer):
     """WebSocket server implementation using Google ADK."""
 
-    def __init__(self, host="0.0.0.0", port=8765):
+    def __init__(self, host="0.0.0.0", port=8765, session_service=None):
         super().__init__(host, port)
 
         # Initialize ADK components
@@ -105,37 +52,52 @@ class ADKWebSocketServer(BaseWebSocketServer):
             name="customer_service_agent",
             model=MODEL,
             instruction=SYSTEM_INSTRUCTION,
-            tools=[
-                order_status_tool,
-                storage_availability_tool,
-                book_reservation_tool,
-                validate_identity_tool,
-            ],
+            # Validating wrappers generated from the shared tool registry
+            tools=TOOLS.adk_tools(),
+        )
+
+        # Conversations live in ADK sessions named by the client's reconnect
+        # token; one runner serves every connection
+        self.session_service = session_service or InMemorySessionService()
+        self.sessions = SessionManager(self.session_service)
+        self.runner = Runner(
+            app_name=APP_NAME,
+            agent=self.agent,
+            session_service=self.session_service,
         )
+        self.SESSION_IDLE_TTL = 600  # Seconds a disconnected session is kept
 
-        # Create session service
-        self.session_service = InMemorySessionService()
+        # Meters upstream connects made by the runner
+        self.connect_limiter = ConnectRateLimiter()
+
+        # Optional recording of the live event stream, for adk_events.py bench
+        self.event_recorder = None
 
     async def process_audio(self, websocket, client_id):
         # Store reference to client
         self.active_clients[client_id] = websocket
 
-        # Create session for this client
-        session = self.session_service.create_session(
-            app_name="audio_assistant",
-            user_id=f"user_{client_id}",
-            session_id=f"session_{client_id}",
-        )
-
-        # Create runner
-        runner = Runner(
-            app_name="audio_assistant",
-            agent=self.agent,
-            session_service=self.session_service,
-        )
+        # Attach the conversation for this client's token, resuming it if
+        # the client reconnected in time
+        token = self.client_tokens[client_id]
+        session = await self.sessions.open(token)
+        try:
+            await self.run_session(websocket, client_id, session)
+        finally:
+            # A session ended for inactivity should not be resumed
+            await self.sessions.release(
+                token,
+                self.SESSION_IDLE_TTL,
+                discard=self.end_reasons.get(client_id) == "inactivity",
+            )
+
+    async def run_session(self, websocket, client_id, session):
+        """Stream one connection through the shared runner"""
+        tracer = self.tracers[client_id]
 
         # Create live request queue
         live_request_queue = LiveRequestQueue()
+        self.upstream_sessions[client_id] = live_request_queue
 
         # Create run config with audio settings
         run_config = RunConfig(
@@ -160,35 +122,53 @@ class ADKWebSocketServer(BaseWebSocketServer):
         )
 
         # Queue for audio data from the client
-        audio_queue = asyncio.Queue()
+        audio_queue = self.create_audio_queue(client_id, websocket)
+        # Prioritized queue for messages to the client
+        outbound = self.create_outbound(client_id, websocket)
+        self.start_inactivity_timer(client_id)
 
         async with asyncio.TaskGroup() as tg:
             # Task to process incoming WebSocket messages
             async def handle_websocket_messages():
                 async for message in websocket:
                     try:
-                        data = json.loads(message)
+                        data = self.decode_message(client_id, message)
                         if data.get("type") == "audio":
-                            # Decode base64 audio data
-                            audio_bytes = base64.b64decode(data.get("data", ""))
-                            # Put audio in queue for processing
-                            await audio_queue.put(audio_bytes)
+                            # VAD drops long silence before it goes upstream
+                            audio_bytes = self.gate_audio(client_id, data["data"])
+                            if audio_bytes:
+                                await audio_queue.put(audio_bytes)
                         elif data.get("type") == "end":
                             # Client is done sending audio for this turn
+                            tracer.speech()
                             logger.info("Received end signal from client")
                         elif data.get("type") == "text":
                             # Handle text messages (not implemented in this simple version)
-                            logger.info(f"Received text: {data.get('data')}")
+                            self.update_activity(client_id, from_client=True)
+                            log_event(
+                                logger,
+                                logging.INFO,
+                                client_id,
+                                "activity",
+                                "💬 Received text: %s",
+                                data.get("data"),
+                            )
                     except json.JSONDecodeError:
                         logger.error("Invalid JSON message received")
                     except Exception as e:
-                        logger.error(f"Error processing message: {e}")
+                        log_event(
+                            logger,
+                            logging.ERROR,
+                            client_id,
+                            "message_error",
+                            "Error processing message: %s",
+                            e,
+                        )
+                self.set_end_reason(client_id, "client_closed")
 
             # Task to process and send audio to Gemini
             async def process_and_send_audio():
-                while True:
-                    data = await audio_queue.get()
-
+                async def send(data):
                     # Send the audio data to Gemini through ADK's LiveRequestQueue
                     live_request_queue.send_realtime(
                         types.Blob(
@@ -197,116 +177,186 @@ class ADKWebSocketServer(BaseWebSocketServer):
                         )
                     )
 
-                    audio_queue.task_done()
+                await self.forward_audio(client_id, audio_queue, send)
 
             # Task to receive and process responses
             async def receive_and_process_responses():
-                # Track user and model outputs between turn completion events
-                input_texts = []
-                output_texts = []
-
-                # Flag to track if we've seen an interruption in the current turn
-                interrupted = False
-
-                # Process responses from the agent
-                async for event in runner.run_live(
-                    session=session,
-                    live_request_queue=live_request_queue,
-                    run_config=run_config,
-                ):
-
-                    # Check for turn completion or interruption using string matching
-                    # This is a fallback approach until a proper API exists
-                    event_str = str(event)
-                    # print()
-
-                    # Handle audio content
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            # Process audio content
-                            if hasattr(part, "inline_data") and part.inline_data:
-                                b64_audio = base64.b64encode(
-                                    part.inline_data.data
-                                ).decode("utf-8")
-                                await websocket.send(
-                                    json.dumps({"type": "audio", "data": b64_audio})
-                                )
-
-                            # Process text content
-                            if hasattr(part, "text") and part.text:
-                                # Check if this is user or model text based on content role
-                                if (
-                                    hasattr(event.content, "role")
-                                    and event.content.role == "user"
-                                ):
-                                    # User text shouldn't be sent to the client
-                                    input_texts.append(part.text)
-                                else:
-                                    # From the logs, we can see the duplicated text issue happens because
-                                    # we get streaming chunks with "partial=True" followed by a final consolidated
-                                    # response with "partial=None" containing the complete text
-
-                                    # Check in the event string for the partial flag
-                                    # Only process messages with "partial=True"
-                                    if "partial=True" in event_str:
-                                        await websocket.send(
-                                            json.dumps(
-                                                {"type": "text", "data": part.text}
-                                            )
-                                        )
-                                        output_texts.append(part.text)
-                                    # Skip messages with "partial=None" to avoid duplication
-
-                    # Check for interruption
-                    if event.interrupted and not interrupted:
-                        logger.info("🤐 INTERRUPTION DETECTED")
-                        await websocket.send(
-                            json.dumps(
-                                {
-                                    "type": "interrupted",
-                                    "data": "Response interrupted by user input",
-                                }
-                            )
+                async def on_audio(data):
+                    upstream_audio_bytes_in.inc(len(data))
+                    tracer.mark(MODEL_AUDIO)
+                    await self.send_audio(client_id, websocket, data)
+
+                async def on_text(text):
+                    await self.send_message(
+                        client_id,
+                        websocket,
+                        json.dumps({"type": "text", "data": text}),
+                    )
+
+                async def on_input_text(text):
+                    # User text isn't sent to the client
+                    tracer.mark(INPUT_TRANSCRIPTION)
+
+                async def on_tool_call(function_call):
+                    tracer.tool_started(function_call.id, function_call.name)
+
+                async def on_tool_response(function_response):
+                    tracer.tool_finished(function_response.id)
+
+                async def on_interrupted():
+                    logger.info("🤐 INTERRUPTION DETECTED")
+                    interruptions.inc()
+                    tracer.end_turn("interrupted")
+                    await self.end_audio_turn(client_id, websocket, interrupted=True)
+                    await self.send_message(
+                        client_id,
+                        websocket,
+                        json.dumps(
+                            {
+                                "type": "interrupted",
+                                "data": "Response interrupted by user input",
+                            }
+                        ),
+                        control=True,
+                    )
+
+                async def on_turn_complete(interrupted, input_text, output_text):
+                    # Only send turn_complete if there was no interruption
+                    if not interrupted:
+                        logger.info("✅ Gemini done talking")
+                        await self.end_audio_turn(client_id, websocket)
+                        await self.send_message(
+                            client_id,
+                            websocket,
+                            json.dumps({"type": "turn_complete"}),
+                        )
+                    tracer.end_turn("turn_complete")
+                    if input_text:
+                        logger.info(
+                            "Input transcription: %s",
+                            input_text,
+                            extra={"client_id": client_id},
+                        )
+                    if output_text:
+                        logger.info(
+                            "Output transcription: %s",
+                            output_text,
+                            extra={"client_id": client_id},
                         )
-                        interrupted = True
-
-                    # Check for turn completion
-                    if event.turn_complete:
-                        # Only send turn_complete if there was no interruption
-                        if not interrupted:
-                            logger.info("✅ Gemini done talking")
-                            await websocket.send(json.dumps({"type": "turn_complete"}))
-
-                        # Log collected transcriptions for debugging
-                        if input_texts:
-                            # Get unique texts to prevent duplication
-                            unique_texts = list(dict.fromkeys(input_texts))
-                            logger.info(
-                                f"Input transcription: {' '.join(unique_texts)}"
-                            )
 
-                        if output_texts:
-                            # Get unique texts to prevent duplication
-                            unique_texts = list(dict.fromkeys(output_texts))
-                            logger.info(
-                                f"Output transcription: {' '.join(unique_texts)}"
-                            )
+                # Classifies each event from its fields and streams text
+                # as it arrives
+                dispatcher = EventDispatcher(
+                    on_audio=on_audio,
+                    on_text=on_text,
+                    on_input_text=on_input_text,
+                    on_tool_call=on_tool_call,
+                    on_tool_response=on_tool_response,
+                    on_interrupted=on_interrupted,
+                    on_turn_complete=on_turn_complete,
+                )
 
-                        # Reset for next turn
-                        input_texts = []
-                        output_texts = []
-                        interrupted = False
+                # Process responses from the agent. The runner opens the
+                # upstream connection itself, so the connect rate limit is
+                # applied here, and a rate limited connect is retried only
+                # if it failed before any event arrived.
+                bucket = self.connect_limiter.bucket(MODEL, LOCATION)
+                attempt = 0
+                while True:
+                    await self.connect_limiter.acquire(bucket)
+                    started = False
+                    try:
+                        async for event in self.runner.run_live(
+                            user_id=session.user_id,
+                            session_id=session.id,
+                            live_request_queue=live_request_queue,
+                            run_config=run_config,
+                        ):
+                            started = True
+                            # Any agent output keeps the session active
+                            self.update_activity(client_id)
+                            upstream_messages_in.inc()
+                            if self.event_recorder is not None:
+                                self.event_recorder.record(event)
+                            await dispatcher.dispatch(event)
+                        break
+                    except Exception as e:
+                        if started or not is_rate_limited(e):
+                            raise
+                        await self.connect_limiter.backoff(bucket, attempt, e)
+                        attempt += 1
 
             # Start all tasks
-            tg.create_task(handle_websocket_messages())
-            tg.create_task(process_and_send_audio())
-            tg.create_task(receive_and_process_responses())
+            tasks = [
+                tg.create_task(handle_websocket_messages()),
+                tg.create_task(process_and_send_audio()),
+                tg.create_task(receive_and_process_responses()),
+                tg.create_task(outbound.run()),
+            ]
+            # End the whole session when the client leaves, a task
+            # fails, or the inactivity timer disconnects the client
+            tg.create_task(self.supervise_session(client_id, tasks))
+
+        await self.close_outbound(client_id)
+        live_request_queue.close()
+
+    async def can_resume(self, token):
+        """Whether a reconnect token names a detached ADK session"""
+        return await self.sessions.can_resume(token)
+
+    async def prompt_model(self, client_id, text):
+        """Send a text prompt through the client's LiveRequestQueue"""
+        live_request_queue = self.upstream_sessions.get(client_id)
+        if live_request_queue is not None:
+            live_request_queue.send_content(
+                types.Content(role="user", parts=[types.Part(text=text)])
+            )
 
 
 async def main():
     """Main function to start the server"""
-    server = ADKWebSocketServer()
-    await server.start()
+    metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+    if metrics_port:
+        serve_metrics(
+            "0.0.0.0",
+            metrics_port,
+            routes={"/loglevel": level_route},
+            remote_admin=bool(os.environ.get("REMOTE_ADMIN")),
+        )
+    session_service = None
+    if os.environ.get("SESSION_DB"):
+        session_service = SqliteSessionService(
+            os.environ["SESSION_DB"],
+            retention=float(os.environ.get("SESSION_RETENTION", "86400")),
+        )
+    server = ADKWebSocketServer(session_service=session_service)
+    if os.environ.get("SESSION_IDLE_TTL"):
+        server.SESSION_IDLE_TTL = float(os.environ["SESSION_IDLE_TTL"])
+    server.admission.max_sessions = int(os.environ.get("MAX_SESSIONS", "0"))
+    server.admission.max_queue = int(os.environ.get("ADMISSION_QUEUE", "100"))
+    server.admission.max_wait = float(os.environ.get("ADMISSION_MAX_WAIT", "60"))
+    server.connect_limiter = ConnectRateLimiter(
+        float(os.environ.get("CONNECT_RATE", "0")),
+        float(os.environ.get("CONNECT_BURST", "10")),
+        limits=parse_limits(os.environ.get("CONNECT_LIMITS", "")),
+        max_retries=int(os.environ.get("CONNECT_RETRIES", "3")),
+    )
+    if os.environ.get("PRIORITY_KEYS_FILE"):
+        server.PRIORITY_KEYS = load_priority_keys(os.environ["PRIORITY_KEYS_FILE"])
+    if os.environ.get("TRACE_EXPORT"):
+        server.span_exporter = SpanExporter(os.environ["TRACE_EXPORT"])
+    if os.environ.get("RECORD_EVENTS"):
+        server.event_recorder = EventRecorder(os.environ["RECORD_EVENTS"])
+    try:
+        await server.start()
+    finally:
+        if server.span_exporter is not None:
+            server.span_exporter.close()
+        if server.event_recorder is not None:
+            server.event_recorder.close()
+        await server.sessions.close()
+        if session_service is not None:
+            await session_service.close()
 
 
 if __name__ == "__main__":
@@ -315,7 +365,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Exiting application via KeyboardInterrupt...")
     except Exception as e:
-        logger.error(f"Unhandled exception in main: {e}")
+        logger.error("Unhandled exception in main: %s", e)
         import traceback
 
         traceback.print_exc()
@@ -0,0 +1,372 @@
+"""
+Non-blocking structured logging.
+
+``setup_logging`` replaces the synchronous ``basicConfig`` stream handler
+with a ``QueueHandler`` on the root logger: callers on the event loop only
+append the unformatted record to a bounded queue, and a listener thread
+does the message formatting, JSON encoding and I/O. When the queue is full
+records are dropped and counted rather than blocking the loop.
+
+High-frequency per-session events go through ``log_event``, which tags
+the record with ``client_id`` and ``event``. ``SessionRateLimiter`` keeps a
+token bucket per (client, event) and can also sample 1-in-N; it runs before
+a record is even created, and the next record that gets through carries
+the number suppressed since. Messages use ``%``-style arguments, so
+suppressed and disabled records are never formatted.
+
+Levels can be changed at runtime per logger with ``set_levels`` (also
+served as ``/loglevel`` next to the metrics endpoint, to local clients
+only by default). Run this module with
+``bench`` to measure loop time spent on logging with and without it.
+"""
+
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs
+
+from metrics import counter
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Per-session events that fire often enough to need limits:
+# event -> (records per second, burst)
+DEFAULT_LIMITS = {
+    "speech_detected": (2.0, 5),
+    "activity": (0.5, 3),
+    "message_error": (1.0, 5),
+}
+# event -> keep 1 record in N (the full transcription is logged per turn)
+DEFAULT_SAMPLING = {"speech_detected": 4}
+
+# Fields copied from ``extra`` into the JSON output when present
+_EXTRA_FIELDS = ("client_id", "event", "suppressed")
+
+records_dropped = counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full"
+)
+records_suppressed = counter(
+    "log_records_suppressed_total",
+    "Per-session log records suppressed by rate limiting or sampling",
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus session extras."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in _EXTRA_FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as-is; the listener thread formats them."""
+
+    def prepare(self, record):
+        # The stock handler formats here, on the caller's thread. Arguments
+        # are formatted later instead, so they must not be mutated after
+        # the call (the codebase only logs immutable values).
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            records_dropped.inc()
+
+
+class SessionRateLimiter:
+    """Token-bucket rate limiting and 1-in-N sampling per (client, event)."""
+
+    def __init__(self, limits=None, sampling=None):
+        """
+        Args:
+            limits: ``{event: (records per second, burst)}``
+            sampling: ``{event: n}`` to keep one record in ``n``
+        """
+        self.limits = dict(limits or {})
+        self.sampling = dict(sampling or {})
+        self.state = {}  # (client_id, event) -> [tokens, last, seen, suppressed]
+
+    def check(self, client_id, event, now=None):
+        """
+        Decide whether a record for (client, event) may be logged.
+
+        Returns None to suppress it, otherwise the number of records
+        suppressed since the last one that got through.
+        """
+        sampling = self.sampling.get(event)
+        limit = self.limits.get(event)
+        if sampling is None and limit is None:
+            return 0
+        key = (client_id, event)
+        state = self.state.get(key)
+        if now is None:
+            now = time.monotonic()
+        if state is None:
+            state = self.state[key] = [limit[1] if limit else 1, now, 0, 0]
+        state[2] += 1
+        allowed = sampling is None or (state[2] - 1) % sampling == 0
+        if allowed and limit is not None:
+            rate, burst = limit
+            state[0] = min(burst, state[0] + (now - state[1]) * rate)
+            state[1] = now
+            if state[0] >= 1.0:
+                state[0] -= 1.0
+            else:
+                allowed = False
+        if not allowed:
+            state[3] += 1
+            records_suppressed.inc()
+            return None
+        suppressed, state[3] = state[3], 0
+        return suppressed
+
+    def forget(self, client_id):
+        """Drop the state of a finished session."""
+        for key in [key for key in self.state if key[0] == client_id]:
+            del self.state[key]
+
+
+RATE_LIMITER = SessionRateLimiter(DEFAULT_LIMITS, DEFAULT_SAMPLING)
+_listener = None
+
+
+def log_event(logger, level, client_id, event, msg, *args):
+    """
+    Log a per-session event through the rate limiter.
+
+    Suppressed and disabled events return before a record is created, which
+    is most of the cost of a logging call.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = RATE_LIMITER.check(client_id, event)
+    if suppressed is None:
+        return
+    extra = {"client_id": client_id, "event": event}
+    if suppressed:
+        extra["suppressed"] = suppressed
+    logger.log(level, msg, *args, extra=extra)
+
+
+def _skip_unused_record_fields():
+    # Neither formatter uses these, and collecting them is a large part of
+    # the cost of creating a record (see "Optimization" in the logging docs)
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+    logging._srcfile = None
+
+
+def setup_logging(level=logging.INFO, json_output=True, levels=None, max_queue=10000):
+    """
+    Route all logging through a bounded queue and a writer thread.
+
+    Args:
+        level: root logger level
+        json_output: JSON lines if true, else the classic text format
+        levels: per-logger overrides, as accepted by ``set_levels``
+        max_queue: records buffered before new ones are dropped
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(
+        JsonFormatter() if json_output else logging.Formatter(TEXT_FORMAT)
+    )
+    records = queue.Queue(maxsize=max_queue)
+    handler = LazyQueueHandler(records)
+    _skip_unused_record_fields()
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    if levels:
+        set_levels(levels)
+
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def flush_logging():
+    """Write out queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_levels(spec):
+    """
+    Set logger levels from ``{name: level}`` or ``"name=LEVEL,..."``.
+
+    The root logger is ``root`` (or an empty name). Returns the levels set.
+    """
+    if isinstance(spec, str):
+        spec = dict(
+            item.split("=", 1) for item in spec.split(",") if "=" in item.strip()
+        )
+    applied = {}
+    for name, level in spec.items():
+        name = name.strip()
+        level = str(level).strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level: {level}")
+        logging.getLogger(None if name in ("", "root") else name).setLevel(level)
+        applied[name or "root"] = level
+    return applied
+
+
+def levels():
+    """Return the explicitly set level of the root and every named logger."""
+    current = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            current[name] = logging.getLevelName(logger.level)
+    return current
+
+
+def level_route(method, query):
+    """
+    ``/loglevel`` handler for ``serve_metrics``.
+
+    GET lists levels; POST with ``common=DEBUG&root=WARNING`` sets them.
+    Returns (HTTP status, JSON body).
+    """
+    if method == "POST":
+        try:
+            set_levels({name: values[-1] for name, values in parse_qs(query).items()})
+        except ValueError as e:
+            return 400, json.dumps({"error": str(e)})
+    elif query:
+        return 405, json.dumps({"error": "Levels can only be changed with POST"})
+    return 200, json.dumps(levels())
+
+
+def benchmark(sessions=300, seconds=3.0, interval=0.02):
+    """
+    Measure event-loop time spent in logging calls.
+
+    Each simulated session runs the server's per-response logging pattern
+    every ``interval``: a speech-detected INFO line, an activity INFO line
+    and a DEBUG line that is disabled. The baseline is the previous setup
+    (synchronous stream handler, eager f-strings); the other run uses the
+    queue handler, session rate limiting and lazy arguments. Both write to
+    a temporary file. Returns {setup: (records, seconds in logging calls,
+    share of loop time)}.
+    """
+    log = logging.getLogger("logbench")
+    results = {}
+    for mode in ("baseline", "structured"):
+        with tempfile.NamedTemporaryFile("w", suffix=".log") as out:
+            root = logging.getLogger()
+            saved = root.handlers[:], root.level
+            for old in root.handlers[:]:
+                root.removeHandler(old)
+            root.setLevel(logging.INFO)
+            listener = None
+            if mode == "baseline":
+                handler = logging.StreamHandler(out)
+                handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            else:
+                stream = logging.StreamHandler(out)
+                stream.setFormatter(JsonFormatter())
+                records = queue.Queue(maxsize=100000)
+                handler = LazyQueueHandler(records)
+                RATE_LIMITER.state.clear()
+                listener = logging.handlers.QueueListener(records, stream)
+                listener.start()
+                _skip_unused_record_fields()
+            root.addHandler(handler)
+            spent = [0.0, 0]
+
+            async def session(client_id):
+                text = f"transcribed words for session {client_id}"
+                deadline = time.monotonic() + seconds
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    if mode == "baseline":
+                        log.info(f"Speech detected: {text}")
+                        log.info("🗣️ Activity updated - speech detected")
+                        log.debug(f"Frame for {client_id}: {text!r}")
+                    else:
+                        log_event(
+                            log,
+                            logging.INFO,
+                            client_id,
+                            "speech_detected",
+                            "Speech detected: %s",
+                            text,
+                        )
+                        log_event(
+                            log,
+                            logging.INFO,
+                            client_id,
+                            "activity",
+                            "🗣️ Activity updated - speech detected",
+                        )
+                        log.debug("Frame for %s: %r", client_id, text)
+                    spent[0] += time.perf_counter() - start
+                    spent[1] += 3
+                    await asyncio.sleep(interval)
+
+            async def run():
+                await asyncio.gather(*(session(i) for i in range(sessions)))
+
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            if listener is not None:
+                listener.stop()
+            root.removeHandler(handler)
+            for old in saved[0]:
+                root.addHandler(old)
+            root.setLevel(saved[1])
+            results[mode] = (spent[1], spent[0], spent[0] / elapsed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Compare loop time spent on logging")
+    bench.add_argument("--sessions", type=int, default=300)
+    bench.add_argument("--seconds", type=float, default=3.0)
+    bench.add_argument("--interval", type=float, default=0.02)
+    args = parser.parse_args()
+
+    results = benchmark(args.sessions, args.seconds, args.interval)
+    for mode, (calls, spent, share) in results.items():
+        print(
+            f"{mode:>10}: {calls} log calls, {spent:.3f}s in logging "
+            f"({1e6 * spent / calls:.1f} µs/call), {100 * share:.1f}% of loop time"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Result cache for read-only tool calls.
+
+Results are keyed by tool name and canonical JSON of the arguments, expire
+after a per-tool TTL and are evicted least-recently-used once the cache
+exceeds its entry or byte budget. Concurrent identical calls are
+single-flighted: the first caller runs the tool and later ones await the same
+result instead of hitting the backend again. Only tools with a TTL are
+cached; errors and ``{"error": ...}`` results never are. ``invalidate``
+drops a tool's results when a write makes them stale, including those of
+calls still in flight.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from metrics import counter
+
+
+class ToolResultCache:
+    """Per-tool TTL cache with LRU eviction and single-flight calls."""
+
+    def __init__(self, ttls, max_entries=1024, max_bytes=4 * 1024 * 1024):
+        """
+        Args:
+            ttls: ``{tool name: seconds}`` for cacheable tools; others bypass
+            max_entries: maximum number of cached results
+            max_bytes: approximate memory budget (JSON size of keys and results)
+        """
+        self.ttls = dict(ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, size, result)
+        self.bytes = 0
+        self.in_flight = {}  # key -> task running the tool
+        self.generations = {}  # Tool name -> invalidation count
+        self._tool_metrics = {}
+        self.evictions = counter(
+            "tool_cache_evictions_total", "Tool results evicted by the LRU bounds"
+        )
+        self.invalidations = counter(
+            "tool_cache_invalidations_total",
+            "Cached tool results dropped because a write made them stale",
+        )
+
+    def is_cacheable(self, name):
+        return name in self.ttls
+
+    def _metrics(self, name):
+        metrics = self._tool_metrics.get(name)
+        if metrics is None:
+            labels = {"tool": name}
+            metrics = self._tool_metrics[name] = (
+                counter(
+                    "tool_cache_hits_total", "Tool results served from cache", labels
+                ),
+                counter(
+                    "tool_cache_misses_total", "Tool calls that ran the tool", labels
+                ),
+                counter(
+                    "tool_cache_coalesced_total",
+                    "Tool calls that joined an identical in-flight call",
+                    labels,
+                ),
+            )
+        return metrics
+
+    @staticmethod
+    def make_key(name, args):
+        return name + ":" + json.dumps(args or {}, sort_keys=True, default=str)
+
+    def get(self, key):
+        """Return the cached result for ``key``, or None if absent/expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, result = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.bytes -= size
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, name, result):
+        size = len(key) + len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (time.monotonic() + self.ttls[name], size, result)
+        self.bytes += size
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.bytes > self.max_bytes
+        ):
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions.inc()
+
+    async def get_or_call(self, name, args, call):
+        """
+        Return the cached result of ``name(args)`` or compute it with ``call()``.
+
+        ``call`` is a zero-argument coroutine function. Waiters are shielded
+        from each other: one caller being cancelled does not cancel the shared
+        call for the rest.
+        """
+        hits, misses, coalesced = self._metrics(name)
+        key = self.make_key(name, args)
+        result = self.get(key)
+        if result is not None:
+            hits.inc()
+            return result
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            coalesced.inc()
+        else:
+            misses.inc()
+            task = self.in_flight[key] = asyncio.ensure_future(call())
+            generation = self.generations.get(name, 0)
+            task.add_done_callback(lambda t: self._call_done(key, name, t, generation))
+        return await asyncio.shield(task)
+
+    def _call_done(self, key, name, task, generation):
+        if self.in_flight.get(key) is task:
+            self.in_flight.pop(key)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.generations.get(name, 0) != generation:
+            return  # Invalidated while running; the result may be stale
+        result = task.result()
+        if isinstance(result, dict) and "error" in result:
+            return
+        self.put(key, name, result)
+
+    def invalidate(self, name):
+        """Drop every cached and in-flight result of tool ``name``."""
+        self.generations[name] = self.generations.get(name, 0) + 1
+        prefix = name + ":"
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            self.bytes -= self.entries.pop(key)[1]
+            self.invalidations.inc()
+        # Later callers start a fresh call instead of joining a stale one
+        for key in [key for key in self.in_flight if key.startswith(prefix)]:
+            del self.in_flight[key]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Return current size and per-tool (hits, misses, coalesced) counts."""
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "tools": {
+                name: tuple(metric.value for metric in metrics)
+                for name, metrics in self._tool_metrics.items()
+            },
+        }
@@ -0,0 +1,143 @@
+"""
+Asynchronous tool execution for model function calls.
+
+Tool calls used to run inline in the upstream receive loop, blocking that
+session (and, for blocking backend calls, the whole event loop) until they
+returned. ``ToolExecutor`` runs synchronous tools in a bounded thread pool
+and coroutine tools natively, applies per-tool timeouts, and runs every
+function call of a model turn concurrently so each response can be sent as
+soon as it is ready.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY, counter, histogram
+
+logger = logging.getLogger(__name__)
+
+
+class ToolExecutor:
+    """Run tool calls off the event loop with timeouts and latency metrics."""
+
+    def __init__(
+        self,
+        dispatch,
+        max_workers=8,
+        default_timeout=10.0,
+        timeouts=None,
+        async_tools=(),
+        cache=None,
+        invalidations=None,
+    ):
+        """
+        Args:
+            dispatch: callable ``(name, args) -> result``, sync or async
+            max_workers: size of the thread pool for synchronous tools
+            default_timeout: seconds before a tool call is abandoned
+            timeouts: optional per-tool overrides, ``{name: seconds}``
+            async_tools: names for which a sync ``dispatch`` returns an
+                awaitable; those run on the event loop instead of the pool
+            cache: optional ToolResultCache for read-only tools
+            invalidations: ``{name: (cached tool names...)}`` whose cached
+                results are dropped after a successful call of ``name``
+        """
+        self.dispatch = dispatch
+        self.is_async = inspect.iscoroutinefunction(dispatch)
+        self.async_tools = frozenset(async_tools)
+        self.cache = cache
+        self.invalidations = invalidations or {}
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="tool")
+        self.default_timeout = default_timeout
+        self.timeouts = timeouts or {}
+        self._tool_metrics = {}
+
+    def _metrics(self, name):
+        metrics = self._tool_metrics.get(name)
+        if metrics is None:
+            labels = {"tool": name}
+            metrics = self._tool_metrics[name] = (
+                histogram("tool_call_seconds", "Tool call latency", labels),
+                counter(
+                    "tool_call_errors_total", "Failed or timed out tool calls", labels
+                ),
+                counter("tool_call_timeouts_total", "Timed out tool calls", labels),
+            )
+        return metrics
+
+    async def _execute(self, name, args, timeout):
+        if self.is_async or name in self.async_tools:
+            pending = self.dispatch(name, args)
+        else:
+            pending = asyncio.get_running_loop().run_in_executor(
+                self.pool, functools.partial(self.dispatch, name, args)
+            )
+        return await asyncio.wait_for(pending, timeout=timeout)
+
+    async def call(self, name, args):
+        """Execute one tool call; errors come back as {"error": ...} results."""
+        latency, errors, timeouts = self._metrics(name)
+        timeout = self.timeouts.get(name, self.default_timeout)
+        start = time.perf_counter()
+        try:
+            if self.cache is not None and self.cache.is_cacheable(name):
+                result = await self.cache.get_or_call(
+                    name, args, functools.partial(self._execute, name, args, timeout)
+                )
+            else:
+                result = await self._execute(name, args, timeout)
+        except asyncio.TimeoutError:
+            errors.inc()
+            timeouts.inc()
+            result = {"error": f"Tool {name} timed out after {timeout}s"}
+        except Exception as e:
+            errors.inc()
+            result = {"error": str(e)}
+        else:
+            stale = self.invalidations.get(name, ())
+            if stale and self.cache is not None:
+                if not (isinstance(result, dict) and "error" in result):
+                    for tool in stale:
+                        self.cache.invalidate(tool)
+        latency.observe(time.perf_counter() - start)
+        return result
+
+    def run_calls(self, function_calls, respond):
+        """
+        Start all ``function_calls`` concurrently.
+
+        ``respond(function_call, result)`` is awaited as each call finishes;
+        errors it raises are logged, since nothing awaits the tasks.
+        Returns the tasks so the caller can cancel them with its session.
+        """
+
+        async def run(function_call):
+            result = await self.call(function_call.name, function_call.args or {})
+            try:
+                await respond(function_call, result)
+            except Exception as e:
+                logger.warning(
+                    "Could not send the %s tool response: %r", function_call.name, e
+                )
+
+        return [asyncio.ensure_future(run(fc)) for fc in function_calls]
+
+    def latency_summary(self):
+        """Return {tool: (count, p50, p95, p99)} from the latency histograms."""
+        summary = {}
+        for (name, labels), metric in REGISTRY.metrics.items():
+            if name == "tool_call_seconds" and metric.count:
+                summary[dict(labels)["tool"]] = (
+                    metric.count,
+                    metric.quantile(0.5),
+                    metric.quantile(0.95),
+                    metric.quantile(0.99),
+                )
+        return summary
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,375 @@
+"""
+Declarative tool registry.
+
+Tools are plain functions registered once with a decorator. Their
+type-annotated signatures and Google-style docstrings are the single source
+of truth: the registry derives the Live API ``FunctionDeclaration`` schemas
+from them (built once and cached), validates and coerces model-supplied
+arguments against precompiled per-parameter checks, and dispatches by name
+through a dict lookup. The ADK server gets validating wrappers that keep the
+original signature, so ADK builds the same declarations from them.
+"""
+
+import functools
+import inspect
+import re
+import time
+import types as pytypes
+import typing
+
+from metrics import counter, histogram
+
+_ARGS_SECTION = re.compile(r"^\s*Args:\s*$")
+_ARG_LINE = re.compile(r"^\s+(\w+)(?:\s*\([^)]*\))?:\s*(.*)$")
+
+
+class ToolError(ValueError):
+    """Raised for unknown tools and invalid tool arguments."""
+
+
+def _parse_docstring(doc):
+    """Split a Google-style docstring into (summary, {arg: description})."""
+    doc = inspect.cleandoc(doc or "")
+    summary = doc.split("\n\n", 1)[0].replace("\n", " ").strip()
+    descriptions = {}
+    in_args = False
+    current = None
+    for line in doc.splitlines():
+        if _ARGS_SECTION.match(line):
+            in_args = True
+            continue
+        if not in_args:
+            continue
+        if line and not line[0].isspace():
+            break  # Next section (Returns:, Raises:, ...)
+        match = _ARG_LINE.match(line)
+        if match and (current is None or len(line) - len(line.lstrip()) <= 4):
+            current = match.group(1)
+            descriptions[current] = match.group(2).strip()
+        elif current and line.strip():
+            descriptions[current] += " " + line.strip()
+    return summary, descriptions
+
+
+def _unwrap_optional(annotation):
+    """Return (inner annotation, nullable) for ``X | None`` / Optional[X]."""
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, pytypes.UnionType):
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            return args[0], len(args) != len(typing.get_args(annotation))
+    return annotation, False
+
+
+def _coerce_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise TypeError("expected a string")
+
+
+def _coerce_int(value):
+    if isinstance(value, bool):
+        raise TypeError("expected an integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)  # JSON numbers often arrive as floats
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    raise TypeError("expected an integer")
+
+
+def _coerce_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            pass
+    raise TypeError("expected a number")
+
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise TypeError("expected a boolean")
+
+
+def _coerce_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    raise TypeError("expected an array")
+
+
+def _coerce_dict(value):
+    if isinstance(value, dict):
+        return value
+    raise TypeError("expected an object")
+
+
+# Python annotation -> (schema type name, coercion)
+_TYPES = {
+    str: ("STRING", _coerce_str),
+    int: ("INTEGER", _coerce_int),
+    float: ("NUMBER", _coerce_float),
+    bool: ("BOOLEAN", _coerce_bool),
+    list: ("ARRAY", _coerce_list),
+    dict: ("OBJECT", _coerce_dict),
+}
+
+
+class ToolParameter:
+    """One parameter of a registered tool, with its precompiled check."""
+
+    def __init__(self, name, annotation, default, description):
+        annotation, nullable = _unwrap_optional(annotation)
+        origin = typing.get_origin(annotation) or annotation
+        if origin not in _TYPES:
+            raise TypeError(f"Unsupported tool parameter type for {name}: {annotation}")
+        self.name = name
+        self.schema_type, self.coerce = _TYPES[origin]
+        item_args = typing.get_args(annotation) if origin is list else ()
+        self.item_type = _TYPES[item_args[0]][0] if item_args else None
+        self.required = default is inspect.Parameter.empty
+        self.nullable = nullable or (not self.required and default is None)
+        self.description = description
+
+    def validate(self, value):
+        if value is None:
+            if self.nullable:
+                return None
+            raise ToolError(f"Argument {self.name} must not be null")
+        try:
+            return self.coerce(value)
+        except TypeError as e:
+            raise ToolError(f"Argument {self.name}: {e}, got {value!r}") from None
+
+
+class Tool:
+    """A registered tool: function, parameters and execution settings."""
+
+    def __init__(
+        self,
+        func,
+        name=None,
+        description=None,
+        timeout=None,
+        cache_ttl=None,
+        invalidates=(),
+    ):
+        summary, arg_descriptions = _parse_docstring(func.__doc__)
+        hints = typing.get_type_hints(func)
+        self.func = func
+        self.name = name or func.__name__
+        self.description = description or summary
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.invalidates = tuple(invalidates)
+        self.is_async = inspect.iscoroutinefunction(func)
+        self.parameters = {}
+        for param in inspect.signature(func).parameters.values():
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                raise TypeError(f"Tool {self.name} cannot take *args or **kwargs")
+            if param.name not in hints:
+                raise TypeError(f"Tool {self.name} parameter {param.name} needs a type")
+            self.parameters[param.name] = ToolParameter(
+                param.name,
+                hints[param.name],
+                param.default,
+                arg_descriptions.get(param.name, ""),
+            )
+        self.required = [p.name for p in self.parameters.values() if p.required]
+
+    def bind(self, args):
+        """Validate model-supplied ``args`` and return call kwargs."""
+        args = args or {}
+        unknown = args.keys() - self.parameters.keys()
+        if unknown:
+            raise ToolError(
+                f"Unknown argument(s) for {self.name}: {', '.join(sorted(unknown))}"
+            )
+        missing = [name for name in self.required if name not in args]
+        if missing:
+            raise ToolError(
+                f"Missing required argument(s) for {self.name}: {', '.join(missing)}"
+            )
+        return {
+            name: self.parameters[name].validate(value) for name, value in args.items()
+        }
+
+    def declaration(self):
+        """Build the google-genai FunctionDeclaration for this tool."""
+        from google.genai import types
+
+        properties = {}
+        for param in self.parameters.values():
+            schema = types.Schema(
+                type=getattr(types.Type, param.schema_type),
+                description=param.description or None,
+                nullable=param.nullable or None,
+            )
+            if param.item_type:
+                schema.items = types.Schema(type=getattr(types.Type, param.item_type))
+            properties[param.name] = schema
+        return types.FunctionDeclaration(
+            name=self.name,
+            description=self.description,
+            parameters=types.Schema(
+                type=types.Type.OBJECT,
+                properties=properties,
+                required=self.required or None,
+            ),
+        )
+
+
+class ToolRegistry:
+    """Name -> Tool mapping shared by every server implementation."""
+
+    def __init__(self):
+        self.tools = {}
+        self._declarations = None
+
+    def register(
+        self,
+        func=None,
+        *,
+        name=None,
+        description=None,
+        timeout=None,
+        cache_ttl=None,
+        invalidates=(),
+    ):
+        """
+        Register a tool; usable as ``@registry.register`` or with options.
+
+        Args:
+            func: the tool function; parameters must be type-annotated
+            name: tool name exposed to the model, defaults to the function name
+            description: overrides the docstring summary
+            timeout: per-tool execution timeout in seconds
+            cache_ttl: seconds a result may be reused for identical arguments;
+                only for read-only tools. None (the default) never caches.
+            invalidates: names of cached tools whose results a successful
+                call of this one makes stale
+        """
+
+        def decorator(func):
+            tool = Tool(
+                func,
+                name=name,
+                description=description,
+                timeout=timeout,
+                cache_ttl=cache_ttl,
+                invalidates=invalidates,
+            )
+            if tool.name in self.tools:
+                raise ValueError(f"Tool {tool.name} is already registered")
+            self.tools[tool.name] = tool
+            self._declarations = None
+            return func
+
+        return decorator if func is None else decorator(func)
+
+    def __contains__(self, name):
+        return name in self.tools
+
+    def __len__(self):
+        return len(self.tools)
+
+    def get(self, name):
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ToolError(f"Unknown function: {name}")
+        return tool
+
+    def dispatch(self, name, args):
+        """Validate ``args`` and call tool ``name``; async tools return a coroutine."""
+        tool = self.get(name)
+        return tool.func(**tool.bind(args))
+
+    def function_declarations(self):
+        """FunctionDeclarations for all tools, built once and cached."""
+        if self._declarations is None:
+            self._declarations = [tool.declaration() for tool in self.tools.values()]
+        return self._declarations
+
+    def timeouts(self):
+        """Per-tool timeout overrides, ``{name: seconds}``."""
+        return {
+            name: tool.timeout
+            for name, tool in self.tools.items()
+            if tool.timeout is not None
+        }
+
+    def cache_ttls(self):
+        """Result TTLs of cacheable tools, ``{name: seconds}``."""
+        return {
+            name: tool.cache_ttl
+            for name, tool in self.tools.items()
+            if tool.cache_ttl is not None
+        }
+
+    def invalidations(self):
+        """Cached tools each writing tool makes stale, ``{name: (names...)}``."""
+        return {
+            name: tool.invalidates
+            for name, tool in self.tools.items()
+            if tool.invalidates
+        }
+
+    def async_tools(self):
+        """Names of tools implemented as coroutines."""
+        return {name for name, tool in self.tools.items() if tool.is_async}
+
+    def adk_tools(self):
+        """
+        Functions for an ADK ``Agent(tools=...)``.
+
+        Each wrapper validates its arguments through the registry and keeps
+        the tool's signature and docstring, which ADK reads to build its own
+        declarations.
+        """
+        return [_adk_wrapper(tool) for tool in self.tools.values()]
+
+
+def _adk_wrapper(tool):
+    labels = {"tool": tool.name}
+    latency = histogram("tool_call_seconds", "Tool call latency", labels)
+    errors = counter("tool_call_errors_total", "Failed or timed out tool calls", labels)
+
+    if tool.is_async:
+
+        @functools.wraps(tool.func)
+        async def wrapper(**kwargs):
+            start = time.perf_counter()
+            try:
+                return await tool.func(**tool.bind(kwargs))
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+
+    else:
+
+        @functools.wraps(tool.func)
+        def wrapper(**kwargs):
+            start = time.perf_counter()
+            try:
+                return tool.func(**tool.bind(kwargs))
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+
+    wrapper.__name__ = tool.name
+    return wrapper
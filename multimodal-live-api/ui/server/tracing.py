@@ -0,0 +1,326 @@
+"""
+Per-turn latency tracing.
+
+A ``TurnTracer`` per session timestamps the milestones of each
+conversational turn: the first user audio forwarded upstream, the end of
+the user's speech, the first input transcription, every tool call and its
+response, the first model audio chunk, and the turn ending in
+``turn_complete`` or ``interrupted``. Marks are a dict lookup and a clock
+read, so they are cheap enough for per-frame paths; spans are only built
+once per turn.
+
+Finished turns become OpenTelemetry spans (a ``turn`` span with children
+for each measured phase, all in one trace per session) encoded as OTLP/JSON.
+``SpanExporter`` ships them from a background thread, either appended to a
+local file as one ``ExportTraceServiceRequest`` per line or POSTed to an
+OTLP/HTTP collector, so the event loop never waits on I/O. Each session
+also keeps a compact per-turn record for a summary logged on disconnect.
+"""
+
+import json
+import logging
+import queue
+import secrets
+import statistics
+import threading
+import time
+import urllib.request
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+USER_AUDIO = "user_audio"
+END_OF_SPEECH = "end_of_speech"
+INPUT_TRANSCRIPTION = "input_transcription"
+FUNCTION_CALL = "function_call"
+FUNCTION_RESPONSE = "function_response"
+MODEL_AUDIO = "model_audio"
+
+# Child spans of a turn: (name, start mark(s), end mark); the first start
+# mark present is used
+_PHASES = (
+    ("user.speech", (USER_AUDIO,), END_OF_SPEECH),
+    ("model.transcription", (END_OF_SPEECH, USER_AUDIO), INPUT_TRANSCRIPTION),
+    ("model.first_audio", (END_OF_SPEECH, USER_AUDIO), MODEL_AUDIO),
+)
+
+# Milestones that show the model worked on the turn
+_MODEL_MARKS = frozenset((INPUT_TRANSCRIPTION, FUNCTION_CALL, MODEL_AUDIO))
+
+_SPAN_KIND_INTERNAL = 1
+
+turn_first_audio_seconds = histogram(
+    "turn_first_audio_seconds",
+    "From the end of user speech to the first model audio chunk",
+)
+turns_total = counter("turns_total", "Conversational turns traced")
+spans_dropped = counter(
+    "trace_spans_dropped_total", "Turn spans dropped because the export queue was full"
+)
+
+
+def _attributes(values):
+    """Encode a dict as an OTLP attribute list."""
+    encoded = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": value})
+    return encoded
+
+
+class TurnTracer:
+    """Timestamp turn milestones for one session and emit a span tree per turn."""
+
+    def __init__(self, session_id, exporter=None):
+        """
+        Args:
+            session_id: identifies the session in span attributes and logs
+            exporter: optional ``SpanExporter`` that receives finished spans
+        """
+        self.session_id = str(session_id)
+        self.exporter = exporter
+        self.trace_id = secrets.token_hex(16)
+        self.marks = {}  # milestone -> unix ns, for the turn in progress
+        self.next_marks = {}  # User input heard while the model is answering
+        self.tool_calls = {}  # call id -> (tool name, start ns)
+        self.tool_spans = []  # (tool name, call id, start ns, end ns)
+        self.turns = []  # Per-turn summary records
+        self.turn_index = 0
+
+    def _target(self):
+        # Once the model has started answering, new user input opens the
+        # next turn (e.g. the speech that is about to interrupt this one)
+        return self.next_marks if MODEL_AUDIO in self.marks else self.marks
+
+    def user_audio(self):
+        """Client audio was forwarded upstream."""
+        target = self._target()
+        if USER_AUDIO not in target:
+            target[USER_AUDIO] = time.time_ns()
+
+    def speech(self):
+        """The user was speaking; end of speech is the latest call."""
+        target = self._target()
+        now = time.time_ns()
+        target.setdefault(USER_AUDIO, now)
+        target[END_OF_SPEECH] = now
+
+    def mark(self, milestone):
+        """Record the first occurrence of ``milestone`` in this turn."""
+        if milestone not in self.marks:
+            self.marks[milestone] = time.time_ns()
+
+    def tool_started(self, call_id, name):
+        self.mark(FUNCTION_CALL)
+        self.tool_calls[call_id] = (name, time.time_ns())
+
+    def tool_finished(self, call_id):
+        started = self.tool_calls.pop(call_id, None)
+        if started is None:
+            return
+        self.mark(FUNCTION_RESPONSE)
+        self.tool_spans.append((started[0], call_id, started[1], time.time_ns()))
+
+    def end_turn(self, outcome):
+        """Close the turn in progress with ``outcome`` and export its spans."""
+        if not self.tool_spans and _MODEL_MARKS.isdisjoint(self.marks):
+            # Nothing from the model yet, e.g. the turn_complete that follows
+            # an interruption: the user's next turn stays open
+            return
+        self._finish(self.marks, time.time_ns(), outcome)
+        self.marks = self.next_marks
+        self.next_marks = {}
+        self.tool_spans = []
+
+    def _finish(self, marks, end, outcome):
+        starts = [*marks.values(), *(span[2] for span in self.tool_spans)]
+        start = min(starts)
+        self.turn_index += 1
+        turns_total.inc()
+
+        record = {"outcome": outcome, "duration": (end - start) / 1e9}
+        speech_end = marks.get(END_OF_SPEECH, marks.get(USER_AUDIO))
+        if speech_end is not None and MODEL_AUDIO in marks:
+            record["first_audio"] = max(0, marks[MODEL_AUDIO] - speech_end) / 1e9
+            turn_first_audio_seconds.observe(record["first_audio"])
+        if self.tool_spans:
+            record["tools"] = sum(s[3] - s[2] for s in self.tool_spans) / 1e9
+        self.turns.append(record)
+
+        if self.exporter is not None:
+            self.exporter.export(self._spans(marks, start, end, outcome))
+
+    def _span(self, name, start, end, parent=None, attributes=None, events=()):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": secrets.token_hex(8),
+            "name": name,
+            "kind": _SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(max(start, end)),
+            "attributes": _attributes(attributes or {}),
+        }
+        if parent is not None:
+            span["parentSpanId"] = parent
+        if events:
+            span["events"] = [
+                {"timeUnixNano": str(ts), "name": event} for event, ts in events
+            ]
+        return span
+
+    def _spans(self, marks, start, end, outcome):
+        root = self._span(
+            "turn",
+            start,
+            end,
+            attributes={
+                "session.id": self.session_id,
+                "turn.index": self.turn_index,
+                "turn.outcome": outcome,
+            },
+            events=sorted(marks.items(), key=lambda item: item[1]),
+        )
+        spans = [root]
+        parent = root["spanId"]
+        for name, start_marks, end_mark in _PHASES:
+            phase_start = next((marks[m] for m in start_marks if m in marks), None)
+            phase_end = marks.get(end_mark)
+            if phase_start is not None and phase_end is not None:
+                spans.append(self._span(name, phase_start, phase_end, parent))
+        if MODEL_AUDIO in marks:
+            spans.append(self._span("model.response", marks[MODEL_AUDIO], end, parent))
+        for tool, call_id, tool_start, tool_end in self.tool_spans:
+            spans.append(
+                self._span(
+                    f"tool.{tool}",
+                    tool_start,
+                    tool_end,
+                    parent,
+                    {"tool.name": tool, "tool.call_id": call_id or ""},
+                )
+            )
+        return spans
+
+    def close(self):
+        """End a turn left open by a disconnect, if anything happened in it."""
+        marks = self.marks
+        if (
+            self.tool_spans
+            or END_OF_SPEECH in marks
+            or not _MODEL_MARKS.isdisjoint(marks)
+        ):
+            self._finish(marks, time.time_ns(), "disconnected")
+        self.marks = {}
+        self.next_marks = {}
+
+    def summary(self):
+        """Return per-session latency stats over the finished turns."""
+        first_audio = [t["first_audio"] for t in self.turns if "first_audio" in t]
+        tools = [t["tools"] for t in self.turns if "tools" in t]
+        summary = {
+            "turns": len(self.turns),
+            "interrupted": sum(t["outcome"] == "interrupted" for t in self.turns),
+        }
+        if first_audio:
+            summary["first_audio_p50"] = statistics.median(first_audio)
+            summary["first_audio_max"] = max(first_audio)
+        if tools:
+            summary["tool_seconds"] = sum(tools)
+        return summary
+
+
+class SpanExporter:
+    """Batch spans on a background thread and write them as OTLP/JSON."""
+
+    def __init__(
+        self,
+        target,
+        service_name="gemini-live-audio-server",
+        max_queue=4096,
+        interval=1.0,
+        resource=None,
+    ):
+        """
+        Args:
+            target: file path to append to, or an ``http(s)://`` OTLP/HTTP
+                traces endpoint such as ``http://localhost:4318/v1/traces``
+            service_name: ``service.name`` resource attribute
+            max_queue: spans buffered before new ones are dropped
+            interval: seconds between batches
+            resource: extra resource attributes
+        """
+        self.target = target
+        self.is_http = target.startswith(("http://", "https://"))
+        self.interval = interval
+        self.resource = _attributes({"service.name": service_name, **(resource or {})})
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, spans):
+        """Queue spans for export; never blocks the caller."""
+        for span in spans:
+            try:
+                self.queue.put_nowait(span)
+            except queue.Full:
+                spans_dropped.inc()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        spans = self._drain()
+        if not spans:
+            return
+        body = json.dumps(
+            {
+                "resourceSpans": [
+                    {
+                        "resource": {"attributes": self.resource},
+                        "scopeSpans": [
+                            {"scope": {"name": "turn-tracing"}, "spans": spans}
+                        ],
+                    }
+                ]
+            },
+            separators=(",", ":"),
+        )
+        try:
+            if self.is_http:
+                request = urllib.request.Request(
+                    self.target,
+                    data=body.encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            else:
+                with open(self.target, "a") as f:
+                    f.write(body + "\n")
+        except Exception as e:
+            logger.warning("Failed to export %d spans: %s", len(spans), e)
+
+    def close(self):
+        """Flush queued spans and stop the export thread."""
+        self._stopped.set()
+        self._thread.join()
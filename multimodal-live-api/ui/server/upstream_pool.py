@@ -0,0 +1,252 @@
+"""
+Pool of pre-connected upstream Live sessions.
+
+Opening a Live session costs a TLS handshake plus session setup, which the
+user used to wait through after the browser connected. ``UpstreamSessionPool``
+keeps sessions connected and configured ahead of time so a new client can
+lease one immediately while the pool refills in the background.
+
+Each pooled session is owned by a holder task that enters the backend's
+``connect()`` context, parks the session in the pool and exits the context
+(closing the connection) from that same task once the lease ends or the
+session is recycled. The pool size follows demand: by Little's law, the
+sessions needed to absorb arrivals while replacements connect is the arrival
+rate times the connect time, scaled by ``headroom`` and clamped to
+``[min_size, max_size]``. Idle sessions are recycled after ``max_age``
+seconds, before the server would expire them, and dropped as soon as their
+connection closes so a lease never gets a dead session.
+"""
+
+import asyncio
+import collections
+import contextlib
+import logging
+import math
+import time
+
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+
+def _is_closed(session):
+    """Whether the session's connection is known to be closed."""
+    # google-genai's AsyncSession wraps a websockets connection in ``_ws``
+    connection = getattr(session, "_ws", session)
+    state = getattr(connection, "state", None)
+    if getattr(state, "name", None) in ("CLOSING", "CLOSED"):
+        return True
+    return getattr(connection, "closed", False) is True
+
+
+def _wait_closed(session):
+    """Awaitable finishing when the session's connection closes, or None."""
+    wait_closed = getattr(session, "wait_closed", None)
+    if wait_closed is None:
+        wait_closed = getattr(getattr(session, "_ws", None), "wait_closed", None)
+    return wait_closed() if wait_closed is not None else None
+
+
+class _PooledSession:
+    def __init__(self, session):
+        self.session = session
+        self.created = time.monotonic()
+        self.released = asyncio.Event()
+        self.leased = False
+
+
+class UpstreamSessionPool:
+    """Keep upstream sessions warm and hand them out on demand."""
+
+    def __init__(
+        self,
+        open_session,
+        min_size=1,
+        max_size=8,
+        max_age=300.0,
+        headroom=2.0,
+        rate_window=60.0,
+    ):
+        """
+        Args:
+            open_session: zero-argument callable returning an async context
+                manager that yields a connected session
+            min_size: sessions kept warm even with no traffic
+            max_size: upper bound on warm sessions (excluding leased ones)
+            max_age: seconds an idle pooled session is kept before recycling
+            headroom: multiplier on the Little's-law pool size estimate
+            rate_window: seconds of arrivals used to estimate the arrival rate
+        """
+        self.open_session = open_session
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.headroom = headroom
+        self.rate_window = rate_window
+
+        self.ready = collections.deque()  # Idle warm sessions, oldest first
+        self.opening = 0  # Holder tasks still connecting
+        self.arrivals = collections.deque()  # Lease timestamps within the window
+        self.connect_time = 1.0  # EWMA of upstream connect seconds
+        self.failures = 0  # Consecutive connect failures
+        self.backoff_until = 0.0
+        self._tasks = set()
+        self._maintainer = None
+        self._closed = False
+        self.started = time.monotonic()
+
+        self.hits = counter("upstream_pool_hits_total", "Leases served warm")
+        self.misses = counter(
+            "upstream_pool_misses_total", "Leases that had to connect inline"
+        )
+        self.recycled = counter(
+            "upstream_pool_recycled_total", "Idle pooled sessions closed for age"
+        )
+        self.dropped = counter(
+            "upstream_pool_dropped_total",
+            "Idle pooled sessions dropped because their connection closed",
+        )
+        self.connect_failures = counter(
+            "upstream_pool_connect_failures_total", "Failed warm connects"
+        )
+        self.connect_seconds = histogram(
+            "upstream_connect_seconds", "Upstream session connect time"
+        )
+
+    def arrival_rate(self):
+        now = time.monotonic()
+        while self.arrivals and self.arrivals[0] < now - self.rate_window:
+            self.arrivals.popleft()
+        # Until a full window has passed, divide by the time observed so far
+        window = min(self.rate_window, max(1.0, now - self.started))
+        return len(self.arrivals) / window
+
+    def target_size(self):
+        """Warm sessions to keep for the current arrival rate."""
+        wanted = math.ceil(self.arrival_rate() * self.connect_time * self.headroom)
+        return max(self.min_size, min(self.max_size, wanted))
+
+    def _refill(self):
+        if self._closed or time.monotonic() < self.backoff_until:
+            return
+        for _ in range(self.target_size() - len(self.ready) - self.opening):
+            self.opening += 1
+            task = asyncio.ensure_future(self._hold())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _hold(self):
+        """Own one pooled session from connect until release or recycling."""
+        start = time.monotonic()
+        connected = False
+        try:
+            async with self.open_session() as session:
+                elapsed = time.monotonic() - start
+                self.connect_seconds.observe(elapsed)
+                self.connect_time = 0.8 * self.connect_time + 0.2 * elapsed
+                self.failures = 0
+                connected = True
+                self.opening -= 1
+                pooled = _PooledSession(session)
+                self.ready.append(pooled)
+                await self._idle(pooled)
+                await pooled.released.wait()
+        except Exception as e:
+            if connected:
+                logger.warning("Error closing pooled upstream session: %s", e)
+                return
+            self.connect_failures.inc()
+            self.failures += 1
+            self.backoff_until = time.monotonic() + min(30.0, 2.0**self.failures)
+            logger.warning("Warm upstream connect failed: %s", e)
+        finally:
+            if not connected:
+                self.opening -= 1
+
+    async def _idle(self, pooled):
+        """Wait while a session sits in the pool; drop it if it closes there."""
+        closed = _wait_closed(pooled.session)
+        if closed is None:
+            return
+        closed = asyncio.ensure_future(closed)
+        released = asyncio.ensure_future(pooled.released.wait())
+        try:
+            await asyncio.wait([closed, released], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closed.cancel()
+            released.cancel()
+        if not pooled.leased and not pooled.released.is_set():
+            self.ready.remove(pooled)
+            self.dropped.inc()
+            pooled.released.set()
+
+    def _take(self):
+        """Pop the newest usable warm session, recycling stale or closed ones."""
+        while self.ready:
+            pooled = self.ready.pop()
+            if _is_closed(pooled.session):
+                self.dropped.inc()
+            elif time.monotonic() - pooled.created < self.max_age:
+                pooled.leased = True
+                return pooled
+            else:
+                self.recycled.inc()
+            pooled.released.set()
+        return None
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        """Yield a connected session: warm if available, else connected inline."""
+        self.arrivals.append(time.monotonic())
+        pooled = self._take()
+        self._refill()
+        if pooled is None:
+            self.misses.inc()
+            start = time.monotonic()
+            async with self.open_session() as session:
+                self.connect_seconds.observe(time.monotonic() - start)
+                yield session
+            return
+
+        self.hits.inc()
+        try:
+            yield pooled.session
+        finally:
+            pooled.released.set()  # The holder task closes the connection
+
+    async def _maintain(self, interval):
+        while not self._closed:
+            now = time.monotonic()
+            # Oldest sessions sit at the left; recycle them before they expire
+            while self.ready and now - self.ready[0].created >= self.max_age:
+                self.recycled.inc()
+                self.ready.popleft().released.set()
+            # Shrink toward the target when demand drops
+            while len(self.ready) > self.target_size():
+                self.ready.popleft().released.set()
+            self._refill()
+            await asyncio.sleep(interval)
+
+    async def start(self, interval=1.0):
+        self._maintainer = asyncio.ensure_future(self._maintain(interval))
+
+    async def close(self):
+        self._closed = True
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+        while self.ready:
+            self.ready.popleft().released.set()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "ready": len(self.ready),
+            "opening": self.opening,
+            "target": self.target_size(),
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "recycled": self.recycled.value,
+            "dropped": self.dropped.value,
+        }
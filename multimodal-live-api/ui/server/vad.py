@@ -0,0 +1,154 @@
+"""
+Server-side voice activity detection for client audio.
+
+Incoming 16-bit PCM is cut into short analysis frames; energy and
+zero-crossing rate are computed for all frames of a chunk at once with
+NumPy, and an adaptive noise floor decides which frames are speech.
+Speech frames are forwarded upstream together with a pre-roll of the
+frames just before each onset (so onsets aren't clipped) and a hangover of
+trailing silence (so the model's own end-of-speech detection still sees the
+pause it needs). Longer silence is dropped, or thinned to every Nth frame.
+"""
+
+import numpy as np
+
+from metrics import counter
+
+vad_bytes_in = counter("vad_bytes_in_total", "Client audio bytes seen by the VAD")
+vad_bytes_forwarded = counter(
+    "vad_bytes_forwarded_total", "Client audio bytes forwarded upstream by the VAD"
+)
+
+_NO_FRAME = -(2**62)
+
+
+class VoiceActivityDetector:
+    """Energy/zero-crossing VAD that gates silent audio, one per session."""
+
+    def __init__(
+        self,
+        sample_rate,
+        frame_ms=20,
+        threshold_db=-50.0,
+        noise_margin_db=10.0,
+        max_zcr=0.35,
+        preroll_ms=300,
+        hangover_ms=1000,
+        thin_every=0,
+    ):
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.frame_bytes = self.frame_samples * 2
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.max_zcr = max_zcr
+        self.preroll_frames = preroll_ms // frame_ms
+        self.hangover_frames = hangover_ms // frame_ms
+        self.thin_every = thin_every  # Forward every Nth silent frame, 0 drops all
+
+        self.noise_floor_db = -60.0
+        self._remainder = b""
+        self._held = b""  # Recent gated-out frames, replayed as pre-roll
+        self._frame_index = 0
+        self._last_speech = _NO_FRAME
+
+        # Per-session stats
+        self.bytes_in = 0
+        self.bytes_forwarded = 0
+        self.speech_frames = 0
+
+    @property
+    def in_speech(self):
+        """True while inside a speech segment or its hangover."""
+        return self._frame_index - 1 - self._last_speech <= self.hangover_frames
+
+    def classify(self, frames):
+        """Return a boolean speech decision for each row of ``frames``."""
+        x = frames.astype(np.float32)
+        power = np.mean(x * x, axis=1) / (32768.0 * 32768.0)
+        level_db = 10.0 * np.log10(power + 1e-12)
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (
+            frames.shape[1] - 1
+        )
+
+        threshold = max(self.threshold_db, self.noise_floor_db + self.noise_margin_db)
+        # Loud frames count as speech even with a high zero-crossing rate
+        # (fricatives); quiet noisy frames don't.
+        speech = (level_db > threshold) & (
+            (zcr < self.max_zcr) | (level_db > threshold + 15.0)
+        )
+
+        quiet = level_db[~speech]
+        if quiet.size:
+            self.noise_floor_db += 0.1 * (float(np.median(quiet)) - self.noise_floor_db)
+            self.noise_floor_db = min(self.noise_floor_db, -20.0)
+        return speech
+
+    def process(self, pcm):
+        """
+        Gate a chunk of PCM.
+
+        Returns ``(audio_to_forward, speech_detected)``, where audio may be
+        empty and ``speech_detected`` is True if the chunk contained speech.
+        """
+        self.bytes_in += len(pcm)
+        vad_bytes_in.inc(len(pcm))
+
+        data = self._remainder + pcm
+        n = len(data) // self.frame_bytes
+        usable = n * self.frame_bytes
+        self._remainder = data[usable:]
+        if n == 0:
+            return b"", False
+
+        frames = np.frombuffer(data, dtype="<i2", count=n * self.frame_samples)
+        frames = frames.reshape(n, self.frame_samples)
+        speech = self.classify(frames)
+        index = np.arange(self._frame_index, self._frame_index + n)
+
+        # Most recent speech frame at or before each frame, carried across chunks
+        last_speech = np.maximum.accumulate(np.where(speech, index, _NO_FRAME))
+        last_speech = np.maximum(last_speech, self._last_speech)
+        active = index - last_speech <= self.hangover_frames
+
+        # Next speech frame at or after each frame, for pre-roll within the chunk
+        next_speech = np.minimum.accumulate(np.where(speech, index, -_NO_FRAME)[::-1])[
+            ::-1
+        ]
+        forward = active | (next_speech - index <= self.preroll_frames)
+        if self.thin_every:
+            forward |= index % self.thin_every == 0
+
+        out = data[:usable]
+        if not forward.all():
+            keep = np.repeat(forward, self.frame_bytes)
+            out = np.frombuffer(out, dtype=np.uint8)[keep].tobytes()
+
+        # An onset near the start of the chunk takes its pre-roll from frames
+        # held back from previous chunks
+        if speech.any() and not self.in_speech:
+            missing = self.preroll_frames - int(np.argmax(speech))
+            if missing > 0 and self._held:
+                out = self._held[-missing * self.frame_bytes :] + out
+        self._held = self._update_held(data[:usable], forward, n)
+
+        self._frame_index += n
+        self._last_speech = int(last_speech[-1])
+        speech_frames = int(np.count_nonzero(speech))
+        self.speech_frames += speech_frames
+        self.bytes_forwarded += len(out)
+        vad_bytes_forwarded.inc(len(out))
+        return out, speech_frames > 0
+
+    def _update_held(self, data, forward, n):
+        """Keep up to a pre-roll's worth of trailing gated-out frames."""
+        if forward[-1]:
+            return b""
+        # Trailing run of frames that were not forwarded
+        forwarded = np.flatnonzero(forward)
+        start = int(forwarded[-1]) + 1 if forwarded.size else 0
+        start = max(start, n - self.preroll_frames)
+        tail = data[start * self.frame_bytes :]
+        if start == 0:
+            tail = self._held + tail
+        return tail[-self.preroll_frames * self.frame_bytes :]
@@ -0,0 +1,194 @@
+"""
+Multi-process worker mode.
+
+``Supervisor`` starts N worker processes that each run a full server event
+loop bound to the same port with SO_REUSEPORT, so the kernel spreads new
+connections across cores. The supervisor restarts workers that crash (with
+backoff when one keeps failing), and on SIGINT/SIGTERM forwards SIGTERM so
+every worker stops accepting, lets its sessions drain, and exits; workers
+still running after the drain timeout are killed.
+
+Workers push dumps of their metrics registry to the supervisor over a
+queue; the supervisor sums them into one view of the whole box and can
+serve that view on a Prometheus endpoint.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from metrics import REGISTRY, merge, serve_metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def report_stats(stats_queue, index, interval=5.0):
+    """Worker side: send this process's metrics dump every ``interval``."""
+    while True:
+        try:
+            stats_queue.put_nowait((index, os.getpid(), REGISTRY.collect()))
+        except queue.Full:
+            pass  # Supervisor is behind; the next snapshot supersedes this one
+        await asyncio.sleep(interval)
+
+
+class Supervisor:
+    """Run, restart and drain a fixed number of worker processes."""
+
+    def __init__(
+        self,
+        target,
+        args=(),
+        workers=2,
+        drain_timeout=30.0,
+        stats_log_interval=60.0,
+        metrics_address=None,
+    ):
+        """
+        Args:
+            target: picklable ``target(*args, index, stats_queue)`` run in each
+                worker; it must bind with SO_REUSEPORT and drain on SIGTERM
+            args: leading arguments for ``target``
+            workers: number of worker processes
+            drain_timeout: seconds workers get to finish sessions on shutdown
+            stats_log_interval: seconds between aggregated stats log lines
+            metrics_address: optional (host, port) to serve merged metrics on
+        """
+        self.target = target
+        self.args = tuple(args)
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.stats_log_interval = stats_log_interval
+        self.metrics_address = metrics_address
+        self.context = multiprocessing.get_context("spawn")
+        self.stats_queue = self.context.Queue(maxsize=workers * 16)
+        self.processes = {}  # index -> Process
+        self.crashes = {}  # index -> consecutive crash count
+        self.started_at = {}  # index -> monotonic start time
+        self.restart_at = {}  # index -> monotonic time to restart
+        self.worker_stats = {}  # index -> latest metrics snapshot
+        self.restarts = 0
+        self.stopping = False
+
+    def _spawn(self, index):
+        process = self.context.Process(
+            target=self.target,
+            args=(*self.args, index, self.stats_queue),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info("Worker %d started (pid %d)", index, process.pid)
+
+    def _request_stop(self, signum, frame):
+        if not self.stopping:
+            logger.info("Supervisor received signal %s, draining workers", signum)
+        self.stopping = True
+
+    def _collect_stats(self, timeout):
+        try:
+            index, pid, snapshot = self.stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.worker_stats[index] = snapshot
+        while True:
+            try:
+                index, pid, snapshot = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.worker_stats[index] = snapshot
+
+    def stats(self):
+        """Merged metrics dump across all workers' latest snapshots."""
+        return merge(list(self.worker_stats.values()))
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index in range(self.workers):
+            process = self.processes.get(index)
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                process.join()
+                self.processes.pop(index)
+                self.worker_stats.pop(index, None)
+                # Back off on crash loops; a worker that ran a while starts over
+                if now - self.started_at[index] >= 60.0:
+                    self.crashes[index] = 0
+                if process.exitcode != 0:
+                    self.crashes[index] = self.crashes.get(index, 0) + 1
+                crashes = self.crashes.get(index, 0)
+                delay = min(30.0, 0.5 * 2 ** (crashes - 1)) if crashes else 0.0
+                logger.warning(
+                    "Worker %d (pid %d) exited with code %s; restarting in %.1fs",
+                    index,
+                    process.pid,
+                    process.exitcode,
+                    delay,
+                )
+                self.restart_at[index] = now + delay
+            if now >= self.restart_at.get(index, 0):
+                self.restart_at.pop(index, None)
+                self.restarts += 1
+                self._spawn(index)
+
+    def _log_stats(self):
+        sessions = sum(
+            value for name, _, _, _, value in self.stats() if name == "active_sessions"
+        )
+        alive = sum(process.is_alive() for process in self.processes.values())
+        logger.info(
+            "Supervisor: %d/%d workers up, %d active sessions, %d restarts",
+            alive,
+            self.workers,
+            sessions,
+            self.restarts,
+        )
+
+    def _drain(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: stop accepting, drain sessions
+        deadline = time.monotonic() + self.drain_timeout + 5.0
+        for process in self.processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        for index, process in self.processes.items():
+            if process.is_alive():
+                logger.warning("Worker %d did not drain in time; killing", index)
+                process.kill()
+                process.join()
+
+    def run(self):
+        """Start the workers and supervise them until SIGINT/SIGTERM."""
+        previous = {
+            sig: signal.signal(sig, self._request_stop)
+            for sig in (signal.SIGINT, signal.SIGTERM)
+        }
+        metrics_server = None
+        try:
+            if self.metrics_address is not None:
+                metrics_server = serve_metrics(*self.metrics_address, self.stats)
+            for index in range(self.workers):
+                self._spawn(index)
+            last_log = time.monotonic()
+            while not self.stopping:
+                self._collect_stats(timeout=0.5)
+                if self.stopping:
+                    break
+                self._check_workers()
+                if time.monotonic() - last_log >= self.stats_log_interval:
+                    self._log_stats()
+                    last_log = time.monotonic()
+            self._drain()
+            self._collect_stats(timeout=0.1)
+            self._log_stats()
+        finally:
+            if metrics_server is not None:
+                metrics_server.shutdown()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)